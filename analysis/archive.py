@@ -0,0 +1,149 @@
+"""
+Seekable archive of an experiment.
+
+The archives collected by the bench phase (`<host>-kolla-logs.tar.gz`,
+`<host>-kolla-conf.tar.gz`, `<host>-influxdb.tar.gz`, `<host>-rally.tar.gz`)
+and the files of the result directory are gathered in a single zip file,
+each file of the tar archives becoming a member compressed on its own
+(`<host>/<kind>/<path>`). One file is read without decompressing the rest.
+
+The `manifest.json` member describes every member: host, kind, path, size,
+sha256 and the time range of the dated lines of text files.
+"""
+import calendar
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+from execo_engine import logger
+
+ARCHIVE_NAME = 'experiment.zip'
+MANIFEST = 'manifest.json'
+
+# Kind of the archives collected by the bench role
+KINDS = ['kolla-logs', 'kolla-conf', 'influxdb', 'rally']
+# Files of the result directory
+RESULT_KIND = 'result'
+
+CHUNK_SIZE = 1 << 20
+# Dates are looked for in this many bytes at the start and the end of a file
+DATE_SCAN = 1 << 16
+# 2016-11-02 12:34:56 or 2016-11-02T12:34:56
+DATE = re.compile(r'(\d{4})-(\d\d)-(\d\d)[ T](\d\d):(\d\d):(\d\d)')
+
+
+def _dates(data):
+    return [calendar.timegm(tuple(int(x) for x in m.groups()))
+            for m in DATE.finditer(data)]
+
+
+def time_range(path):
+    """(first, last) dates found in the head and the tail of a file, or None."""
+    with open(path, 'rb') as f:
+        head = f.read(DATE_SCAN)
+        if '\0' in head:
+            # Not a text file
+            return None
+        f.seek(max(os.path.getsize(path) - DATE_SCAN, 0))
+        tail = f.read(DATE_SCAN)
+    head_dates = _dates(head)
+    tail_dates = _dates(tail)
+    if not head_dates:
+        return None
+    return [head_dates[0], (tail_dates or head_dates)[-1]]
+
+
+def _entry(host, kind, path, name, file_path):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            sha256.update(chunk)
+    return {
+        'host': host,
+        'kind': kind,
+        'path': path,
+        'name': name,
+        'size': os.path.getsize(file_path),
+        'sha256': sha256.hexdigest(),
+        'time_range': time_range(file_path)
+    }
+
+
+def sources(result_dir):
+    """Returns the (host, kind, tar archive path) of the collected archives."""
+    archives = []
+    for kind in KINDS:
+        suffix = '-%s.tar.gz' % kind
+        for archive_path in sorted(glob.glob(os.path.join(result_dir, '*' + suffix))):
+            archives.append((os.path.basename(archive_path)[:-len(suffix)], kind, archive_path))
+    return archives
+
+
+def build(result_dir, archive_path=None):
+    """
+    Writes the archive of result_dir (result_dir/experiment.zip by default).
+    Returns the manifest.
+    """
+    if archive_path is None:
+        archive_path = os.path.join(result_dir, ARCHIVE_NAME)
+    archives = sources(result_dir)
+    collected = set(path for _, _, path in archives)
+    manifest = []
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(archive_path + '.tmp', 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+            # The files of the tar archives are copied one at a time
+            for host, kind, tar_path in archives:
+                logger.info("Archiving %s" % tar_path)
+                with tarfile.open(tar_path, 'r:gz') as archive:
+                    for member in archive:
+                        if not member.isfile():
+                            continue
+                        tmp_path = os.path.join(tmp_dir, 'member')
+                        with open(tmp_path, 'wb') as f:
+                            shutil.copyfileobj(archive.extractfile(member), f, CHUNK_SIZE)
+                        path = member.name.lstrip('/')
+                        name = '/'.join([host, kind, path])
+                        manifest.append(_entry(host, kind, path, name, tmp_path))
+                        zf.write(tmp_path, name)
+            for file_name in sorted(os.listdir(result_dir)):
+                file_path = os.path.join(result_dir, file_name)
+                if not os.path.isfile(file_path) or file_path in collected \
+                   or file_name.startswith(ARCHIVE_NAME):
+                    continue
+                name = '/'.join([RESULT_KIND, file_name])
+                manifest.append(_entry('', RESULT_KIND, file_name, name, file_path))
+                zf.write(file_path, name)
+            zf.writestr(MANIFEST, json.dumps(manifest, indent=1))
+    finally:
+        shutil.rmtree(tmp_dir)
+    os.rename(archive_path + '.tmp', archive_path)
+    logger.info("%d files archived in %s" % (len(manifest), archive_path))
+    return manifest
+
+
+def read_manifest(archive_path):
+    with zipfile.ZipFile(archive_path) as zf:
+        return json.loads(zf.read(MANIFEST))
+
+
+def find(manifest, host=None, kind=None, path=None):
+    """Entries of the manifest matching the host, the kind and a path regexp."""
+    pattern = re.compile(path) if path is not None else None
+    return [e for e in manifest
+            if (host is None or e['host'] == host)
+            and (kind is None or e['kind'] == kind)
+            and (pattern is None or pattern.search(e['path']))]
+
+
+def copy_member(archive_path, name, output):
+    """Writes the member name of the archive in the output file object."""
+    with zipfile.ZipFile(archive_path) as zf:
+        with zf.open(name) as member:
+            shutil.copyfileobj(member, output, CHUNK_SIZE)
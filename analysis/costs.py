@@ -0,0 +1,245 @@
+"""
+Resource cost of the rally scenarios and of their atomic actions.
+
+The iterations of each scenario come from the results of the rally tasks
+(`results-<uuid>.json` in the rally archive, see the bench role), the
+metrics from influx (cadvisor and collectd databases), either live or
+restored in the results VM.
+
+The metrics are fetched once per scenario in buckets of `step` seconds.
+Each bucket of a counter (cpu, network) is shared between the atomic
+actions running during the bucket, in proportion to their time in it; the
+gauges (memory, connections) are averaged over the buckets weighted the
+same way. Iterations run concurrently, so the share of an action is a
+fraction of the whole service usage and not a measure of the action alone.
+"""
+from collections import OrderedDict
+import csv
+import glob
+import json
+import os
+import tarfile
+
+from execo_engine import logger
+
+from analysis.logs import RALLY_SUFFIX
+
+RESULTS_PREFIX = 'results-'
+COSTS_NAME = 'costs.csv'
+
+# Whole iterations, next to their atomic actions
+ITERATION = 'iteration'
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+
+# name, database, query, kind, scale. The queries return a value per
+# bucket and per service tag: container_name (cadvisor) or instance (the
+# port of collectd tcpconns). The counters are cumulative, their increase
+# during each bucket is the derivative over the bucket.
+METRICS = [
+    ('cpu_s', 'cadvisor',
+     "SELECT non_negative_derivative(max(value), %(step)ds) FROM cpu_usage_total "
+     "WHERE %(where)s GROUP BY time(%(step)ds), container_name, machine",
+     COUNTER, 1e-9),
+    ('rx_mib', 'cadvisor',
+     "SELECT non_negative_derivative(max(value), %(step)ds) FROM rx_bytes "
+     "WHERE %(where)s GROUP BY time(%(step)ds), container_name, machine",
+     COUNTER, 2 ** -20),
+    ('tx_mib', 'cadvisor',
+     "SELECT non_negative_derivative(max(value), %(step)ds) FROM tx_bytes "
+     "WHERE %(where)s GROUP BY time(%(step)ds), container_name, machine",
+     COUNTER, 2 ** -20),
+    ('memory_mib', 'cadvisor',
+     "SELECT mean(value) FROM memory_usage "
+     "WHERE %(where)s GROUP BY time(%(step)ds), container_name, machine",
+     GAUGE, 2 ** -20),
+    ('connections', 'collectd',
+     "SELECT mean(value) FROM tcpconns_value "
+     "WHERE type_instance = 'ESTABLISHED' AND %(where)s GROUP BY time(%(step)ds), instance, host",
+     GAUGE, 1),
+]
+
+# Services listening on the ports watched by collectd tcpconns
+PORTS = {
+    '3306': 'mariadb',
+    '5000': 'keystone',
+    '35357': 'keystone',
+    '5672': 'rabbitmq',
+    '15672': 'rabbitmq',
+    '8774': 'nova',
+    '9292': 'glance',
+    '9696': 'neutron',
+    '11211': 'memcached',
+}
+
+COLUMNS = ['scenario', 'action', 'service', 'count'] + [m[0] for m in METRICS]
+
+
+def service(tags):
+    """
+    Service of a series: the prefix of the container (nova_api -> nova) or
+    the service of the port of a connection (3306-local -> mariadb).
+    """
+    if 'container_name' in tags:
+        return tags['container_name'].split('_')[0] or None
+    port = tags.get('instance', '').split('-')[0]
+    return PORTS.get(port)
+
+
+def read_iterations(result_dir):
+    """
+    Reads the iterations of the scenarios from the rally archives, the
+    iterations of the rally hosts are put together.
+    Returns a list of (scenario, iterations), an iteration being its start,
+    its duration and the (name, duration) of its atomic actions in order.
+    """
+    scenarios = OrderedDict()
+    for archive_path in glob.glob(os.path.join(result_dir, '*' + RALLY_SUFFIX)):
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            for member in archive.getmembers():
+                name = os.path.basename(member.name)
+                if not (name.startswith(RESULTS_PREFIX) and name.endswith('.json')):
+                    continue
+                results = json.load(archive.extractfile(member),
+                                    object_pairs_hook=OrderedDict)
+                for result in results:
+                    iterations = [(i['timestamp'], i['duration'],
+                                   i['atomic_actions'].items())
+                                  for i in result['result'] if not i['error']]
+                    scenarios.setdefault(result['key']['name'], []).extend(iterations)
+    return scenarios.items()
+
+
+def action_windows(iterations):
+    """
+    Returns the (start, end) windows of each atomic action, the actions
+    of an iteration run one after the other from its start.
+    """
+    windows = OrderedDict([(ITERATION, [])])
+    for start, duration, actions in iterations:
+        windows[ITERATION].append((start, start + duration))
+        date = start
+        for name, action_duration in actions:
+            windows.setdefault(name, []).append((date, date + action_duration))
+            date += action_duration
+    return windows
+
+
+def overlaps(windows, t0, step, nb_buckets):
+    "Seconds spent in the windows during each bucket."
+    seconds = [0.0] * nb_buckets
+    for start, end in windows:
+        first = max(int((start - t0) // step), 0)
+        last = min(int((end - t0) // step), nb_buckets - 1)
+        for b in range(first, last + 1):
+            bucket_start = t0 + b * step
+            seconds[b] += max(0.0, min(end, bucket_start + step) - max(start, bucket_start))
+    return seconds
+
+
+def shares(windows, t0, step, nb_buckets):
+    """
+    Share of each bucket given to each action. The atomic actions split
+    the buckets in proportion of their time in them, the iterations get
+    the whole buckets they cover.
+    """
+    seconds = dict((action, overlaps(w, t0, step, nb_buckets))
+                   for action, w in windows.items())
+    busy = [sum(seconds[a][b] for a in seconds if a != ITERATION)
+            for b in range(nb_buckets)]
+    result = {}
+    for action, s in seconds.items():
+        if action == ITERATION:
+            result[action] = [min(1.0, x / step) for x in s]
+        else:
+            result[action] = [x / busy[b] if busy[b] > 0 else 0.0
+                              for b, x in enumerate(s)]
+    return result
+
+
+def query(url, database, q):
+    "Returns the series of an influx query."
+    import requests
+    response = requests.get(url + '/query',
+                            params={'db': database, 'q': q, 'epoch': 's'})
+    response.raise_for_status()
+    result = response.json()['results'][0]
+    if 'error' in result:
+        raise Exception("%s: %s" % (q, result['error']))
+    return result.get('series', [])
+
+
+def fetch(url, t0, step, nb_buckets):
+    """
+    Returns the buckets of each metric and service between t0 and the end
+    of the last bucket: {metric: {service: [values]}}.
+    """
+    # One more bucket before t0 for the derivative of the first one
+    where = "time >= %ds AND time < %ds" % (t0 - step, t0 + step * nb_buckets)
+    metrics = {}
+    for name, database, q, kind, scale in METRICS:
+        buckets = metrics.setdefault(name, {})
+        for series in query(url, database, q % {'where': where, 'step': step}):
+            s = service(series.get('tags', {}))
+            if s is None:
+                continue
+            values = buckets.setdefault(s, [0.0] * nb_buckets)
+            for date, value in series['values']:
+                b = int((date - t0) // step)
+                if value is not None and 0 <= b < nb_buckets:
+                    # Hosts and containers of a service add up
+                    values[b] += value * scale
+    return metrics
+
+
+def costs(scenario, windows, metrics, t0, step, nb_buckets):
+    """
+    Returns a row per action and service: the counters per execution of the
+    action and the mean of the gauges while it runs.
+    """
+    kinds = dict((m[0], m[3]) for m in METRICS)
+    action_shares = shares(windows, t0, step, nb_buckets)
+    services = sorted(set(s for buckets in metrics.values() for s in buckets))
+    rows = []
+    for action, share in action_shares.items():
+        count = len(windows[action])
+        weight = sum(share)
+        for s in services:
+            row = [scenario, action, s, count]
+            for name, _, _, _, _ in METRICS:
+                values = metrics[name].get(s, [0.0] * nb_buckets)
+                total = sum(v * w for v, w in zip(values, share))
+                if kinds[name] == COUNTER:
+                    row.append(total / count if count else 0.0)
+                else:
+                    row.append(total / weight if weight else 0.0)
+            rows.append(row)
+    return rows
+
+
+def report(url, result_dir, step=10):
+    """
+    Computes the costs of the scenarios of result_dir with the metrics of
+    the influx at url. The rows are written in result_dir/costs.csv and
+    returned (see COLUMNS).
+    """
+    rows = []
+    for scenario, iterations in read_iterations(result_dir):
+        if iterations == []:
+            logger.warning("No successful iteration in %s" % scenario)
+            continue
+        windows = action_windows(iterations)
+        start = min(s for s, _ in windows[ITERATION])
+        end = max(e for _, e in windows[ITERATION])
+        t0 = int(start // step) * step
+        nb_buckets = int((end - t0) // step) + 1
+        logger.info("Fetching the metrics of %s" % scenario)
+        metrics = fetch(url, t0, step, nb_buckets)
+        rows.extend(costs(scenario, windows, metrics, t0, step, nb_buckets))
+
+    with open(os.path.join(result_dir, COSTS_NAME), 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(rows)
+    return rows
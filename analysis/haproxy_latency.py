@@ -0,0 +1,207 @@
+#! /usr/bin/env python
+"""Per-second latency histograms of the requests that went through haproxy.
+
+The haproxy logs are read directly from the kolla-logs archive collected
+by the bench phase, without extracting it on disk.
+
+Usage:
+  haproxy_latency.py show <HISTOGRAMS> [--backend=BACKEND]
+  haproxy_latency.py <ARCHIVE>... [-o OUTPUT]
+
+Options:
+  -h --help             Show this help message.
+  -o OUTPUT             Path of the histograms file [default: ./haproxy-latency.bin].
+  --backend=BACKEND     Only show the histograms of this backend.
+"""
+from docopt import docopt
+from bisect import bisect_left
+import calendar
+import gzip
+import re
+import struct
+import tarfile
+import time
+
+from execo_engine import logger
+
+# Log files of haproxy inside a kolla-logs archive (with rotations)
+HAPROXY_LOG = re.compile(r'haproxy/haproxy\.log(\.\d+)?$')
+
+# http log format:
+# ... [06/Feb/2009:12:14:14.655] frontend backend/server Tq/Tw/Tc/Tr/Tt status ...
+HTTP_LOG = re.compile(
+    r'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d)\.\d+\] \S+ ([^/ ]+)/\S+ '
+    r'(-?\d+)/(-?\d+)/(-?\d+)/(-?\d+)/\+?(-?\d+) ')
+# tcp log format (e.g. mariadb):
+# ... [06/Feb/2009:12:14:14.655] frontend backend/server Tw/Tc/Tt bytes ...
+TCP_LOG = re.compile(
+    r'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d)\.\d+\] \S+ ([^/ ]+)/\S+ '
+    r'(-?\d+)/(-?\d+)/\+?(-?\d+) ')
+
+TIMERS = ['Tq', 'Tw', 'Tc', 'Tr', 'Tt']
+
+# Upper bounds (ms) of the buckets of the histograms. The first bucket
+# counts the timers set to -1 by haproxy (step not reached), the last one
+# everything above the last bound.
+BUCKET_BOUNDS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+                 1000, 2000, 5000, 10000, 30000, 60000]
+NB_BUCKETS = len(BUCKET_BOUNDS) + 2
+
+MAGIC = 'HAPXLAT'
+VERSION = 1
+
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+
+def bucket(value):
+    "Index of the bucket of a timer value (ms)."
+    if value < 0:
+        return 0
+    return bisect_left(BUCKET_BOUNDS, value) + 1
+
+
+def parse_date(date):
+    "Converts an haproxy date (06/Feb/2009:12:14:14) to a timestamp."
+    return calendar.timegm((int(date[7:11]), MONTHS[date[3:6]], int(date[0:2]),
+                            int(date[12:14]), int(date[15:17]), int(date[18:20])))
+
+
+class LatencyHistograms(object):
+    """
+    Per second and per backend histograms of the haproxy timers.
+    """
+
+    def __init__(self):
+        self.histograms = {}
+        self.dates = {}
+        self.lines = 0
+        self.skipped = 0
+
+    def add_line(self, line):
+        m = HTTP_LOG.search(line)
+        if m is not None:
+            date, backend, tq, tw, tc, tr, tt = m.groups()
+        else:
+            m = TCP_LOG.search(line)
+            if m is None:
+                self.skipped += 1
+                return
+            date, backend, tw, tc, tt = m.groups()
+            tq = tr = '-1'
+        self.lines += 1
+
+        # many requests share the same second
+        second = self.dates.get(date)
+        if second is None:
+            second = self.dates[date] = parse_date(date)
+
+        key = (backend, second)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = [0] * (len(TIMERS) * NB_BUCKETS)
+        for i, value in enumerate((tq, tw, tc, tr, tt)):
+            histogram[i * NB_BUCKETS + bucket(int(value))] += 1
+
+    def add_file(self, f):
+        for line in f:
+            self.add_line(line)
+
+    def add_archive(self, archive_path):
+        """
+        Streams the haproxy logs of a kolla-logs archive.
+        The archive is read sequentially and never extracted.
+        """
+        with tarfile.open(archive_path, 'r|gz') as archive:
+            for member in archive:
+                if member.isfile() and HAPROXY_LOG.search(member.name):
+                    logger.info("Parsing %s from %s" % (member.name, archive_path))
+                    self.add_file(archive.extractfile(member))
+
+    def backends(self):
+        return sorted(set(backend for backend, _ in self.histograms))
+
+    def write(self, path):
+        """
+        Writes the histograms in a gzipped binary file:
+        - header: magic, version, number of timers, number of buckets,
+          the bucket bounds and the backend names
+        - one record per backend and second: backend index, timestamp and
+          the buckets of each timer (uint32)
+        """
+        backends = self.backends()
+        index = dict((b, i) for i, b in enumerate(backends))
+        record = struct.Struct('<HI%dI' % (len(TIMERS) * NB_BUCKETS))
+        with gzip.open(path, 'wb') as f:
+            f.write(struct.pack('<7sBBB', MAGIC, VERSION, len(TIMERS), NB_BUCKETS))
+            f.write(struct.pack('<%dI' % len(BUCKET_BOUNDS), *BUCKET_BOUNDS))
+            f.write(struct.pack('<H', len(backends)))
+            for backend in backends:
+                f.write(struct.pack('<H', len(backend)) + backend)
+            f.write(struct.pack('<I', len(self.histograms)))
+            for (backend, second) in sorted(self.histograms, key=lambda k: (k[1], k[0])):
+                f.write(record.pack(index[backend], second,
+                                    *self.histograms[(backend, second)]))
+
+        logger.info("%d requests, %d backends, %d histograms written to %s" %
+                    (self.lines, len(backends), len(self.histograms), path))
+
+
+def read_histograms(path):
+    """
+    Reads a file written by LatencyHistograms.write.
+    Returns a dict that maps (backend, second) to a dict that maps each
+    timer to its list of buckets
+    """
+    with gzip.open(path, 'rb') as f:
+        magic, version, nb_timers, nb_buckets = struct.unpack('<7sBBB', f.read(10))
+        if magic != MAGIC or version != VERSION:
+            raise Exception("%s is not an haproxy latency file" % path)
+        f.read(4 * (nb_buckets - 2))
+        nb_backends, = struct.unpack('<H', f.read(2))
+        backends = []
+        for _ in range(nb_backends):
+            length, = struct.unpack('<H', f.read(2))
+            backends.append(f.read(length))
+        nb_records, = struct.unpack('<I', f.read(4))
+        record = struct.Struct('<HI%dI' % (nb_timers * nb_buckets))
+        histograms = {}
+        for _ in range(nb_records):
+            values = record.unpack(f.read(record.size))
+            buckets = values[2:]
+            histograms[(backends[values[0]], values[1])] = dict(
+                (timer, list(buckets[i * nb_buckets:(i + 1) * nb_buckets]))
+                for i, timer in enumerate(TIMERS[:nb_timers]))
+        return histograms
+
+
+def show(path, backend=None):
+    "Prints the number of requests and the median bucket of Tt per second."
+    histograms = read_histograms(path)
+    labels = ['-1'] + ['<=%d' % b for b in BUCKET_BOUNDS] + ['>%d' % BUCKET_BOUNDS[-1]]
+    for (b, second), timers in sorted(histograms.items(), key=lambda i: (i[0][1], i[0][0])):
+        if backend is not None and b != backend:
+            continue
+        tt = timers['Tt']
+        total = sum(tt)
+        median, seen = 0, 0
+        for i, count in enumerate(tt):
+            seen += count
+            if seen * 2 >= total:
+                median = i
+                break
+        print("%s %-24s %6d requests  Tt median %s ms" % (
+            time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(second)),
+            b, total, labels[median]))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    if args['show']:
+        show(args['<HISTOGRAMS>'], args['--backend'])
+    else:
+        histograms = LatencyHistograms()
+        for archive in args['<ARCHIVE>']:
+            histograms.add_archive(archive)
+        histograms.write(args['-o'])
@@ -0,0 +1,304 @@
+"""
+Index of the kolla logs collected at the end of a bench.
+
+The archives are extracted once under `logs/<host>` of the result
+directory, then every log file is parsed by a pool of processes. The
+index is a sqlite database that holds:
+
+- the offsets of the lines of each request id
+- the duration of the API requests
+- the number of errors per minute and per service
+- the time window of each rally scenario
+"""
+import calendar
+import glob
+import multiprocessing
+import os
+import re
+import sqlite3
+import tarfile
+
+from execo_engine import logger
+
+INDEX_NAME = 'index.sqlite'
+KOLLA_LOGS_SUFFIX = '-kolla-logs.tar.gz'
+RALLY_SUFFIX = '-rally.tar.gz'
+# Written by rally/launch_scenarios.sh in the rally home directory
+SCENARIOS_LOG = 'scenarios.log'
+
+# Kind of logs, matching the files parsed by the heka decoders
+# (see results/templates/heka-*.toml.j2)
+LOG_FILES = [
+    ('keystone-apache', re.compile(r'keystone/(keystone-apache-.+)-access\.log\.?\d*$')),
+    ('mariadb', re.compile(r'(mariadb)/mariadb\.log\.?\d*$')),
+    ('rabbitmq', re.compile(r'rabbitmq/(rabbit.*)\.log\.?\d*$')),
+    ('openstack', re.compile(r'(?:cloudkitty|nova|glance|keystone|neutron|ceph|cinder|heat|murano|magnum|mistral|manila|senlin)/(.*)\.log\.?\d*$')),
+]
+
+REQUEST_ID = re.compile(r'req-[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+# 2016-11-02 12:34:56.306 3434 INFO nova.osapi_compute.wsgi.server [req-...] ...
+OPENSTACK_LINE = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\.\d+ \d+ ([A-Z]+) ')
+# ... "GET /v2.1/servers HTTP/1.1" status: 200 len: 1893 time: 0.1234567
+OPENSTACK_ACCESS = re.compile(r'"([A-Z]+) (\S+) HTTP/[\d.]+" status: (\d+) len: \d+ time: ([\d.]+)')
+# %{X-Forwarded-For}i %l %u %t "%r" %>s %b %D "%{Referer}i" "%{User-Agent}i"
+KEYSTONE_ACCESS = re.compile(r'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d) [^\]]*\] "([A-Z]+) (\S+) [^"]*" (\d+) \S+ (\d+)')
+# 161102 12:34:56 [ERROR] ...
+MARIADB_LINE = re.compile(r'(\d{6}) +(\d?\d:\d\d:\d\d) \[([A-Za-z]+)\]')
+# =ERROR REPORT==== 2-Nov-2016::12:34:56 ===
+RABBITMQ_LINE = re.compile(r'=([A-Z]+) REPORT==== (\d?\d-\w{3}-\d{4})::(\d\d:\d\d:\d\d) ===')
+
+ERROR_LEVELS = set(['ERROR', 'CRITICAL'])
+
+MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+     'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+SCHEMA = """
+CREATE TABLE files (id INTEGER PRIMARY KEY, host TEXT, path TEXT, kind TEXT, service TEXT);
+CREATE TABLE lines (request_id TEXT, file_id INTEGER, offset INTEGER);
+CREATE TABLE requests (request_id TEXT, file_id INTEGER, offset INTEGER, time INTEGER,
+                       service TEXT, method TEXT, url TEXT, status INTEGER, duration REAL);
+CREATE TABLE errors (minute INTEGER, host TEXT, service TEXT, count INTEGER);
+CREATE TABLE scenarios (name TEXT, start INTEGER, end INTEGER);
+"""
+
+INDEXES = """
+CREATE INDEX lines_request_id ON lines (request_id);
+CREATE INDEX requests_time ON requests (service, time);
+"""
+
+
+def classify(path):
+    """Returns the kind of log and the service of a file, or None."""
+    for kind, pattern in LOG_FILES:
+        m = pattern.search(path)
+        if m is not None:
+            return kind, m.group(1)
+    return None
+
+
+def _timestamp(year, month, day, clock):
+    h, m, s = clock.split(':')
+    return calendar.timegm((year, month, day, int(h), int(m), int(s)))
+
+
+def parse_log(args):
+    """
+    Parses a log file. Runs in the processes of the pool.
+    Returns (lines, requests, errors) where errors maps a minute to its
+    number of errors
+    """
+    file_id, path, kind = args
+    lines, requests, errors = [], [], {}
+    times = {}
+    offset = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            current, offset = offset, offset + len(line)
+            timestamp, error = None, False
+
+            if kind == 'openstack':
+                m = OPENSTACK_LINE.match(line)
+                if m is None:
+                    continue
+                date = m.group(1)
+                timestamp = times.get(date)
+                if timestamp is None:
+                    timestamp = times[date] = _timestamp(
+                        int(date[0:4]), int(date[5:7]), int(date[8:10]), date[11:])
+                error = m.group(2) in ERROR_LEVELS
+                request_id = REQUEST_ID.search(line)
+                if request_id is not None:
+                    request_id = request_id.group(0)
+                    lines.append((request_id, file_id, current))
+                    access = OPENSTACK_ACCESS.search(line)
+                    if access is not None:
+                        method, url, status, duration = access.groups()
+                        requests.append((request_id, file_id, current, timestamp,
+                                         method, url, int(status), float(duration)))
+            elif kind == 'keystone-apache':
+                m = KEYSTONE_ACCESS.search(line)
+                if m is None:
+                    continue
+                date, method, url, status, duration = m.groups()
+                timestamp = _timestamp(int(date[7:11]), MONTHS[date[3:6]],
+                                       int(date[0:2]), date[12:])
+                error = int(status) >= 500
+                # %D is in microseconds
+                requests.append((None, file_id, current, timestamp,
+                                 method, url, int(status), int(duration) / 1e6))
+            elif kind == 'mariadb':
+                m = MARIADB_LINE.match(line)
+                if m is None:
+                    continue
+                date, clock, level = m.groups()
+                timestamp = _timestamp(2000 + int(date[0:2]), int(date[2:4]),
+                                       int(date[4:6]), clock)
+                error = level.upper() in ERROR_LEVELS
+            elif kind == 'rabbitmq':
+                m = RABBITMQ_LINE.match(line)
+                if m is None:
+                    continue
+                level, date, clock = m.groups()
+                day, month, year = date.split('-')
+                timestamp = _timestamp(int(year), MONTHS[month], int(day), clock)
+                error = level in ERROR_LEVELS
+
+            if error:
+                minute = timestamp - timestamp % 60
+                errors[minute] = errors.get(minute, 0) + 1
+
+    return lines, requests, errors
+
+
+def _extract(args):
+    archive_path, destination = args
+    with tarfile.open(archive_path, 'r:gz') as archive:
+        archive.extractall(destination)
+    return archive_path
+
+
+def extract_archives(result_dir, logs_dir, pool):
+    """Extracts the kolla logs archives of each host in logs_dir/<host>."""
+    jobs = []
+    for archive_path in glob.glob(os.path.join(result_dir, '*' + KOLLA_LOGS_SUFFIX)):
+        host = os.path.basename(archive_path)[:-len(KOLLA_LOGS_SUFFIX)]
+        destination = os.path.join(logs_dir, host)
+        if not os.path.isdir(destination):
+            jobs.append((archive_path, destination))
+    for archive_path in pool.imap_unordered(_extract, jobs):
+        logger.info("Extracted %s" % archive_path)
+
+
+def read_scenarios(result_dir):
+    """
+    Reads the time window of the rally scenarios from the rally archives.
+    The rally hosts run the scenarios side by side: the overlapping windows
+    of a scenario are merged into one, from the first start to the last end.
+    """
+    windows = []
+    for archive_path in glob.glob(os.path.join(result_dir, '*' + RALLY_SUFFIX)):
+        with tarfile.open(archive_path, 'r:gz') as archive:
+            for member in archive.getmembers():
+                if os.path.basename(member.name) == SCENARIOS_LOG:
+                    for line in archive.extractfile(member):
+                        start, end, name = line.split(None, 2)
+                        windows.append((name.strip(), int(start), int(end)))
+    scenarios = []
+    for name, start, end in sorted(windows):
+        if scenarios and scenarios[-1][0] == name and start <= scenarios[-1][2]:
+            scenarios[-1] = (name, scenarios[-1][1], max(end, scenarios[-1][2]))
+        else:
+            scenarios.append((name, start, end))
+    return sorted(scenarios, key=lambda s: s[1])
+
+
+def build_index(result_dir, processes=None):
+    """
+    Extracts and indexes the kolla logs of result_dir.
+    The index is written in result_dir/logs/index.sqlite
+    """
+    logs_dir = os.path.join(result_dir, 'logs')
+    index_path = os.path.join(logs_dir, INDEX_NAME)
+    pool = multiprocessing.Pool(processes)
+    try:
+        extract_archives(result_dir, logs_dir, pool)
+
+        files = []
+        for host in sorted(os.listdir(logs_dir)):
+            host_dir = os.path.join(logs_dir, host)
+            if not os.path.isdir(host_dir):
+                continue
+            for root, _, names in os.walk(host_dir):
+                for name in names:
+                    path = os.path.join(root, name)
+                    kind_service = classify(path)
+                    if kind_service is not None:
+                        files.append((len(files) + 1, host, path) + kind_service)
+
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        db = sqlite3.connect(index_path)
+        db.executescript(SCHEMA)
+        db.executemany("INSERT INTO files VALUES (?, ?, ?, ?, ?)", files)
+        db.executemany("INSERT INTO scenarios VALUES (?, ?, ?)", read_scenarios(result_dir))
+
+        # biggest files first to balance the pool
+        jobs = sorted([(f[0], f[2], f[3]) for f in files],
+                      key=lambda j: -os.path.getsize(j[1]))
+        by_id = dict((f[0], f) for f in files)
+        for (file_id, _, _), (lines, requests, errors) in zip(
+                jobs, pool.imap(parse_log, jobs)):
+            _, host, path, _, service = by_id[file_id]
+            db.executemany("INSERT INTO lines VALUES (?, ?, ?)", lines)
+            db.executemany("INSERT INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [r[:4] + (service,) + r[4:] for r in requests])
+            db.executemany("INSERT INTO errors VALUES (?, ?, ?, ?)",
+                           [(minute, host, service, count) for minute, count in errors.items()])
+            logger.info("Indexed %s (%d request lines)" % (path, len(lines)))
+
+        db.executescript(INDEXES)
+        db.commit()
+        db.close()
+    finally:
+        pool.close()
+        pool.join()
+
+    logger.info("Logs index written to %s" % index_path)
+    return index_path
+
+
+def open_index(result_dir):
+    index_path = os.path.join(result_dir, 'logs', INDEX_NAME)
+    if not os.path.isfile(index_path):
+        raise Exception("No logs index in %s, run `logs index` first" % result_dir)
+    return sqlite3.connect(index_path)
+
+
+def scenario_window(db, scenario):
+    """Returns the (start, end) of the first scenario whose name matches."""
+    if scenario is None:
+        return None
+    row = db.execute("SELECT start, end FROM scenarios WHERE name LIKE ? ORDER BY start",
+                     ('%' + scenario + '%',)).fetchone()
+    if row is None:
+        raise Exception("No scenario matching %s" % scenario)
+    return row
+
+
+def slowest_requests(db, service, scenario=None, limit=10):
+    """Returns the slowest requests of a service (e.g. nova-api)."""
+    query = "SELECT time, duration, status, method, url, request_id FROM requests WHERE service LIKE ?"
+    params = ['%' + service + '%']
+    window = scenario_window(db, scenario)
+    if window is not None:
+        query += " AND time BETWEEN ? AND ?"
+        params.extend(window)
+    query += " ORDER BY duration DESC LIMIT ?"
+    params.append(limit)
+    return db.execute(query, params).fetchall()
+
+
+def errors_per_minute(db, scenario=None):
+    """Returns the number of errors per minute and per service."""
+    query = "SELECT minute, service, SUM(count) FROM errors"
+    params = []
+    window = scenario_window(db, scenario)
+    if window is not None:
+        query += " WHERE minute BETWEEN ? AND ?"
+        params.extend([window[0] - window[0] % 60, window[1]])
+    query += " GROUP BY minute, service ORDER BY minute, service"
+    return db.execute(query, params).fetchall()
+
+
+def request_lines(db, request_id):
+    """Returns the (host, path, line) of each log line of a request id."""
+    rows = db.execute("SELECT host, path, offset FROM lines JOIN files ON files.id = file_id "
+                      "WHERE request_id = ? ORDER BY path, offset", (request_id,)).fetchall()
+    result = []
+    for host, path, offset in rows:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            result.append((host, path, f.readline().rstrip('\n')))
+    return result
@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+"""Merges the results of the rally tasks run by several rally hosts.
+
+Each rally host runs its share of the iterations of every scenario, the
+merged results hold all the iterations of a scenario as if a single rally
+had run them (see `rally task results`), and can be given to
+`rally task report`.
+
+Usage:
+  rally_results.py <RESULTS_DIR> <OUTPUT>
+
+Options:
+  -h --help             Show this help message.
+"""
+from docopt import docopt
+from collections import OrderedDict
+import glob
+import json
+import os
+
+
+def merge(results):
+    """
+    Merges lists of task results: the iterations of the scenarios with the
+    same name and position are put together.
+    """
+    merged = OrderedDict()
+    for task in results:
+        for scenario in task:
+            key = (scenario['key']['name'], scenario['key'].get('pos', 0))
+            if key not in merged:
+                merged[key] = dict(scenario, result=[])
+            m = merged[key]
+            m['result'].extend(scenario['result'])
+            m['full_duration'] = max(m.get('full_duration', 0), scenario.get('full_duration', 0))
+
+    for m in merged.values():
+        m['result'].sort(key=lambda i: i['timestamp'])
+        if m['result']:
+            start = m['result'][0]['timestamp']
+            end = max(i['timestamp'] + i['duration'] for i in m['result'])
+            m['load_duration'] = end - start
+    return merged.values()
+
+
+def merge_files(results_dir, output):
+    results = []
+    for path in sorted(glob.glob(os.path.join(results_dir, '*.json'))):
+        with open(path) as f:
+            results.append(json.load(f, object_pairs_hook=OrderedDict))
+    with open(output, 'w') as f:
+        json.dump(merge(results), f, indent=1)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    merge_files(args['<RESULTS_DIR>'], args['<OUTPUT>'])
@@ -8,15 +8,16 @@
 #
 # Modified by "Warren Turkal" <wt@signalfuse.com>, "Volodymyr Zhabiuk" <vzhabiuk@signalfx.com>
 
-import cStringIO as StringIO
+import array
 import socket
-import csv
-import pprint
+import time
 
 import collectd
 
 PLUGIN_NAME = 'haproxy'
-RECV_SIZE = 1024
+RECV_SIZE = 65536
+# Marker sent back by haproxy after each response in interactive mode
+PROMPT = '\n> '
 
 METRIC_TYPES = {
     #Metrics that are collected for the whole haproxy instance.
@@ -96,77 +97,163 @@ METRIC_DELIM = '.'  # for the frontend/backend stats
 DEFAULT_SOCKET = '/var/lib/haproxy/stats'
 DEFAULT_PROXY_MONITORS = [ 'server', 'frontend', 'backend' ]
 HAPROXY_SOCKET = None
+HAPROXY = None
+VERBOSE_LOGGING = False
+# In delta mode, gauges are only dispatched when they change and derive
+# metrics are dispatched as per second rates (gauges named *_rate).
+# Unchanged values are still dispatched every DELTA_HEARTBEAT intervals.
+DELTA_MODE = False
+DELTA_HEARTBEAT = 12
+PREVIOUS = None
+
+# Maps a `show stat` header line to the list of (index, metric name) of
+# its columns. The header rarely changes, so it is only parsed once.
+STAT_COLUMNS = {}
 
 
 class HAProxySocket(object):
     """
-            Encapsulates communication with HAProxy via the socket interface
+            Encapsulates communication with HAProxy via the socket interface.
+            The socket is switched to interactive mode and kept open
+            between two reads.
      """
 
     def __init__(self, socket_file=DEFAULT_SOCKET):
         self.socket_file = socket_file
+        self.stat_sock = None
 
     def connect(self):
         stat_sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
         stat_sock.connect(self.socket_file)
+        self.stat_sock = stat_sock
+        self.stat_sock.sendall('prompt\n')
+        self._read_responses(1)
         return stat_sock
 
-    def communicate(self, command):
-        '''Get response from single command.
+    def close(self):
+        if self.stat_sock is not None:
+            self.stat_sock.close()
+            self.stat_sock = None
+
+    def _read_responses(self, count):
+        """Reads the responses of count commands.
+
+        In interactive mode, haproxy ends each response with its prompt.
+        """
+        chunks = []
+        tail = ''
+        while True:
+            buf = self.stat_sock.recv(RECV_SIZE)
+            if not buf:
+                raise socket.error('Connection closed by HAProxy')
+            chunks.append(buf)
+            tail = (tail + buf)[-len(PROMPT):]
+            if tail == PROMPT:
+                responses = ''.join(chunks).split(PROMPT)
+                if len(responses) > count:
+                    return responses[:count]
+
+    def communicate(self, *commands):
+        '''Get responses from commands.
+
+        The commands are pipelined on the same connection. The connection
+        is opened on first use, and opened again if haproxy closed it in
+        between (e.g. after its `stats timeout`).
 
         Args:
-            command: string command to send to haproxy stat socket
+            commands: string commands to send to haproxy stat socket
 
         Returns:
-            a string of the response data
+            a string of the response data if one command is given,
+            the list of the responses otherwise
         '''
-        if not command.endswith('\n'):
-            command += '\n'
-        stat_sock = self.connect()
-        stat_sock.sendall(command)
-        result_buf = StringIO.StringIO()
-        buf = stat_sock.recv(RECV_SIZE)
-        while buf:
-            result_buf.write(buf)
-            buf = stat_sock.recv(RECV_SIZE)
-        stat_sock.close()
-        return result_buf.getvalue()
+        request = ''.join(c if c.endswith('\n') else c + '\n' for c in commands)
+        for attempt in range(2):
+            try:
+                if self.stat_sock is None:
+                    self.connect()
+                self.stat_sock.sendall(request)
+                responses = self._read_responses(len(commands))
+                break
+            except socket.error:
+                self.close()
+                if attempt > 0:
+                    raise
+        if len(commands) == 1:
+            return responses[0]
+        return responses
 
     def get_server_info(self):
-        result = {}
-        output = self.communicate('show info')
-        for line in output.splitlines():
-            try:
-                key, val = line.split(':', 1)
-            except ValueError:
-                continue
-            result[key.strip()] = val.strip()
-        return result
+        return parse_info(self.communicate('show info'))
 
     def get_server_stats(self):
-        output = self.communicate('show stat')
-        #sanitize and make a list of lines
-        output = output.lstrip('# ').strip()
-        output = [l.strip(',') for l in output.splitlines()]
-        csvreader = csv.DictReader(output)
-        result = [d.copy() for d in csvreader]
-        return result
+        return parse_stats(self.communicate('show stat'))
+
+    def get_server_info_and_stats(self):
+        """Fetches both server info and server stats in one round-trip."""
+        info, stats = self.communicate('show info', 'show stat')
+        return parse_info(info), parse_stats(stats)
+
+
+def parse_info(output):
+    """
+        Parses the output of `show info`.
+        Returns a dict that maps each (lowercased) key to its value
+    """
+    result = {}
+    for line in output.splitlines():
+        key, sep, val = line.partition(':')
+        if sep:
+            result[key.strip().lower()] = val.strip()
+    return result
+
+
+def stat_columns(header):
+    """
+        Returns the list of (index, metric name) of a `show stat` header.
+        Only the columns listed in METRIC_TYPES are part of the list.
+    """
+    columns = STAT_COLUMNS.get(header)
+    if columns is None:
+        names = header.lstrip('# ').rstrip(',').split(',')
+        columns = [(i, name.lower()) for i, name in enumerate(names)
+                   if name.lower() in METRIC_TYPES]
+        STAT_COLUMNS[header] = columns
+    return columns
+
+
+def parse_stats(output):
+    """
+        Parses the output of `show stat`.
+        Returns a tuple (columns, rows) where columns is the list of
+        (index, metric name) of the header and rows is the list of the
+        splitted lines (pxname and svname are the first two fields)
+    """
+    lines = output.strip().splitlines()
+    if not lines:
+        return [], []
+    columns = stat_columns(lines[0])
+    rows = [line.split(',') for line in lines[1:]]
+    return columns, rows
 
 
 def get_stats():
     """
-        Makes two calls to haproxy to fetch server info and server stats.
-        Returns the dict containing metric name as the key and a tuple of metric value and the dict of dimensions if any
+        Makes one call to haproxy to fetch server info and server stats.
+        Returns a list of tuples (metric name, metric value, plugin instance)
+        where the plugin instance holds the formatted dimensions if any.
+        Only the metrics of METRIC_TYPES and the rows of PROXY_MONITORS are kept
     """
+    global HAPROXY
     if HAPROXY_SOCKET is None:
         collectd.error("Socket configuration parameter is undefined. Couldn't get the stats")
         return
     stats = []
-    haproxy = HAProxySocket(HAPROXY_SOCKET)
+    if HAPROXY is None:
+        HAPROXY = HAProxySocket(HAPROXY_SOCKET)
 
     try:
-        server_info = haproxy.get_server_info()
-        server_stats = haproxy.get_server_stats()
+        server_info, (columns, rows) = HAPROXY.get_server_info_and_stats()
     except socket.error:
         collectd.warning(
             'status err Unable to connect to HAProxy socket at %s' %
@@ -174,17 +261,24 @@ def get_stats():
         return stats
 
     for key, val in server_info.iteritems():
+        if key not in METRIC_TYPES:
+            continue
         try:
-            stats.append((key, int(val), None))
+            stats.append((key, int(val), ''))
         except (TypeError, ValueError):
             pass
-    for statdict in server_stats:
-        if not (statdict['svname'].lower() in PROXY_MONITORS or statdict['pxname'].lower() in PROXY_MONITORS):
+    for fields in rows:
+        pxname, svname = fields[0], fields[1]
+        if not (svname.lower() in PROXY_MONITORS or pxname.lower() in PROXY_MONITORS):
               continue
-        for metricname, val in statdict.items():
+        plugin_instance = _format_dimensions({'proxy_name': pxname, 'service_name': svname})
+        for index, metricname in columns:
+            value = fields[index] if index < len(fields) else None
+            if not value:
+                continue
             try:
-                stats.append((metricname, int(val), {'proxy_name': statdict['pxname'], 'service_name': statdict['svname']}))
-            except (TypeError, ValueError):
+                stats.append((metricname, int(value), plugin_instance))
+            except ValueError:
                 pass
     return stats
 
@@ -196,7 +290,7 @@ def config(config_values):
     config_values (collectd.Config): Object containing config values
     """
 
-    global PROXY_MONITORS, HAPROXY_SOCKET
+    global PROXY_MONITORS, HAPROXY_SOCKET, VERBOSE_LOGGING, DELTA_MODE, DELTA_HEARTBEAT
     PROXY_MONITORS = [ ]
     HAPROXY_SOCKET = DEFAULT_SOCKET
     for node in config_values.children:
@@ -204,6 +298,12 @@ def config(config_values):
               PROXY_MONITORS.append(node.values[0].lower())
         elif  node.key == "Socket":
             HAPROXY_SOCKET = node.values[0]
+        elif node.key == "Verbose":
+            VERBOSE_LOGGING = bool(node.values[0])
+        elif node.key == "DeltaMode":
+            DELTA_MODE = bool(node.values[0])
+        elif node.key == "DeltaHeartbeat":
+            DELTA_HEARTBEAT = int(node.values[0])
         else:
             collectd.warning('Unknown config key: %s' % node.key)
     if not PROXY_MONITORS:
@@ -211,6 +311,65 @@ def config(config_values):
     PROXY_MONITORS = [ p.lower() for p in PROXY_MONITORS ]
 
 
+class PreviousValues(object):
+    """
+        Compact table of the previous values of each (proxy, service, metric).
+        Each key is given a slot in arrays, so that a big topology doesn't
+        cost several python objects per metric.
+    """
+
+    def __init__(self):
+        self.slots = {}
+        # last read value and time
+        self.values = array.array('d')
+        self.times = array.array('d')
+        # last dispatched value and number of reads since
+        self.sent = array.array('d')
+        self.skipped = array.array('i')
+
+    def update(self, stats, now, heartbeat):
+        """
+            Records the stats of a read, as returned by get_stats.
+            Returns the stats to dispatch, that is the gauges that changed
+            and the per second rates of the counters that changed. Values
+            that didn't change are returned again every heartbeat reads.
+        """
+        slots, values, times = self.slots, self.values, self.times
+        sent, skipped = self.sent, self.skipped
+        changed = []
+        for metric_name, value, plugin_instance in stats:
+            key = (plugin_instance, metric_name)
+            slot = slots.get(key)
+            if slot is None:
+                slot = slots[key] = len(values)
+                values.append(value)
+                times.append(now)
+                sent.append(float('nan'))
+                skipped.append(0)
+                if METRIC_TYPES[metric_name][1] != 'gauge':
+                    # a rate needs two reads
+                    continue
+            elif METRIC_TYPES[metric_name][1] != 'gauge':
+                previous, elapsed = values[slot], now - times[slot]
+                values[slot] = value
+                times[slot] = now
+                if elapsed <= 0 or value < previous:
+                    # counter reset
+                    continue
+                value = (value - previous) / elapsed
+            else:
+                values[slot] = value
+                times[slot] = now
+
+            if value == sent[slot] and skipped[slot] < heartbeat:
+                skipped[slot] += 1
+                continue
+            sent[slot] = value
+            skipped[slot] = 0
+            changed.append((metric_name, value, plugin_instance))
+        return changed
+
+
 def _format_dimensions(dimensions):
     """
     Formats a dictionary of dimensions to a format that enables them to be
@@ -229,10 +388,11 @@ def _format_dimensions(dimensions):
 
 
 def collect_metrics():
-    collectd.debug('beginning collect_metrics')
     """
         A callback method that gets metrics from HAProxy and records them to collectd.
     """
+    if VERBOSE_LOGGING:
+        collectd.debug('beginning collect_metrics')
 
     info = get_stats()
 
@@ -240,30 +400,32 @@ def collect_metrics():
         collectd.warning('%s: No data received' % PLUGIN_NAME)
         return
 
-    for metric_name, metric_value, dimensions in info:
-        if not metric_name.lower() in METRIC_TYPES:
-            collectd.debug("Metric %s is not in the metric types" % metric_name)
-            continue
+    global PREVIOUS
+    if DELTA_MODE:
+        if PREVIOUS is None:
+            PREVIOUS = PreviousValues()
+        info = PREVIOUS.update(info, time.time(), DELTA_HEARTBEAT)
+
+    # A single Values is reused, the changing fields are given at dispatch
+    datapoint = collectd.Values(plugin=PLUGIN_NAME)
+    for metric_name, metric_value, plugin_instance in info:
+        translated_metric_name, val_type = METRIC_TYPES[metric_name]
+        if DELTA_MODE and val_type != 'gauge':
+            translated_metric_name += '_rate'
+            val_type = 'gauge'
+
+        datapoint.dispatch(type=val_type,
+                           type_instance=translated_metric_name,
+                           plugin_instance=plugin_instance,
+                           values=(metric_value,))
+        if VERBOSE_LOGGING:
+            collectd.debug('Collecting %s%s: %s' % (plugin_instance, translated_metric_name, metric_value))
+
 
-        translated_metric_name, val_type = METRIC_TYPES[metric_name.lower()]
-
-        collectd.debug('Collecting {0}: {1}'.format(translated_metric_name, metric_value))
-        datapoint = collectd.Values()
-        datapoint.type = val_type
-        datapoint.type_instance = translated_metric_name
-        datapoint.plugin = PLUGIN_NAME
-        if dimensions:
-            datapoint.plugin_instance = _format_dimensions(dimensions)
-        datapoint.values = (metric_value,)
-        pprint_dict = {
-                    'plugin': datapoint.plugin,
-                    'plugin_instance': datapoint.plugin_instance,
-                    'type': datapoint.type,
-                    'type_instance': datapoint.type_instance,
-                    'values': datapoint.values
-                }
-        collectd.debug(pprint.pformat(pprint_dict))
-        datapoint.dispatch()
+def shutdown():
+    if HAPROXY is not None:
+        HAPROXY.close()
 
 collectd.register_config(config)
 collectd.register_read(collect_metrics)
+collectd.register_shutdown(shutdown)
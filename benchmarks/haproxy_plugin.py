@@ -0,0 +1,112 @@
+#! /usr/bin/env python
+"""Micro-benchmark of the haproxy collectd plugin.
+
+The recorded `show stat` dump is replicated to get the given number of
+backends, then one read interval of the plugin is timed.
+
+Usage:
+  haproxy_plugin.py [--backends=BACKENDS] [--rounds=ROUNDS]
+
+Options:
+  -h --help              Show this help message.
+  --backends=BACKENDS    Number of proxies in the `show stat` dump [default: 3000].
+  --rounds=ROUNDS        Number of read intervals to time [default: 20].
+"""
+from docopt import docopt
+import csv
+import os
+import sys
+import timeit
+import types
+
+BENCH_PATH = os.path.dirname(os.path.realpath(__file__))
+PLUGIN_PATH = os.path.join(BENCH_PATH, '..', 'ansible', 'roles', 'collectd', 'files')
+STAT_DUMP = os.path.join(BENCH_PATH, 'data', 'haproxy-show-stat.csv')
+INFO_DUMP = os.path.join(BENCH_PATH, 'data', 'haproxy-show-info.txt')
+
+
+class Values(object):
+    "Counts the dispatched values instead of sending them to collectd."
+    dispatched = 0
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def dispatch(self, **kwargs):
+        Values.dispatched += 1
+
+
+def load_plugin():
+    "Imports the plugin with a collectd module that only counts values."
+    collectd = types.ModuleType('collectd')
+    collectd.Values = Values
+    for name in ['register_config', 'register_read', 'register_shutdown',
+                 'debug', 'info', 'warning', 'error']:
+        setattr(collectd, name, lambda *args, **kwargs: None)
+    sys.modules['collectd'] = collectd
+    sys.path.insert(0, PLUGIN_PATH)
+    import haproxy
+    return haproxy
+
+
+def make_stat_dump(nb_backends):
+    "Replicates the proxies of the recorded dump up to nb_backends."
+    with open(STAT_DUMP) as f:
+        lines = f.read().splitlines()
+    header, rows = lines[0], lines[1:]
+    proxies = sorted(set(r.split(',', 1)[0] for r in rows))
+    dump = [header]
+    for i in range(nb_backends):
+        proxy = proxies[i % len(proxies)]
+        for row in rows:
+            if row.startswith(proxy + ','):
+                dump.append("%s_%d%s" % (proxy, i, row[len(proxy):]))
+    return "\n".join(dump) + "\n"
+
+
+def legacy_parse(output):
+    "The csv.DictReader based parsing the plugin used to do."
+    output = output.lstrip('# ').strip()
+    output = [l.strip(',') for l in output.splitlines()]
+    return [d.copy() for d in csv.DictReader(output)]
+
+
+def main(nb_backends, rounds):
+    haproxy = load_plugin()
+    stat_dump = make_stat_dump(nb_backends)
+    with open(INFO_DUMP) as f:
+        info_dump = f.read()
+
+    class RecordedSocket(haproxy.HAProxySocket):
+        def communicate(self, *commands):
+            return [info_dump, stat_dump]
+
+    haproxy.HAPROXY_SOCKET = 'recorded'
+    haproxy.HAPROXY = RecordedSocket()
+    haproxy.PROXY_MONITORS = haproxy.DEFAULT_PROXY_MONITORS
+
+    print("%d proxies, %d lines, %d bytes" % (nb_backends,
+        stat_dump.count("\n"), len(stat_dump)))
+
+    for label, fn in [
+            ('legacy parse (csv.DictReader)', lambda: legacy_parse(stat_dump)),
+            ('parse_stats', lambda: haproxy.parse_stats(stat_dump)),
+            ('get_stats', haproxy.get_stats),
+            ('collect_metrics', haproxy.collect_metrics)]:
+        best = min(timeit.repeat(fn, number=1, repeat=rounds))
+        print("%-32s %8.2f ms" % (label, best * 1000))
+
+    print("%d values dispatched per interval" % (Values.dispatched / rounds))
+
+    # The dump doesn't change between two reads: in delta mode only the
+    # first read dispatches values, until the heartbeat
+    haproxy.DELTA_MODE = True
+    Values.dispatched = 0
+    best = min(timeit.repeat(haproxy.collect_metrics, number=1, repeat=rounds))
+    print("%-32s %8.2f ms" % ('collect_metrics (delta mode)', best * 1000))
+    print("%d values dispatched per interval in delta mode" % (Values.dispatched / rounds))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--backends']), int(args['--rounds']))
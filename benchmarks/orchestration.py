@@ -0,0 +1,139 @@
+#! /usr/bin/env python
+"""Overhead of the orchestration layer from tens to thousands of nodes.
+
+The nodes come from the simulated backend, so no time is spent on
+Grid'5000: what is timed is kolla-g5k itself (reservation bookkeeping,
+role placement, inventory, state and the setup of ansible).
+
+Usage:
+  orchestration.py [--sizes=SIZES] [--rounds=ROUNDS]
+
+Options:
+  -h --help              Show this help message.
+  --sizes=SIZES          Numbers of nodes, comma separated [default: 10,100,1000,10000].
+  --rounds=ROUNDS        Number of runs of each step, the best one is kept [default: 3].
+"""
+from docopt import docopt
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_PATH = os.path.dirname(os.path.realpath(__file__))
+ROOT_PATH = os.path.join(BENCH_PATH, '..')
+sys.path.insert(0, ROOT_PATH)
+
+from execo_engine import logger
+import engine.state
+from engine.g5k_engine import G5kEngine, DEFAULT_CONFIG
+from engine.sim_backend import SimulatedBackend
+
+CLUSTER = 'paravance'
+BASE_INVENTORY = os.path.join(ROOT_PATH, 'inventories', 'inventory.sample')
+
+
+def load_cli():
+    "Imports kolla-g5k.py as a module."
+    return imp.load_source('kolla_g5k', os.path.join(ROOT_PATH, 'kolla-g5k.py'))
+
+
+def resources(nb_nodes):
+    "Control and network nodes grow slowly, the rest are compute nodes."
+    control = max(1, nb_nodes // 100)
+    network = max(1, nb_nodes // 200)
+    return {CLUSTER: {'control': control, 'network': network,
+                      'compute': nb_nodes - control - network}}
+
+
+def make_engine(nb_nodes):
+    g5k = G5kEngine(backend=SimulatedBackend(clusters={CLUSTER: nb_nodes}))
+    g5k.config = dict(DEFAULT_CONFIG)
+    g5k.config.update({
+        'resources': resources(nb_nodes),
+        'vlans': {'rennes': "{type='kavlan'}/vlan=1"}
+    })
+    return g5k
+
+
+def best_of(rounds, function):
+    "Returns the best wall time of function and its last result."
+    times = []
+    result = None
+    for _ in range(rounds):
+        start = time.time()
+        result = function()
+        times.append(time.time() - start)
+    return min(times), result
+
+
+def run_ansible_setup(inventory_path):
+    "What run_ansible does before running the playbooks."
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.vars import VariableManager
+    from ansible.inventory import Inventory
+    variable_manager = VariableManager()
+    inventory = Inventory(loader=DataLoader(), variable_manager=variable_manager,
+                          host_list=inventory_path)
+    variable_manager.set_inventory(inventory)
+    return inventory
+
+
+def bench_size(cli, nb_nodes, rounds, tmp_dir):
+    timings = []
+
+    def get_job_and_deploy():
+        g5k = make_engine(nb_nodes)
+        g5k.get_job()
+        g5k.deploy()
+        return g5k
+    t, g5k = best_of(rounds, get_job_and_deploy)
+    timings.append(('reservation and deploy', t))
+
+    t, roles = best_of(rounds, lambda: g5k.build_roles(facts=g5k.get_nodes_facts(g5k.deployed_nodes)))
+    timings.append(('build_roles', t))
+
+    t, _ = best_of(rounds, lambda: cli.to_ansible_group_string(roles))
+    timings.append(('to_ansible_group_string', t))
+
+    inventory_path = os.path.join(tmp_dir, 'multinode')
+    t, _ = best_of(rounds, lambda: cli.generate_inventory(roles, BASE_INVENTORY, inventory_path))
+    timings.append(('generate_inventory', t))
+
+    state = {'config': g5k.config, 'nodes': engine.state.to_addresses(roles),
+             'timeline': [], 'user': 'simulated'}
+    t, _ = best_of(rounds, lambda: engine.state.save(tmp_dir, state))
+    timings.append(('state save', t))
+    t, _ = best_of(rounds, lambda: engine.state.load(tmp_dir))
+    timings.append(('state load', t))
+
+    try:
+        t, _ = best_of(rounds, lambda: run_ansible_setup(inventory_path))
+        timings.append(('run_ansible setup', t))
+    except ImportError:
+        timings.append(('run_ansible setup', None))
+
+    return timings
+
+
+def main(sizes, rounds):
+    cli = load_cli()
+    # The steps log each node, keep the output readable
+    logger.setLevel(40)
+    for nb_nodes in sizes:
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for step, t in bench_size(cli, nb_nodes, rounds, tmp_dir):
+                label = "%6d nodes  %s" % (nb_nodes, step)
+                if t is None:
+                    print("%-45s %11s" % (label, 'missing'))
+                else:
+                    print("%-45s %8.1f ms" % (label, t * 1000))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main([int(s) for s in args['--sizes'].split(',')], int(args['--rounds']))
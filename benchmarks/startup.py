@@ -0,0 +1,80 @@
+#! /usr/bin/env python
+"""Startup time of kolla-g5k.py.
+
+Times the commands that don't need Grid'5000 (each run in a fresh
+interpreter) and the import time of the libraries each phase loads.
+
+Usage:
+  startup.py [--rounds=ROUNDS]
+
+Options:
+  -h --help              Show this help message.
+  --rounds=ROUNDS        Number of runs of each command [default: 5].
+"""
+from docopt import docopt
+import os
+import subprocess
+import sys
+import time
+
+BENCH_PATH = os.path.dirname(os.path.realpath(__file__))
+SCRIPT = os.path.join(BENCH_PATH, '..', 'kolla-g5k.py')
+
+COMMANDS = [
+    ['--help'],
+    ['info'],
+    ['ssh-tunnel'],
+]
+
+# Libraries imported by each phase
+PHASE_IMPORTS = [
+    ('cli', 'execo_engine, engine.state, yaml, docopt'),
+    ('prepare-node', 'engine.g5k_engine'),
+    ('prepare-node, install-os, bench', 'ansible.executor.playbook_executor'),
+    ('init-os', 'novaclient.client, glanceclient.client, keystoneclient.v3.client, neutronclient.neutron.client'),
+    ('logs', 'analysis.logs'),
+]
+
+
+def run(argv):
+    "Returns the wall time of a run, or None if it failed."
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        code = subprocess.call(argv, stdout=devnull, stderr=devnull,
+                               cwd=os.path.join(BENCH_PATH, '..'))
+    if code != 0:
+        return None
+    return time.time() - start
+
+
+def best_of(argv, rounds):
+    times = [run(argv) for _ in range(rounds)]
+    if None in times:
+        return None
+    return min(times)
+
+
+def main(rounds):
+    baseline = best_of([sys.executable, '-c', 'pass'], rounds)
+    print("%-40s %8.1f ms" % ('python interpreter', baseline * 1000))
+
+    for command in COMMANDS:
+        t = best_of([sys.executable, SCRIPT] + command, rounds)
+        label = 'kolla-g5k.py ' + ' '.join(command)
+        if t is None:
+            print("%-40s %11s" % (label, 'failed'))
+        else:
+            print("%-40s %8.1f ms" % (label, t * 1000))
+
+    for phase, modules in PHASE_IMPORTS:
+        t = best_of([sys.executable, '-c', 'import ' + modules], rounds)
+        label = 'imports of ' + phase
+        if t is None:
+            print("%-40s %11s" % (label, 'missing'))
+        else:
+            print("%-40s %8.1f ms" % (label, (t - baseline) * 1000))
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    main(int(args['--rounds']))
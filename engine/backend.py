@@ -0,0 +1,114 @@
+"""
+Backends of the G5kEngine.
+
+A backend makes the reservation, deploys the nodes, looks up the reference
+API and runs commands on the nodes. G5kBackend talks to Grid'5000,
+engine.sim_backend.SimulatedBackend fakes it.
+"""
+from collections import namedtuple
+
+import execo as EX
+from execo.process import ProcessLifecycleHandler
+import execo_g5k as EX5
+from execo_engine import logger
+from g5k_api import G5kApi
+
+# Result of a command on a host
+HostResult = namedtuple('HostResult', ['host', 'ok', 'exit_code', 'duration',
+                                       'stdout', 'stderr'])
+
+
+def _host_result(process):
+    return HostResult(process.host.address, process.ok, process.exit_code,
+                      (process.end_date or 0) - (process.start_date or 0),
+                      process.stdout, process.stderr)
+
+
+class _ResultHandler(ProcessLifecycleHandler):
+    "Calls on_result with the result of each process as it ends."
+    def __init__(self, on_result):
+        self.on_result = on_result
+
+    def end(self, process):
+        self.on_result(_host_result(process))
+
+
+class G5kBackend(object):
+    "Grid'5000 through execo_g5k and the Grid'5000 API"
+
+    simulated = False
+
+    def __init__(self):
+        self.api = G5kApi()
+
+    def get_job_by_name(self, name):
+        """Returns the id of the running oargrid job with this name (or None)."""
+        gridjob, _ = EX5.planning.get_job_by_name(name)
+        return gridjob
+
+    def reserve(self, jobs_specs, reservation_date, walltime):
+        """Submits an oargrid job, returns its id (None on failure)."""
+        gridjob, _ = EX5.oargridsub(
+            jobs_specs,
+            reservation_date=reservation_date,
+            walltime=walltime,
+            job_type='deploy'
+        )
+        return gridjob
+
+    def wait_job_start(self, gridjob):
+        EX5.wait_oargrid_job_start(gridjob)
+
+    def get_job_nodes(self, gridjob):
+        return EX5.get_oargrid_job_nodes(gridjob)
+
+    def get_job_info(self, gridjob):
+        """Returns a dict with the start_date, walltime and user of the job."""
+        return EX5.get_oargrid_job_info(gridjob)
+
+    def get_job_sites(self, gridjob):
+        """Returns the (job_id, site) of each oar job of the grid job."""
+        return EX5.get_oargrid_job_oar_jobs(gridjob)
+
+    def get_job_vlan(self, job_id, site):
+        return EX5.get_oar_job_kavlan(job_id, site)
+
+    def deploy(self, nodes, env_name, vlan, check_deployed):
+        """
+        Deploys env_name on the nodes. Returns the addresses of the deployed
+        and undeployed nodes.
+        """
+        return EX5.deploy(
+            EX5.Deployment(nodes, env_name=env_name, vlan=vlan),
+            check_deployed_command=check_deployed)
+
+    def run(self, cmd, nodes, conn_params, timeout=None, tree=False, on_result=None):
+        """
+        Runs cmd on the nodes at the same time. Returns a HostResult per node.
+
+        With tree, the command is propagated by taktuk through a tree of
+        connections instead of one ssh connection per node. on_result is
+        called with the HostResult of each node as soon as it ends.
+        """
+        process_args = {'timeout': timeout, 'nolog_exit_code': True}
+        if on_result is not None:
+            process_args['lifecycle_handlers'] = [_ResultHandler(on_result)]
+        remote_class = EX.TaktukRemote if tree else EX.Remote
+        remote = remote_class(cmd, nodes, conn_params, process_args=process_args)
+        remote.run()
+        return [_host_result(p) for p in remote.processes]
+
+    def delete_job(self, gridjob):
+        EX5.oardel([gridjob])
+
+
+def make_backend(config):
+    """Returns the backend named by the `backend` key of the config."""
+    name = config.get('backend', 'g5k')
+    if name == 'g5k':
+        return G5kBackend()
+    if name == 'simulated':
+        from sim_backend import SimulatedBackend
+        logger.warning("Using the simulated backend, nothing runs on Grid'5000")
+        return SimulatedBackend(**config.get('simulation', {}))
+    raise Exception("Unknown backend %s" % name)
@@ -0,0 +1,119 @@
+"""
+Fan-out of a command over the nodes.
+
+The command runs on all the nodes at once, through a tree of taktuk
+connections for large sets of nodes. The nodes that fail are retried, and
+the fan-out succeeds if a quorum of nodes succeeded. The result of each
+node (exit code, duration, output, attempts) is kept.
+"""
+import math
+import time
+
+from execo_engine import logger
+
+# From this number of nodes, commands are propagated through a tree of
+# taktuk connections instead of one ssh connection per node from the frontend
+TREE_THRESHOLD = 20
+# Progress is logged at most every PROGRESS_INTERVAL seconds
+PROGRESS_INTERVAL = 10
+
+
+class FanoutError(Exception):
+    "Raised when not enough nodes succeeded."
+    def __init__(self, result):
+        super(FanoutError, self).__init__(
+            "%s: %d nodes succeeded, %d required" %
+            (result.label, len(result.succeeded), result.required))
+        self.result = result
+
+
+class FanoutResult(object):
+    """
+    Results of a fan-out: results maps each host to the HostResult of its
+    last attempt, attempts to its number of attempts.
+    """
+    def __init__(self, label, results, attempts, required):
+        self.label = label
+        self.results = results
+        self.attempts = attempts
+        self.required = required
+
+    @property
+    def succeeded(self):
+        return sorted(h for h, r in self.results.items() if r.ok)
+
+    @property
+    def failed(self):
+        return sorted(h for h, r in self.results.items() if not r.ok)
+
+    @property
+    def ok(self):
+        return len(self.succeeded) >= self.required
+
+    def log(self):
+        retried = len([h for h, a in self.attempts.items() if a > 1])
+        logger.info("%s: %d/%d nodes succeeded (%d retried)" %
+                    (self.label, len(self.succeeded), len(self.results), retried))
+        for host in self.failed:
+            result = self.results[host]
+            reason = (result.stderr or result.stdout or '').strip().splitlines()
+            logger.error("%s failed on %s (exit code %s, %d attempts): %s" %
+                         (self.label, host, result.exit_code, self.attempts[host],
+                          reason[-1] if reason else 'no output'))
+
+
+class Progress(object):
+    "Logs the progress of a fan-out as the nodes end."
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.last = time.time()
+
+    def __call__(self, result):
+        self.done += 1
+        if not result.ok:
+            self.failed += 1
+        now = time.time()
+        if now - self.last >= PROGRESS_INTERVAL and self.done < self.total:
+            self.last = now
+            logger.info("%s: %d/%d nodes done, %d failed" %
+                        (self.label, self.done, self.total, self.failed))
+
+
+def required_nodes(quorum, nb_nodes):
+    """
+    quorum is a fraction of the nodes (float up to 1.0) or a number of
+    nodes (int).
+    """
+    if isinstance(quorum, float) and quorum <= 1:
+        return int(math.ceil(quorum * nb_nodes))
+    return min(int(quorum), nb_nodes)
+
+
+def run(backend, cmd, nodes, conn_params, label, retries=0, quorum=1.0,
+        timeout=None, tree_threshold=TREE_THRESHOLD):
+    """
+    Runs cmd on the nodes with the backend, the failed nodes are retried up
+    to retries times. Returns a FanoutResult.
+    """
+    results = {}
+    attempts = {}
+    pending = list(nodes)
+    for attempt in range(retries + 1):
+        if pending == []:
+            break
+        if attempt > 0:
+            logger.warning("%s: retrying on %d nodes" % (label, len(pending)))
+        for result in backend.run(cmd, pending, conn_params, timeout=timeout,
+                                  tree=len(pending) >= tree_threshold,
+                                  on_result=Progress(label, len(pending))):
+            results[result.host] = result
+            attempts[result.host] = attempt + 1
+        pending = [n for n in pending if not results[n.address].ok]
+
+    fanout = FanoutResult(label, results, attempts,
+                          required_nodes(quorum, len(nodes)))
+    fanout.log()
+    return fanout
@@ -0,0 +1,163 @@
+"""
+Access to the Grid'5000 API.
+
+Reference data (sites, clusters, nodes) rarely changes: it is cached on
+disk and reused until its TTL expires. Identical requests made at the same
+time by several threads are sent only once.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from execo_g5k.api_utils import APIConnection
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kolla-g5k', 'g5k-api')
+# Reference data is kept one day
+REFERENCE_TTL = 24 * 3600
+MAX_CONCURRENCY = 8
+
+
+class _Request(object):
+    "A request in flight, shared by the threads asking for the same path."
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class G5kApi(object):
+
+    def __init__(self, base_uri=None, username=None,
+                 cache_dir=CACHE_DIR, ttl=REFERENCE_TTL):
+        """
+        base_uri and username default to the execo_g5k configuration.
+        A cache_dir set to None disables the disk cache.
+        """
+        self.connection = APIConnection(base_uri=base_uri, username=username)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.cluster_sites = None
+        self.requests = 0
+
+    def _cache_path(self, path):
+        key = hashlib.sha1(self.connection.base_uri + path).hexdigest()
+        return os.path.join(self.cache_dir, key + '.json')
+
+    def _read_cache(self, path):
+        if self.cache_dir is None:
+            return None
+        cache_path = self._cache_path(path)
+        try:
+            if time.time() - os.path.getmtime(cache_path) > self.ttl:
+                return None
+            with open(cache_path) as f:
+                return json.load(f)
+        except (OSError, IOError, ValueError):
+            return None
+
+    def _write_cache(self, path, document):
+        if self.cache_dir is None:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        cache_path = self._cache_path(path)
+        tmp_path = "%s.%d.%s" % (cache_path, os.getpid(), threading.current_thread().ident)
+        with open(tmp_path, 'w') as f:
+            json.dump(document, f)
+        os.rename(tmp_path, cache_path)
+
+    def get(self, path, cached=False):
+        """
+        Returns the json document at path.
+        Reference data should be read with cached=True.
+        """
+        if cached:
+            document = self._read_cache(path)
+            if document is not None:
+                return document
+
+        with self.lock:
+            request = self.in_flight.get(path)
+            owner = request is None
+            if owner:
+                request = self.in_flight[path] = _Request()
+                self.requests += 1
+
+        if not owner:
+            request.done.wait()
+            if request.error is not None:
+                raise request.error
+            return request.result
+
+        try:
+            _, content = self.connection.get(path)
+            request.result = json.loads(content)
+            if cached:
+                self._write_cache(path, request.result)
+            return request.result
+        except Exception as e:
+            request.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[path]
+            request.done.set()
+
+    def map(self, function, items):
+        """Applies function to each item concurrently."""
+        items = list(items)
+        if len(items) <= 1:
+            return map(function, items)
+        pool = ThreadPool(min(MAX_CONCURRENCY, len(items)))
+        try:
+            return pool.map(function, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_sites(self):
+        return [site['uid'] for site in self.get('/sites', cached=True)['items']]
+
+    def get_site_clusters(self, site):
+        return [cluster['uid'] for cluster in
+                self.get('/sites/%s/clusters' % site, cached=True)['items']]
+
+    def get_cluster_site(self, cluster):
+        """Get the site of a cluster."""
+        if self.cluster_sites is None:
+            sites = self.get_sites()
+            cluster_sites = {}
+            for site, clusters in zip(sites, self.map(self.get_site_clusters, sites)):
+                for c in clusters:
+                    cluster_sites[c] = site
+            self.cluster_sites = cluster_sites
+        if cluster not in self.cluster_sites:
+            raise ValueError("unknown g5k cluster %s" % cluster)
+        return self.cluster_sites[cluster]
+
+    def get_cluster_nodes(self, cluster):
+        """Returns the reference description of the nodes of a cluster."""
+        site = self.get_cluster_site(cluster)
+        return self.get('/sites/%s/clusters/%s/nodes' % (site, cluster),
+                        cached=True)['items']
+
+    def get_node(self, cluster, uid):
+        """Returns the reference description of a node (e.g. paravance-1)."""
+        for node in self.get_cluster_nodes(cluster):
+            if node['uid'] == uid:
+                return node
+        raise ValueError("unknown g5k node %s" % uid)
+
+    def get_cluster_nics(self, cluster):
+        """
+        Returns the mountable NIC devices of the nodes of a cluster, the
+        ones mounted by default first.
+        """
+        nics = self.get_cluster_nodes(cluster)[0]['network_adapters']
+        return [nic['device'] for nic in sorted(nics, key=lambda nic: not nic.get('mounted'))
+                if nic['mountable']]
@@ -1,4 +1,4 @@
-import pprint, os, sys
+import pprint, os, sys, threading
 pf = pprint.PrettyPrinter(indent=4).pformat
 import yaml
 
@@ -6,11 +6,13 @@ import execo as EX
 from string import Template
 from execo import configuration
 from execo.log import style
-import execo_g5k as EX5
-from execo_g5k.api_utils import get_cluster_site
 from execo_g5k import OarSubmission
 from execo_engine import Engine, logger
+from backend import G5kBackend, make_backend
+import fanout
+import screening
 
+from collections import deque
 from itertools import groupby
 from netaddr import IPNetwork, IPSet
 import operator
@@ -25,15 +27,48 @@ DEFAULT_CONN_PARAMS = {'user': 'root'}
 
 ROLE_DISTRIBUTION_MODE_STRICT = "strict"
 
+# Roles get their nodes in this order, the latency critical ones
+# (databases, message bus, haproxy) first. Other roles come after the
+# listed ones, except compute which comes last.
+ROLE_PRIORITIES = ['control', 'controller', 'network', 'storage', 'util']
+COMPUTE_ROLE = 'compute'
+# External interface of the nodes with a single NIC
+VETH_INTERFACE = 'veth0'
+
 DEFAULT_CONFIG = {
     "name": "kolla-discovery",
     "walltime": "02:00:00",
     "env_name": 'ubuntu1404-x64-min',
     "reservation": None,
     "vlans": {},
-    "role_distribution": ROLE_DISTRIBUTION_MODE_STRICT
+    "role_distribution": ROLE_DISTRIBUTION_MODE_STRICT,
+    "screening": False,
+    "screening_tolerance": screening.DEFAULT_TOLERANCE,
+    # Nodes reserved in each cluster to replace the outliers of the
+    # screening
+    "screening_spares": 0,
+    # Failed nodes are retried exec_retries times, and exec_quorum
+    # (fraction or number) of the nodes must succeed
+    "exec_retries": 1,
+    "exec_quorum": 1.0,
+    # Each cluster is deployed on its own and bootstrapped as soon as it is
+    # deployed
+    "pipeline_deploy": False,
+    # Size haproxy, galera and the API workers after the hardware of the
+    # nodes (True or formulas overriding engine.tuning.FORMULAS)
+    "tuning": False
 };
 
+SCREENING_TIMEOUT = 300
+
+# Commands run on each deployed node before ansible can take over
+BOOTSTRAP_COMMANDS = [
+    ('apt-get update && apt-get -y --force-yes install apt-transport-https',
+     'Installing apt-transport-https'),
+    ('apt-get -y install python',
+     'Installing Python')
+]
+
 def translate_to_vlan(nodes, vlan_id):
     """
     When using a vlan, we need to *manually* translate
@@ -62,13 +97,141 @@ def check_nodes(nodes = [], resources = {}, mode = ROLE_DISTRIBUTION_MODE_STRICT
 
     return True
 
+def merge_resources(deployments):
+    """
+    Sums the resources of each deployment to get the resources of the
+    reservation.
+    """
+    resources = {}
+    for name in sorted(deployments.keys()):
+        if 'resources' not in deployments[name]:
+            raise Exception("Deployment %s doesn't have resources" % name)
+        for cluster, roles in deployments[name]['resources'].items():
+            cluster_roles = resources.setdefault(cluster, {})
+            for role, count in roles.items():
+                cluster_roles[role] = cluster_roles.get(role, 0) + int(count)
+    return resources
+
+def node_uid(address):
+    """
+    Returns the reference uid of a node from its address
+    e.g : parapluie-1-kavlan-4.rennes.grid5000.fr -> parapluie-1
+    """
+    return address.split('.')[0].split('-kavlan-')[0]
+
+def node_cluster(address):
+    "e.g : parapluie-1-kavlan-4.rennes.grid5000.fr -> parapluie"
+    return node_uid(address).split('-')[0]
+
+def node_facts(description):
+    """
+    Extracts the hardware facts used for the placement from the reference
+    description of a node.
+    """
+    nics = [nic for nic in description.get('network_adapters', [])
+            if nic.get('mountable')]
+    disks = description.get('storage_devices', [])
+    # The NICs mounted by default (configured, in the kavlan) first, the
+    # fastest first among them
+    fastest = sorted(nics, key=lambda nic: (not nic.get('mounted'),
+                                            -(nic.get('rate') or 0)))
+    return {
+        'cores': description.get('architecture', {}).get('nb_cores', 0),
+        'ram': description.get('main_memory', {}).get('ram_size', 0),
+        'ssd': any(d.get('storage') == 'SSD' for d in disks),
+        'nic_rate': max([nic.get('rate') or 0 for nic in nics] or [0]),
+        'nics': [str(nic['device']) for nic in fastest if nic.get('device')],
+        'switch': nics[0].get('switch') if nics else None
+    }
+
+def node_interfaces(nics):
+    """
+    Returns the (network_interface, neutron_external_interface) of a node
+    given its NICs, the mounted and fastest first. The network interface
+    carries the API and tenant traffic and the VIPs, so it must have an
+    address; a node with a single NIC gets a veth pair as external
+    interface.
+    """
+    return nics[0], nics[1] if len(nics) > 1 else VETH_INTERFACE
+
+def role_priority(role):
+    if role in ROLE_PRIORITIES:
+        return ROLE_PRIORITIES.index(role)
+    if role == COMPUTE_ROLE:
+        return len(ROLE_PRIORITIES) + 1
+    return len(ROLE_PRIORITIES)
+
+def score_nodes(nodes, facts):
+    """
+    Scores each node against the best node of the list for each fact.
+    Nodes without facts get a null score.
+    """
+    scores = {}
+    maxima = {}
+    for fact in ['cores', 'ram', 'nic_rate']:
+        maxima[fact] = max([facts[n.address][fact] for n in nodes
+                            if n.address in facts] or [0])
+    for node in nodes:
+        f = facts.get(node.address)
+        if f is None:
+            scores[node.address] = 0
+            continue
+        score = sum(float(f[fact]) / maximum for fact, maximum in maxima.items()
+                    if maximum > 0)
+        scores[node.address] = score + (1 if f['ssd'] else 0)
+    return scores
+
+class NodePool(object):
+    """
+    Nodes ranked from the strongest to the weakest, equivalent nodes are
+    kept in the given order. Picking a node costs O(1) (amortized), even
+    with thousands of nodes.
+    """
+    def __init__(self, nodes, scores, facts):
+        # sorted is stable
+        self.ranked = deque(sorted(nodes, key=lambda n: -scores[n.address]))
+        self.by_switch = {}
+        for node in self.ranked:
+            switch = facts.get(node.address, {}).get('switch')
+            self.by_switch.setdefault(switch, deque()).append(node)
+        self.taken = set()
+        self.left = len(self.ranked)
+
+    def _first(self, queue):
+        while queue and queue[0].address in self.taken:
+            queue.popleft()
+        return queue[0] if queue else None
+
+    def pick(self, switch=None):
+        "Picks the strongest node left, preferably on switch."
+        node = None
+        if switch is not None and switch in self.by_switch:
+            node = self._first(self.by_switch[switch])
+        if node is None:
+            node = self._first(self.ranked)
+        if node is not None:
+            self.taken.add(node.address)
+            self.left -= 1
+        return node
+
+    def remaining(self):
+        return [n for n in self.ranked if n.address not in self.taken]
+
 class G5kEngine(Engine):
-    def __init__(self, conf_file, force_deploy):
-        """Initialize the Execo Engine"""
+    def __init__(self, conf_file=DEFAULT_CONF_FILE, force_deploy=False, backend=None):
+        """
+        Initialize the Execo Engine.
+        The backend defaults to the one of the configuration (see load).
+        """
         super(G5kEngine, self).__init__()
 
         self.config_path = conf_file
         self.force_deploy = force_deploy
+        self.set_backend(backend or G5kBackend())
+
+    def set_backend(self, backend):
+        self.backend = backend
+        self.api = backend.api
 
     def load(self):
         """Load the configuration file"""
@@ -93,6 +256,13 @@ class G5kEngine(Engine):
         self.config.update(DEFAULT_CONFIG)
         self.config.update(config)
 
+        if self.config.get('backend', 'g5k') != 'g5k':
+            self.set_backend(make_backend(self.config))
+
+        # The reservation holds the nodes of all the deployments
+        if self.config.get('deployments'):
+            self.config['resources'] = merge_resources(self.config['deployments'])
+
         logger.info("Configuration file loaded : %s" % self.config_path)
         logger.info(pf(self.config))
 
@@ -103,7 +273,7 @@ class G5kEngine(Engine):
         This will perform a reservation if necessary."""
 
         # Look if there is a running job or make a new reservation
-        self.gridjob, _ = EX5.planning.get_job_by_name(self.config['name'])
+        self.gridjob = self.backend.get_job_by_name(self.config['name'])
 
         if self.gridjob is None:
             self._make_reservation()
@@ -112,12 +282,12 @@ class G5kEngine(Engine):
             
 
         # Wait for the job to start
-        EX5.wait_oargrid_job_start(self.gridjob)
+        self.backend.wait_job_start(self.gridjob)
 
         attempts = 0
         self.nodes = None
         while self.nodes is None and attempts < MAX_ATTEMPTS:
-            self.nodes = sorted(EX5.get_oargrid_job_nodes(self.gridjob),
+            self.nodes = sorted(self.backend.get_job_nodes(self.gridjob),
                                     key = lambda n: n.address)
             attempts += 1
 
@@ -126,31 +296,35 @@ class G5kEngine(Engine):
                 resources = self.config['resources'],
                 mode = self.config['role_distribution'])
 
-        # TODO - Start_date is never used, deadcode ? Ad_rien_ - August 11th 2016
-        self.start_date = None
-        job_info = EX5.get_oargrid_job_info(self.gridjob)
-        if 'start_date' in job_info:
-            self.start_date = job_info['start_date']
-
         ## filling some information about the jobs here
-        self.user = None
-        job_info = EX5.get_oargrid_job_info(self.gridjob)
-        if 'user' in job_info:
-            self.user = job_info['user']
-
-        ## vlans information
-        job_sites = EX5.get_oargrid_job_oar_jobs(self.gridjob)
+        job_info = self.backend.get_job_info(self.gridjob)
+        # TODO - Start_date is never used, deadcode ? Ad_rien_ - August 11th 2016
+        self.start_date = job_info.get('start_date')
+        self.walltime = job_info.get('walltime')
+        self.user = job_info.get('user')
+
+        ## vlans information, the sites are queried concurrently
+        job_sites = self.backend.get_job_sites(self.gridjob)
+        vlan_ids = self.api.map(lambda (job_id, site): self.backend.get_job_vlan(job_id, site),
+                                job_sites)
         self.jobs = []
         self.vlans = []
-        for (job_id, site) in job_sites:
+        for (job_id, site), vlan_id in zip(job_sites, vlan_ids):
             self.jobs.append((site, job_id))
-            vlan_id = EX5.get_oar_job_kavlan(job_id, site)
             if vlan_id is not None:
-                self.vlans.append((site, EX5.get_oar_job_kavlan(job_id, site)))
+                self.vlans.append((site, vlan_id))
 
         return self.gridjob
 
-    def deploy(self):
+    def deploy(self, bootstrap=False):
+        """
+        Deploys the nodes, and bootstraps them (see bootstrap) with bootstrap.
+
+        With pipeline_deploy, each cluster is deployed on its own and its
+        nodes are bootstrapped as soon as they are deployed, while the slower
+        clusters are still deploying. The nodes that fail the bootstrap are
+        left out of the deployed nodes.
+        """
         # we put the nodes in the first vlan we have
         vlan = self._get_primary_vlan()
          # Deploy all the nodes
@@ -158,12 +332,49 @@ class G5kEngine(Engine):
             len(self.nodes),
             '(forced)' if self.force_deploy else ''))
 
-        deployed, undeployed = EX5.deploy(
-        EX5.Deployment(
-            self.nodes,
-            env_name=self.config['env_name'],
-            vlan = vlan[1]
-        ), check_deployed_command=not self.force_deploy)
+        if self.config.get('pipeline_deploy'):
+            batches = [list(nodes) for _, nodes in groupby(
+                sorted(self.nodes, key=lambda n: n.address),
+                key=lambda n: node_cluster(n.address))]
+        else:
+            batches = [self.nodes]
+
+        deployed = set()
+        undeployed = set()
+        failed = set()
+        errors = []
+        lock = threading.Lock()
+
+        def deploy_batch(nodes):
+            d, u = self.backend.deploy(
+                nodes,
+                self.config['env_name'],
+                vlan[1],
+                not self.force_deploy)
+            with lock:
+                deployed.update(d)
+                undeployed.update(u)
+            if bootstrap and len(d) > 0:
+                hosts = translate_to_vlan(map(lambda n: EX.Host(n), d), vlan[1])
+                try:
+                    f = self.bootstrap(hosts)
+                except fanout.FanoutError as e:
+                    errors.append(e)
+                    f = [h.address for h in hosts]
+                with lock:
+                    failed.update(f)
+
+        if len(batches) == 1:
+            deploy_batch(batches[0])
+        else:
+            threads = [threading.Thread(target=deploy_batch, args=(nodes,))
+                       for nodes in batches]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        if errors:
+            raise errors[0]
 
         # Check the deployment
         if len(undeployed) > 0:
@@ -175,8 +386,9 @@ class G5kEngine(Engine):
         self.nodes = sorted(translate_to_vlan(self.nodes, vlan[1]),
                             key = lambda n: n.address)
         logger.info(self.nodes)
-        self.deployed_nodes = sorted(translate_to_vlan(
-                                        map(lambda n: EX.Host(n), deployed), vlan[1]),
+        self.deployed_nodes = sorted([n for n in translate_to_vlan(
+                                        map(lambda n: EX.Host(n), deployed), vlan[1])
+                                      if n.address not in failed],
                                 key = lambda n: n.address)
         logger.info(self.deployed_nodes)
         check_nodes(
@@ -186,66 +398,196 @@ class G5kEngine(Engine):
 
         return deployed, undeployed
 
-    def exec_command_on_nodes(self, nodes, cmd, label, conn_params=None):
-        """Execute a command on a node (id or hostname) or on a set of nodes"""
+    def exec_command_on_nodes(self, nodes, cmd, label, conn_params=None,
+                              retries=None, quorum=None):
+        """
+        Execute a command on a node (id or hostname) or on a set of nodes.
+        Returns the fanout.FanoutResult, raises fanout.FanoutError if less
+        than the quorum of nodes succeeded.
+        """
         if not isinstance(nodes, list):
             nodes = [nodes]
 
         if conn_params is None:
             conn_params = DEFAULT_CONN_PARAMS
+        if retries is None:
+            retries = self.config.get('exec_retries', 0)
+        if quorum is None:
+            quorum = self.config.get('exec_quorum', 1.0)
 
         logger.info(label)
-        remote = EX.Remote(cmd, nodes, conn_params)
-        remote.run()
+        result = fanout.run(self.backend, cmd, nodes, conn_params, label,
+                            retries=retries, quorum=quorum)
+        if not result.ok:
+            raise fanout.FanoutError(result)
+        return result
+
+    def bootstrap(self, nodes):
+        """
+        Runs the BOOTSTRAP_COMMANDS on the nodes, the nodes that fail a
+        command are left aside for the next ones. Returns the failed nodes.
+        """
+        failed = []
+        for cmd, label in BOOTSTRAP_COMMANDS:
+            result = self.exec_command_on_nodes(
+                [n for n in nodes if n.address not in failed],
+                cmd,
+                "%s on %d nodes..." % (label, len(nodes) - len(failed)))
+            failed.extend(result.failed)
+        return failed
+
+    def remove_nodes(self, addresses):
+        """Leaves the nodes aside, the deployed nodes must still be enough."""
+        addresses = set(addresses)
+        if not addresses:
+            return
+        self.deployed_nodes = [n for n in self.deployed_nodes
+                               if n.address not in addresses]
+        check_nodes(
+                nodes = self.deployed_nodes,
+                resources = self.config['resources'],
+                mode = self.config['role_distribution'])
 
-        if not remote.finished_ok:
-            sys.exit(31)
+    def get_nodes_facts(self, nodes):
+        """
+        Returns the hardware facts of each node (indexed by address) from
+        the reference API. Clusters that can't be looked up are skipped.
+        """
+        facts = {}
+        for cluster, cluster_nodes in groupby(
+                sorted(nodes, key=lambda n: n.address),
+                lambda node: node_uid(node.address).split('-')[0]):
+            try:
+                descriptions = dict((d['uid'], d) for d in
+                                    self.api.get_cluster_nodes(cluster))
+            except Exception as e:
+                logger.warning("No hardware description for cluster %s: %s" %
+                               (cluster, e))
+                continue
+            for node in cluster_nodes:
+                description = descriptions.get(node_uid(node.address))
+                if description is not None:
+                    facts[node.address] = node_facts(description)
+        return facts
+
+    def screen_nodes(self):
+        """
+        Runs the screening benchmarks on all the deployed nodes at once.
+        The outliers are removed from the deployed nodes so that build_roles
+        uses the spare nodes of the reservation instead. A cluster only
+        loses as many outliers as it has spare nodes, the other outliers are
+        kept.
 
-    def build_roles(self):
+        Returns the results of each node and the excluded outliers.
+        """
+        logger.info("Screening %d nodes..." % len(self.deployed_nodes))
+        references = [n.address for n in self.deployed_nodes[:2]]
+        results = {}
+        screened = fanout.run(self.backend, screening.screening_command(references),
+                              self.deployed_nodes, DEFAULT_CONN_PARAMS, 'Screening',
+                              quorum=0, timeout=SCREENING_TIMEOUT)
+        for host, result in screened.results.items():
+            if result.ok:
+                results[host] = screening.parse_results(result.stdout)
+        clusters = dict((n.address, node_cluster(n.address))
+                        for n in self.deployed_nodes)
+        outliers = screening.find_outliers(results, clusters,
+                                           self.config['screening_tolerance'])
+
+        # Spare nodes of each cluster, beyond its resources
+        spares = {}
+        for cluster in clusters.values():
+            spares[cluster] = spares.get(cluster, 0) + 1
+        for cluster, roles in self.config['resources'].items():
+            spares[cluster] = spares.get(cluster, 0) - sum(map(int, roles.values()))
+        excluded, kept = screening.select_outliers(outliers, clusters, spares)
+        for address, reasons in sorted(excluded.items()):
+            logger.warning("Excluding %s: %s" % (style.host(address), ', '.join(reasons)))
+        for address, reasons in sorted(kept.items()):
+            logger.warning("Keeping %s, no spare node to replace it: %s" %
+                           (style.host(address), ', '.join(reasons)))
+
+        self.remove_nodes(excluded.keys())
+
+        return results, excluded
+
+    def build_roles(self, facts=None, nodes=None, resources=None):
         """
         Returns a dict that maps each role to a list of G5K nodes::
 
           { 'controller': [paravance-1, paravance-5], 'compute': [econome-1] }
+
+        nodes and resources default to the deployed nodes and the resources
+        of the config, they are given when the reservation is shared by
+        several deployments.
+
+        The nodes of each cluster are given to its roles in turn, the most
+        latency critical roles first (see ROLE_PRIORITIES). Each role takes
+        the strongest node left, latency critical roles prefer the switch of
+        the first node placed. facts maps an address to its hardware facts
+        and defaults to the reference API facts.
         """
+        if nodes is None:
+            nodes = self.deployed_nodes
+        if resources is None:
+            resources = self.config['resources']
+        if facts is None:
+            facts = self.get_nodes_facts(nodes)
+        scores = score_nodes(nodes, facts)
+
         def mk_pools():
             "Indexes each node by its cluster to construct pools of nodes."
             pools = {}
-            for cluster, nodes in groupby(
-                    self.deployed_nodes, lambda node: node.address.split('-')[0]):
-                pools.setdefault(cluster, []).extend(list(nodes))
-
-            return pools
-
-        def pick_nodes(pool, n):
-            "Picks n node in a pool of nodes."
-            nodes = pool[:n]
-            del pool[:n]
-            return nodes
+            for node in sorted(nodes, key=lambda n: n.address):
+                cluster = node_cluster(node.address)
+                pools.setdefault(cluster, []).append(node)
+            return dict((cluster, NodePool(cluster_nodes, scores, facts))
+                        for cluster, cluster_nodes in pools.items())
 
         # Maps a role (eg, controller) with a list of G5K node
-        roles_set = set()
-        for roles in self.config['resources'].values():
-            roles_set.update(roles.keys())
-        roles = {k: [] for k in roles_set}
-        roles_goal = {k: 0 for k in roles_set}
-
-        # compute the aggregated number of nodes per roles
-        for r in self.config['resources'].values():
-            for k,v in r.items():
-                roles_goal[k] = roles_goal[k] + v
+        roles = {}
+        for rs in resources.values():
+            for r in rs.keys():
+                roles[r] = []
 
         pools = mk_pools()
-        for cluster, rs in self.config['resources'].items():
-            current = pick_nodes(pools[cluster], 1)
-            # distribute node into roles
-            for r in rs.keys() * len(self.deployed_nodes):
-                if current == []:
-                    break
-                if current != [] and len(roles[r]) < roles_goal[r]:
-                    roles.setdefault(r, []).extend(current)
-                    current = pick_nodes(pools[cluster], 1)
+        switch = None
+        for cluster in sorted(resources.keys()):
+            rs = resources[cluster]
+            pool = pools.get(cluster, NodePool([], scores, facts))
+            goal = dict((r, int(n)) for r, n in rs.items())
+            placed = dict((r, 0) for r in rs.keys())
+            # distribute nodes into roles one round at a time, so that
+            # each role gets a node before a role gets a second one
+            ordered_roles = sorted(rs.keys(), key=lambda r: (role_priority(r), r))
+            while pool.left > 0 and any(placed[r] < goal[r] for r in rs.keys()):
+                for r in ordered_roles:
+                    if placed[r] >= goal[r]:
+                        continue
+                    critical = role_priority(r) < role_priority(COMPUTE_ROLE)
+                    node = pool.pick(switch if critical else None)
+                    if node is None:
+                        break
+                    if critical and switch is None:
+                        switch = facts.get(node.address, {}).get('switch')
+                    roles[r].append(node)
+                    placed[r] += 1
+
+        # Roles that didn't get any node take the spare nodes of other
+        # clusters (only possible outside of the strict mode)
+        spares = NodePool([n for cluster in sorted(pools.keys())
+                           for n in pools[cluster].remaining()], scores, facts)
+        for r in sorted(roles.keys(), key=lambda r: (role_priority(r), r)):
+            if roles[r] == [] and spares.left > 0:
+                roles[r].append(spares.pick(switch))
 
         logger.info("Roles: %s" % pf(roles))
+        for r in sorted(roles.keys()):
+            if r == COMPUTE_ROLE:
+                continue
+            for node in roles[r]:
+                logger.info("%s on %s %s" % (r, node.address,
+                                             facts.get(node.address, 'no hardware facts')))
         at_least_one = all(len(n) >= 1 for n in roles.values())
         if not at_least_one:
             # Even if we aren't in strict mode we garantee that
@@ -265,8 +607,10 @@ class G5kEngine(Engine):
         # Actual criteria are :
         # - Number of node per site
         for cluster, roles in self.config["resources"].items():
-            site = get_cluster_site(cluster)
+            site = self.api.get_cluster_site(cluster)
             nb_nodes = reduce(operator.add, map(int, roles.values()))
+            if self.config.get('screening'):
+                nb_nodes += int(self.config.get('screening_spares', 0))
             criterion = "{cluster='%s'}/nodes=%s" % (cluster, nb_nodes)
             criteria.setdefault(site, []).append(criterion)
 
@@ -280,12 +624,10 @@ class G5kEngine(Engine):
         logger.info("Criteria for the reservation: %s" % pf(jobs_specs))
 
         # Make the reservation
-        gridjob, _ = EX5.oargridsub(
+        gridjob = self.backend.reserve(
             jobs_specs,
-            reservation_date=self.config['reservation'],
-            walltime=self.config['walltime'].encode('ascii', 'ignore'),
-            job_type='deploy'
-        )
+            self.config['reservation'],
+            self.config['walltime'].encode('ascii', 'ignore'))
 
         # TODO - move this upper to not have a side effect here
         if gridjob is not None:
@@ -315,12 +657,35 @@ class G5kEngine(Engine):
         return list(range_ips[-3-count:-3])
 
     def get_cluster_nics(self, cluster):
-        site = EX5.get_cluster_site(cluster)
-        nics = EX5.get_resource_attributes('/sites/%s/clusters/%s/nodes' % (site, cluster))['items'][0]['network_adapters']
-        return [nic['device'] for nic in nics if nic['mountable']]
+        return self.api.get_cluster_nics(cluster)
+
+    def get_nodes_interfaces(self, nodes, facts):
+        """
+        Returns the (network_interface, neutron_external_interface) of each
+        node (indexed by address) from its hardware facts. Nodes without
+        facts get the NICs of the first node of their cluster.
+        """
+        interfaces = {}
+        cluster_nics = {}
+        single = []
+        for node in nodes:
+            nics = facts.get(node.address, {}).get('nics')
+            if not nics:
+                cluster = node_cluster(node.address)
+                if cluster not in cluster_nics:
+                    cluster_nics[cluster] = [str(nic) for nic in self.get_cluster_nics(cluster)]
+                nics = cluster_nics[cluster]
+            interfaces[node.address] = node_interfaces(nics)
+            if len(nics) == 1:
+                single.append(node.address)
+        if single:
+            logger.warning("%d nodes have only one NIC (%s...). The same interface "
+                           "will be used for network_interface and "
+                           "neutron_external_interface." % (len(single), single[0]))
+        return interfaces
 
     def delete_job(self):
-        EX5.oardel([self.gridjob])
+        self.backend.delete_job(self.gridjob)
 
     def generate_sshtunnels(self, internal_vip_address):
         logger.info("ssh tunnel informations:")
@@ -0,0 +1,243 @@
+"""
+Open-loop load generator of the OpenStack APIs.
+
+Rally keeps a fixed number of iterations in flight: when OpenStack slows
+down, the load it offers drops too. Here the requests are sent at a target
+arrival rate whatever the response times are. Each request is due at a
+date of the schedule and handed to a pool of threads; its latency is
+measured from the date it was due, so the time spent waiting for a free
+thread when OpenStack can't keep up is counted.
+
+The sessions are keystoneauth sessions (one per thread), they keep their
+HTTP connections open between the requests.
+"""
+import math
+import random
+import threading
+import time
+import Queue
+
+from execo_engine import logger
+
+# Latencies are recorded in microseconds, with 2^SUB_BUCKET_BITS buckets
+# per power of two (less than 1% of error)
+SUB_BUCKET_BITS = 7
+PERCENTILES = [50, 90, 99, 99.9]
+
+# The servers and ports created by the operations are deleted right away
+BOOT_FLAVOR = 'm1.tiny'
+BOOT_IMAGE = 'cirros.uec'
+PORT_NETWORK = 'public1'
+
+
+class Histogram(object):
+    """
+    Log-linear histogram of latencies, in the spirit of HdrHistogram: the
+    values are counted in buckets whose width is a fixed fraction of their
+    value, so percentiles keep their precision from microseconds to minutes.
+    The failed requests are counted too.
+    """
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.errors = 0
+        self.max = 0
+        self.lock = threading.Lock()
+
+    def index(self, value):
+        value = max(int(value), 1)
+        magnitude = int(math.log(value, 2))
+        sub = int((float(value) / 2 ** magnitude - 1) * 2 ** SUB_BUCKET_BITS)
+        return magnitude, min(sub, 2 ** SUB_BUCKET_BITS - 1)
+
+    def value(self, index):
+        "Upper bound of a bucket."
+        magnitude, sub = index
+        return 2 ** magnitude * (1 + float(sub + 1) / 2 ** SUB_BUCKET_BITS)
+
+    def record(self, value, error=False):
+        index = self.index(value)
+        with self.lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.total += 1
+            if error:
+                self.errors += 1
+            self.max = max(self.max, value)
+
+    def percentile(self, p):
+        if self.total == 0:
+            return 0
+        rank = math.ceil(p / 100.0 * self.total)
+        seen = 0
+        for index in sorted(self.counts.keys()):
+            seen += self.counts[index]
+            if seen >= rank:
+                return min(self.value(index), self.max)
+        return self.max
+
+
+def credentials(keystone_addr):
+    "Credentials of the admin of the OpenStack at keystone_addr."
+    return dict(auth_url='http://%s:5000/v3' % keystone_addr,
+                username='admin',
+                password='demo',
+                project_name='admin',
+                user_domain_id='default',
+                project_domain_id='default')
+
+
+def session(keystone_addr):
+    """
+    Keystoneauth session of the admin, see
+    http://docs.openstack.org/developer/keystoneauth/using-sessions.html
+    """
+    from keystoneauth1.identity import v3
+    from keystoneauth1 import session
+    return session.Session(auth=v3.Password(**credentials(keystone_addr)))
+
+
+def _find(sess, service_type, path, key, name):
+    items = sess.get(path, endpoint_filter={'service_type': service_type}).json()[key]
+    for item in items:
+        if item['name'] == name:
+            return item['id']
+    raise Exception("No %s named %s, run init-os first" % (key, name))
+
+
+def token(sess, context):
+    # A new auth plugin has no token yet, it asks keystone for one
+    from keystoneauth1.identity import v3
+    v3.Password(**context['auth']).get_token(sess)
+
+
+def nova_list(sess, context):
+    sess.get('/servers', endpoint_filter={'service_type': 'compute'})
+
+
+def nova_boot(sess, context):
+    server = sess.post('/servers', endpoint_filter={'service_type': 'compute'}, json={
+        'server': {'name': 'loadgen', 'flavorRef': context['flavor'],
+                   'imageRef': context['image']}
+    }).json()['server']
+    context['cleanup'].put(('compute', '/servers/%s' % server['id']))
+
+
+def glance_list(sess, context):
+    sess.get('/v2/images', endpoint_filter={'service_type': 'image'})
+
+
+def neutron_port(sess, context):
+    port = sess.post('/v2.0/ports', endpoint_filter={'service_type': 'network'},
+                     json={'port': {'network_id': context['network']}}).json()['port']
+    context['cleanup'].put(('network', '/v2.0/ports/%s' % port['id']))
+
+
+OPERATIONS = {
+    'token': token,
+    'nova-list': nova_list,
+    'nova-boot': nova_boot,
+    'glance-list': glance_list,
+    'neutron-port': neutron_port,
+}
+
+
+def prepare(keystone_addr, operation):
+    "Looks up what the operation needs (flavor, image, network)."
+    sess = session(keystone_addr)
+    context = {
+        'auth': credentials(keystone_addr),
+        'cleanup': Queue.Queue()
+    }
+    if operation == 'nova-boot':
+        context['flavor'] = _find(sess, 'compute', '/flavors', 'flavors', BOOT_FLAVOR)
+        context['image'] = _find(sess, 'image', '/v2/images', 'images', BOOT_IMAGE)
+    elif operation == 'neutron-port':
+        context['network'] = _find(sess, 'network', '/v2.0/networks', 'networks', PORT_NETWORK)
+    return context
+
+
+def cleanup(sess, context):
+    "Deletes the resources created by the operation."
+    while not context['cleanup'].empty():
+        service_type, path = context['cleanup'].get()
+        try:
+            sess.delete(path, endpoint_filter={'service_type': service_type})
+        except Exception as e:
+            logger.warning("Can't delete %s: %s" % (path, e))
+
+
+def schedule(rate, duration, poisson=False, seed=0):
+    """
+    Dates (seconds from the start) at which the requests are due: evenly
+    spaced, or with exponential gaps (poisson arrivals).
+    """
+    if not poisson:
+        return [float(k) / rate for k in range(int(duration * rate))]
+    rng = random.Random(seed)
+    dates = []
+    date = 0.0
+    while date < duration:
+        dates.append(date)
+        date += rng.expovariate(rate)
+    return dates
+
+
+def run_rate(keystone_addr, function, context, rate, duration, workers, poisson=False):
+    """
+    Offers rate requests per second during duration seconds. Returns the
+    histogram of the latencies (microseconds) and the duration until the
+    last response.
+    """
+    histogram = Histogram()
+    due = Queue.Queue()
+
+    def worker():
+        sess = session(keystone_addr)
+        while True:
+            date = due.get()
+            if date is None:
+                return
+            try:
+                function(sess, context)
+                error = False
+            except Exception:
+                error = True
+            histogram.record((time.time() - date) * 1e6, error)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    start = time.time()
+    for date in schedule(rate, duration, poisson):
+        delay = start + date - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        due.put(start + date)
+    for _ in threads:
+        due.put(None)
+    for thread in threads:
+        thread.join()
+    return histogram, time.time() - start
+
+
+def run(keystone_addr, operation, rates, duration, workers, poisson=False):
+    """
+    Runs the operation at each rate, returns a row per rate: offered rate,
+    achieved rate (successful requests per second), errors and the latency
+    percentiles (ms).
+    """
+    function = OPERATIONS[operation]
+    context = prepare(keystone_addr, operation)
+    rows = []
+    for rate in rates:
+        logger.info("%s at %s requests/s during %ds" % (operation, rate, duration))
+        histogram, elapsed = run_rate(keystone_addr, function, context,
+                                      rate, duration, workers, poisson)
+        cleanup(session(keystone_addr), context)
+        row = [rate, (histogram.total - histogram.errors) / elapsed, histogram.errors]
+        row.extend(histogram.percentile(p) / 1000.0 for p in PERCENTILES)
+        row.append(histogram.max / 1000.0)
+        rows.append(row)
+    return rows
@@ -0,0 +1,125 @@
+"""
+Frontend work that doesn't need the nodes.
+
+prepare-node runs it in the background while it waits for the reservation
+and Kadeploy: the kolla repository is fetched in a cache that install-os
+clones from, and the cirros image that init-os uploads is downloaded. A
+failed prefetch is only a warning, the phases then fetch what they need
+themselves.
+
+install-os updates the cache before cloning it, as it may run long after
+the prefetch. The update is then only the commits pushed in between.
+"""
+import fcntl
+import os
+import shutil
+import threading
+from subprocess import call
+
+from execo_engine import logger
+
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kolla-g5k')
+CIRROS_URL = 'http://download.cirros-cloud.net/0.3.4/cirros-0.3.4-x86_64-disk.img'
+
+
+def kolla_cache(branch):
+    return os.path.join(CACHE_DIR, 'kolla-%s' % branch.replace('/', '-'))
+
+
+def cirros_cache(url=CIRROS_URL):
+    return os.path.join(CACHE_DIR, os.path.basename(url))
+
+
+def _lock(path):
+    "Locks path (the deployments of a reservation share the cache)."
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    lock = open(path + '.lock', 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def _fetch_kolla(repo, branch, path):
+    if os.path.isdir(path):
+        cmd = "cd %s && git fetch -q origin && git reset -q --hard origin/%s" % (path, branch)
+    else:
+        # Cloned aside so that an interrupted clone is never used
+        shutil.rmtree(path + '.tmp', ignore_errors=True)
+        cmd = "git clone -q %s -b %s %s.tmp && mv %s.tmp %s" % (repo, branch, path, path, path)
+    if call(cmd, shell=True) != 0:
+        raise Exception("Can't fetch %s" % repo)
+
+
+def fetch_kolla(repo, branch):
+    """Clones or updates the cached kolla repository."""
+    path = kolla_cache(branch)
+    with _lock(path):
+        _fetch_kolla(repo, branch, path)
+
+
+def clone_kolla(repo, branch, directory):
+    """
+    Clones kolla in directory/kolla from the cache, brought up to date with
+    repo first. Clones repo when the cache can't be updated. The origin of
+    the clone is repo.
+    """
+    path = kolla_cache(branch)
+    destination = os.path.join(directory, 'kolla')
+    with _lock(path):
+        try:
+            _fetch_kolla(repo, branch, path)
+            source = path
+        except Exception as e:
+            logger.warning("Can't update the kolla cache, cloning %s: %s" % (repo, e))
+            source = repo
+        return call("git clone -q %s -b %s %s > /dev/null && cd %s && git remote set-url origin %s"
+                    % (source, branch, destination, destination, repo), shell=True)
+
+
+def fetch_cirros(url=CIRROS_URL):
+    """Downloads the cirros image in the cache."""
+    import requests
+    path = cirros_cache(url)
+    if os.path.isfile(path):
+        return
+    response = requests.get(url)
+    response.raise_for_status()
+    with open(path + '.tmp', 'wb') as f:
+        f.write(response.content)
+    os.rename(path + '.tmp', path)
+
+
+class Prefetch(object):
+    "Runs functions in background threads until join is called."
+
+    def __init__(self):
+        self.threads = []
+        self.failed = []
+
+    def start(self, name, function, *args):
+        def run():
+            try:
+                function(*args)
+            except Exception as e:
+                logger.warning("Prefetch of %s failed: %s" % (name, e))
+                self.failed.append(name)
+        thread = threading.Thread(target=run, name=name)
+        # An exiting phase doesn't wait for the prefetch
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def join(self):
+        for thread in self.threads:
+            thread.join()
+        return self.failed
+
+
+def start(kolla_repo, kolla_branch):
+    """Starts the prefetch of kolla and cirros, returns the Prefetch."""
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    prefetch = Prefetch()
+    prefetch.start('kolla', fetch_kolla, kolla_repo, kolla_branch)
+    prefetch.start('cirros', fetch_cirros)
+    return prefetch
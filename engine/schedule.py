@@ -0,0 +1,159 @@
+"""
+Walltime aware scheduling of the phases and rally scenarios.
+
+The durations of the phases and of the rally scenarios are kept in a
+history shared by all the experiments. The history predicts how long the
+next steps need, so that the scenarios that can't end before the walltime
+of the job are left aside and the results are always collected.
+"""
+import math
+import os
+import sqlite3
+import time
+
+from execo_engine import logger
+
+HISTORY_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'kolla-g5k', 'durations.sqlite')
+
+PHASE = 'phase'
+SCENARIO = 'scenario'
+# Time between the end of the last scenario and the end of the bench
+# (reports, backups of influx, logs and configurations)
+COLLECT = 'collect'
+
+# Durations used until the history knows better (seconds)
+DEFAULT_DURATIONS = {
+    (PHASE, 'prepare-node'): 1800,
+    (PHASE, 'install-os'): 1800,
+    (PHASE, 'init-os'): 300,
+    (COLLECT, 'collect'): 900,
+}
+DEFAULT_SCENARIO_DURATION = 600
+
+# Phases mostly run on all the nodes in parallel, their duration grows
+# slower than the number of nodes
+NODES_EXPONENT = 0.5
+
+# Predictions are inflated to absorb the variability of the durations
+SAFETY_FACTOR = 1.2
+
+
+def _connect(path):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE IF NOT EXISTS durations ("
+               "kind TEXT, name TEXT, duration REAL, nodes INTEGER, "
+               "times INTEGER, concurrency INTEGER, date REAL)")
+    return db
+
+
+def rounds(times, concurrency):
+    "Number of rounds of iterations of a scenario."
+    return int(math.ceil(float(max(times, 1)) / max(concurrency, 1)))
+
+
+def record(kind, name, duration, nodes=1, times=1, concurrency=1, path=HISTORY_FILE):
+    """Adds a duration (seconds) to the history."""
+    try:
+        db = _connect(path)
+        with db:
+            db.execute("INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (kind, name, duration, nodes, times, concurrency, time.time()))
+        db.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning("Can't record the duration of %s %s: %s" % (kind, name, e))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def predict(kind, name, nodes=1, times=1, concurrency=1, path=HISTORY_FILE):
+    """
+    Predicts the duration (seconds) of a phase or a scenario.
+
+    Past durations of a phase are scaled by the number of nodes, the ones of
+    a scenario by its number of rounds of iterations (times / concurrency).
+    """
+    rows = []
+    if os.path.isfile(path):
+        db = _connect(path)
+        rows = db.execute("SELECT duration, nodes, times, concurrency FROM durations "
+                          "WHERE kind = ? AND name = ?", (kind, name)).fetchall()
+        db.close()
+
+    if rows == []:
+        if kind == SCENARIO:
+            return SAFETY_FACTOR * DEFAULT_SCENARIO_DURATION * rounds(times, concurrency)
+        return SAFETY_FACTOR * DEFAULT_DURATIONS.get((kind, name), 0)
+
+    if kind == SCENARIO:
+        per_round = median([d / rounds(t, c) for d, _, t, c in rows])
+        return SAFETY_FACTOR * per_round * rounds(times, concurrency)
+    return SAFETY_FACTOR * median([d * (float(nodes) / max(n, 1)) ** NODES_EXPONENT
+                                   for d, n, _, _ in rows])
+
+
+def remaining_walltime(job, now=None):
+    """
+    Seconds left before the end of the job. job holds the start_date and
+    the walltime of the job (see get_oargrid_job_info).
+    """
+    if now is None:
+        now = time.time()
+    return job['start_date'] + job['walltime'] - now
+
+
+def schedule(scenarios, remaining, times, concurrency, wait=0, path=HISTORY_FILE):
+    """
+    Picks the scenarios that fit in the remaining time, once the results are
+    collected. The order of the list is kept, a scenario that doesn't fit is
+    skipped and the next (shorter) ones are still considered.
+
+    Returns the kept scenarios, the skipped ones and the time the skipped
+    ones need.
+    """
+    available = remaining - predict(COLLECT, 'collect', path=path)
+    kept = []
+    skipped = []
+    missing = 0
+    for scenario in scenarios:
+        duration = wait + predict(SCENARIO, scenario, times=times,
+                                  concurrency=concurrency, path=path)
+        if duration <= available:
+            kept.append(scenario)
+            available -= duration
+        else:
+            skipped.append(scenario)
+            missing += duration
+    return kept, skipped, missing
+
+
+def extend_walltime(jobs, seconds):
+    """
+    Asks OAR for more walltime for each (site, job_id) of jobs.
+    Returns True if all the jobs have been extended.
+    """
+    from execo.process import get_process
+    from execo_g5k.config import default_frontend_connection_params
+    from execo_g5k.oar import format_oar_duration
+    from execo_g5k.utils import get_frontend_host
+
+    extended = True
+    for site, job_id in jobs:
+        process = get_process("oarwalltime %s +%s" % (job_id, format_oar_duration(seconds)),
+                              host=get_frontend_host(site),
+                              connection_params=default_frontend_connection_params)
+        process.nolog_exit_code = True
+        process.run()
+        if not process.ok:
+            logger.warning("Walltime of job %s on %s not extended: %s" %
+                           (job_id, site, process.stdout.strip()))
+            extended = False
+    return extended
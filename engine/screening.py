@@ -0,0 +1,111 @@
+"""
+Pre-flight screening of the deployed nodes.
+
+Short CPU, memory, disk and network micro-benchmarks are run on every node
+at the same time. Each benchmark reports a duration in milliseconds (lower
+is better) and a node is an outlier when one of its durations is far above
+the median of its cluster.
+"""
+
+# Only relies on the tools of the minimal images
+BENCHMARKS = [
+    ('cpu', 'dd if=/dev/zero bs=1M count=512 2>/dev/null | md5sum > /dev/null'),
+    ('memory', 'dd if=/dev/zero of=/dev/null bs=1M count=8192 2>/dev/null'),
+    ('disk', 'dd if=/dev/zero of=/tmp/screening bs=1M count=256 oflag=direct 2>/dev/null'
+             ' && rm -f /tmp/screening'),
+]
+
+# A node is an outlier if a duration is above (1 + tolerance) * median + slack
+DEFAULT_TOLERANCE = 0.5
+SLACK_MS = 1.0
+
+
+def screening_command(references):
+    """
+    Returns the shell command that runs the benchmarks and prints one
+    `<benchmark> <duration in ms>` line per benchmark. The network benchmark
+    is the average rtt to the first of the references that isn't the node
+    itself.
+    """
+    timed = ['s=$(date +%%s%%N); %s; e=$(date +%%s%%N); '
+             'echo %s $(( (e - s) / 1000 ))' % (command, name)
+             for name, command in BENCHMARKS]
+    reference = ("ref=$(for r in %s; do "
+                 "hostname -I | grep -qw \"$(getent hosts $r | awk '{ print $1 }')\" "
+                 "|| { echo $r; break; }; done)" % ' '.join(references))
+    # durations in us, converted to ms by parse_results
+    network = ("echo network $(ping -q -c 5 -i 0.2 ${ref:-%s} | "
+               "awk -F/ '/^rtt/ { printf \"%%d\", $5 * 1000 }')" % references[0])
+    return '; '.join(timed + [reference, network])
+
+
+def parse_results(output):
+    """Parses the output of the screening command of a node."""
+    results = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) != 2:
+            continue
+        try:
+            results[fields[0]] = int(fields[1]) / 1000.0
+        except ValueError:
+            continue
+    return results
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2 == 1:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def find_outliers(results, clusters, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns a dict that maps each outlier to the reasons it is one.
+
+    results maps an address to the results of its benchmarks, clusters maps
+    an address to its cluster. A node that misses a result is an outlier.
+    """
+    outliers = {}
+    by_cluster = {}
+    for address, cluster in clusters.items():
+        by_cluster.setdefault(cluster, []).append(address)
+
+    for cluster, addresses in by_cluster.items():
+        for name in [b[0] for b in BENCHMARKS] + ['network']:
+            values = [results[a][name] for a in addresses
+                      if name in results.get(a, {})]
+            if values == []:
+                continue
+            threshold = (1 + tolerance) * median(values) + SLACK_MS
+            for address in sorted(addresses):
+                value = results.get(address, {}).get(name)
+                if value is None:
+                    reason = "%s: no result" % name
+                elif value > threshold:
+                    reason = "%s: %.1f ms (cluster median %.1f ms)" % (name, value, median(values))
+                else:
+                    continue
+                outliers.setdefault(address, []).append(reason)
+    return outliers
+
+
+def select_outliers(outliers, clusters, spares):
+    """
+    Returns the outliers to exclude and the ones to keep: a cluster can
+    only lose as many nodes as it has spares (spares maps a cluster to its
+    number of spare nodes). The nodes failing the most benchmarks go first.
+    """
+    excluded, kept = {}, {}
+    ranked = sorted(outliers.items(), key=lambda o: (-len(o[1]), o[0]))
+    left = dict(spares)
+    for address, reasons in ranked:
+        cluster = clusters[address]
+        if left.get(cluster, 0) > 0:
+            excluded[address] = reasons
+            left[cluster] -= 1
+        else:
+            kept[address] = reasons
+    return excluded, kept
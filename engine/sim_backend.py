@@ -0,0 +1,195 @@
+"""
+Simulated backend of the G5kEngine.
+
+Fakes the reservation, the deployment, the reference API and the remote
+executions over any number of nodes, with configurable latencies and
+failure rates. Used to exercise prepare-node and to measure the overhead
+of kolla-g5k itself without Grid'5000.
+"""
+import random
+import re
+import threading
+import time
+
+from execo_g5k.oar import oar_duration_to_seconds
+from backend import HostResult
+import screening
+
+# Site of the simulated clusters (unknown clusters are in rennes)
+CLUSTER_SITES = {
+    'paravance': 'rennes',
+    'parasilo': 'rennes',
+    'parapluie': 'rennes',
+    'econome': 'nantes',
+    'graphene': 'nancy',
+    'griffon': 'nancy'
+}
+DEFAULT_SITE = 'rennes'
+# Nodes per switch
+SWITCH_SIZE = 20
+# Routed vlan given to a kavlan reservation
+VLAN_ID = 4
+
+RESOURCE_RE = re.compile(r"\{cluster='(?P<cluster>[^']+)'\}/nodes=(?P<nodes>\d+)")
+
+
+class SimulatedApi(object):
+    "Reference API of the simulated clusters"
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.requests = 0
+
+    def map(self, function, items):
+        return map(function, items)
+
+    def get_cluster_site(self, cluster):
+        return CLUSTER_SITES.get(cluster, DEFAULT_SITE)
+
+    def get_cluster_nodes(self, cluster):
+        self.requests += 1
+        self.backend.wait('api')
+        return [self.backend.describe(cluster, i)
+                for i in range(1, self.backend.clusters.get(cluster, 0) + 1)]
+
+    def get_cluster_nics(self, cluster):
+        return ['eth0', 'eth1']
+
+
+class SimulatedBackend(object):
+    """
+    clusters maps each cluster to its number of nodes. latencies maps an
+    operation (reserve, deploy, api, run) to its duration in seconds and
+    failure_rate is the probability that a node fails a deploy or a command.
+    Each node draws its failures from its own generator, so the clusters
+    deployed side by side fail the same way whatever the order of their
+    threads.
+    """
+
+    simulated = True
+
+    def __init__(self, clusters=None, latencies=None, failure_rate=0.0, seed=0):
+        self.clusters = clusters or {'paravance': 72}
+        self.latencies = latencies or {}
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.node_randoms = {}
+        self.lock = threading.Lock()
+        self.api = SimulatedApi(self)
+        self.jobs = {}
+        self.names = {}
+
+    def wait(self, operation):
+        latency = self.latencies.get(operation, 0)
+        if latency > 0:
+            time.sleep(latency)
+
+    def fails(self, address):
+        if self.failure_rate <= 0:
+            return False
+        with self.lock:
+            if address not in self.node_randoms:
+                self.node_randoms[address] = random.Random('%s-%s' % (self.seed, address))
+            node_random = self.node_randoms[address]
+        return node_random.random() < self.failure_rate
+
+    def describe(self, cluster, index):
+        "Reference description of a simulated node"
+        # Nodes of a cluster differ a bit, as on the real platform
+        variant = (index * 7919) % 10
+        return {
+            'uid': '%s-%d' % (cluster, index),
+            'architecture': {'nb_cores': 16 if variant else 12},
+            'main_memory': {'ram_size': (128 if variant > 1 else 96) * 2 ** 30},
+            'storage_devices': [{'storage': 'SSD' if variant > 7 else 'HDD'}],
+            'network_adapters': [
+                {'device': 'eth0', 'mountable': True, 'mounted': True, 'rate': 10 ** 10,
+                 'switch': 'gw-%d' % (index // SWITCH_SIZE)},
+                {'device': 'eth1', 'mountable': True, 'rate': 10 ** 10,
+                 'switch': 'gw-%d' % (index // SWITCH_SIZE)}
+            ]
+        }
+
+    def get_job_by_name(self, name):
+        return self.names.get(name)
+
+    def reserve(self, jobs_specs, reservation_date, walltime):
+        self.wait('reserve')
+        gridjob = len(self.jobs) + 1
+        nodes = []
+        sites = []
+        for i, (submission, site) in enumerate(jobs_specs):
+            vlan = 'kavlan' in submission.resources
+            sites.append((gridjob * 100 + i, site, vlan))
+            for match in RESOURCE_RE.finditer(submission.resources):
+                cluster = match.group('cluster')
+                count = min(int(match.group('nodes')), self.clusters.get(cluster, 0))
+                nodes.extend('%s-%d.%s.grid5000.fr' % (cluster, n, site)
+                             for n in range(1, count + 1))
+        self.jobs[gridjob] = {
+            'nodes': nodes,
+            'sites': sites,
+            'info': {
+                'start_date': int(time.time()),
+                'walltime': oar_duration_to_seconds(walltime),
+                'user': 'simulated'
+            }
+        }
+        self.names[submission.name] = gridjob
+        return gridjob
+
+    def wait_job_start(self, gridjob):
+        pass
+
+    def get_job_nodes(self, gridjob):
+        import execo as EX
+        return [EX.Host(address) for address in self.jobs[gridjob]['nodes']]
+
+    def get_job_info(self, gridjob):
+        return dict(self.jobs[gridjob]['info'])
+
+    def get_job_sites(self, gridjob):
+        return [(job_id, site) for job_id, site, _ in self.jobs[gridjob]['sites']]
+
+    def get_job_vlan(self, job_id, site):
+        for gridjob in self.jobs.values():
+            for j, s, vlan in gridjob['sites']:
+                if (j, s) == (job_id, site) and vlan:
+                    return VLAN_ID
+        return None
+
+    def deploy(self, nodes, env_name, vlan, check_deployed):
+        self.wait('deploy')
+        deployed = set()
+        undeployed = set()
+        for node in nodes:
+            (undeployed if self.fails(node.address) else deployed).add(node.address)
+        return deployed, undeployed
+
+    def output(self, cmd, address):
+        "Output of cmd, only the screening benchmarks print something"
+        if 'echo network' not in cmd:
+            return ''
+        return ''.join("%s %d\n" % (name, self.random.randint(900, 1100) * 1000)
+                       for name in [b[0] for b in screening.BENCHMARKS] + ['network'])
+
+    def run(self, cmd, nodes, conn_params, timeout=None, tree=False, on_result=None):
+        self.wait('run')
+        results = []
+        for node in nodes:
+            ok = not self.fails(node.address)
+            result = HostResult(node.address, ok, 0 if ok else 1,
+                                self.latencies.get('run', 0),
+                                self.output(cmd, node.address) if ok else '',
+                                '' if ok else 'simulated failure')
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+        return results
+
+    def delete_job(self, gridjob):
+        for name, job in self.names.items():
+            if job == gridjob:
+                del self.names[name]
+        self.jobs.pop(gridjob, None)
@@ -0,0 +1,110 @@
+"""
+Persistent state of kolla-g5k.
+
+The state is stored in a sqlite database (one row per key, values encoded
+in json) so that a command can read only the keys it needs, and so that it
+doesn't depend on the classes of the libraries (e.g. execo.Host) that
+were used when it was written.
+"""
+import json
+import os
+import sqlite3
+
+from execo_engine import logger
+
+STATE_FILE = 'state.sqlite'
+# Legacy pickled state
+PICKLE_STATE_FILE = '.state'
+
+SCHEMA_VERSION = 1
+
+# Keys of the state and their type
+SCHEMA = {
+    'config'     : dict,       # The config
+    'config_file': basestring, # The initial config file
+    'deployment' : basestring, # Name of the deployment (empty if alone)
+    'deployments': list,       # Deployments sharing the reservation
+    'job'        : dict,       # Grid job, its oar jobs, start date and walltime
+    'nodes'      : dict,       # Roles with nodes addresses
+    'phase'      : basestring, # Last phase that have been run
+    'screening'  : dict,       # Screening results and outliers of the nodes
+    'timeline'   : list,       # Start/end timestamps of the phases
+    'user'       : basestring  # User id for this job
+}
+
+
+def to_addresses(nodes):
+    """
+    Converts a dict that maps a role to execo hosts to a dict that maps
+    a role to the addresses of the hosts
+    """
+    return dict((role, [getattr(n, 'address', n) for n in hosts])
+                for role, hosts in nodes.items())
+
+
+def _check(key, value):
+    if key not in SCHEMA:
+        logger.warning("Unknown state key %s" % key)
+    elif value is not None and not isinstance(value, SCHEMA[key]):
+        raise TypeError("State key %s must be a %s, got %s" %
+                        (key, SCHEMA[key].__name__, type(value).__name__))
+
+
+def _connect(state_dir):
+    db = sqlite3.connect(os.path.join(state_dir, STATE_FILE))
+    db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)")
+    db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+    return db
+
+
+def save(state_dir, state):
+    """Writes each key of state in the store of state_dir."""
+    for key, value in state.items():
+        _check(key, value)
+    db = _connect(state_dir)
+    with db:
+        db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(SCHEMA_VERSION),))
+        db.executemany("INSERT OR REPLACE INTO state VALUES (?, ?)",
+                       [(k, json.dumps(v)) for k, v in state.items()])
+    db.close()
+
+
+def load(state_dir, keys=None):
+    """
+    Reads the store of state_dir.
+    Only the given keys are read if any. Returns an empty dict if there
+    is no state yet.
+    """
+    if not os.path.isfile(os.path.join(state_dir, STATE_FILE)):
+        return _load_pickle(state_dir, keys)
+
+    db = _connect(state_dir)
+    version = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    if version is not None and int(version[0]) > SCHEMA_VERSION:
+        raise Exception("State of %s has version %s, this kolla-g5k only knows version %d" %
+                        (state_dir, version[0], SCHEMA_VERSION))
+    if keys is None:
+        rows = db.execute("SELECT key, value FROM state").fetchall()
+    else:
+        keys = list(keys)
+        rows = db.execute("SELECT key, value FROM state WHERE key IN (%s)" %
+                          ','.join('?' * len(keys)), keys).fetchall()
+    db.close()
+    return dict((k, json.loads(v)) for k, v in rows)
+
+
+def _load_pickle(state_dir, keys=None):
+    """Reads a legacy pickled state and converts it to the new store."""
+    pickle_path = os.path.join(state_dir, PICKLE_STATE_FILE)
+    if not os.path.isfile(pickle_path):
+        return {}
+
+    import pickle
+    with open(pickle_path, 'rb') as state_file:
+        state = pickle.load(state_file)
+    state['nodes'] = to_addresses(state.get('nodes', {}))
+    logger.info("Converting %s to %s" % (pickle_path, STATE_FILE))
+    save(state_dir, state)
+    if keys is not None:
+        state = dict((k, v) for k, v in state.items() if k in keys)
+    return state
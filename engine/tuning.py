@@ -0,0 +1,87 @@
+"""
+Tuning of the control plane derived from the hardware of the nodes.
+
+Each formula is a python expression of the facts of a host (`cores`,
+`ram_mb`), of the size of the deployment (`nodes`, `computes`) and of the
+formulas before it. The values of each host become variables of the
+inventory (`tuning_<name>`) used by the haproxy, galera and keystone
+patches; the GLOBALS go in globals.yml, sized for the weakest control node.
+"""
+from collections import OrderedDict
+
+from execo_engine import logger
+
+CONTROL_ROLE = 'control'
+COMPUTE_ROLE = 'compute'
+HOST_VAR_PREFIX = 'tuning_'
+TUNING_NAME = 'tuning.yml'
+
+# The buffers of a connection take about 34KB in haproxy, which gets an
+# eighth of the memory. maxconn is per process; haproxy stays on one
+# process since its stats socket (read by collectd) only sees one.
+FORMULAS = OrderedDict([
+    ('haproxy_nbproc', "1"),
+    ('haproxy_maxconn', "min(ram_mb * 1024 // 8 // 34 // haproxy_nbproc, 400000)"),
+    ('haproxy_service_maxconn', "haproxy_maxconn // 5"),
+    ('innodb_buffer_pool_size', "ram_mb // 4"),
+    ('mariadb_max_connections', "min(1000 * cores, 10000)"),
+    ('keystone_wsgi_processes', "max(2, cores // 2)"),
+    ('keystone_wsgi_threads', "max(1, 40 // keystone_wsgi_processes)"),
+    ('openstack_service_workers', "max(2, cores // 2)"),
+])
+
+# Formulas whose value goes in globals.yml
+GLOBALS = ['openstack_service_workers']
+
+BUILTINS = {'min': min, 'max': max, 'int': int, 'round': round}
+
+
+def formulas(overrides):
+    "The default formulas updated by the ones of the config."
+    result = OrderedDict(FORMULAS)
+    if isinstance(overrides, dict):
+        result.update(overrides)
+    return result
+
+
+def evaluate(formulas, facts, nodes, computes):
+    "Values of the formulas for a host."
+    scope = {
+        'cores': facts['cores'],
+        'ram_mb': facts['ram'] // 2 ** 20,
+        'nodes': nodes,
+        'computes': computes
+    }
+    values = OrderedDict()
+    for name, formula in formulas.items():
+        value = int(eval(formula, {'__builtins__': BUILTINS}, scope))
+        scope[name] = values[name] = value
+    return values
+
+
+def tune(roles, facts, overrides=None):
+    """
+    Returns the kolla globals and the variables of each host (indexed by
+    address). Hosts without hardware facts keep the default values of the
+    templates.
+    """
+    fs = formulas(overrides)
+    addresses = set(getattr(n, 'address', n) for nodes in roles.values() for n in nodes)
+    computes = len(roles.get(COMPUTE_ROLE, []))
+    values = {}
+    for address in sorted(addresses):
+        if address not in facts:
+            logger.warning("No hardware facts for %s, it is not tuned" % address)
+            continue
+        values[address] = evaluate(fs, facts[address], len(addresses), computes)
+
+    controls = [values[a] for a in (getattr(n, 'address', n) for n in roles.get(CONTROL_ROLE, []))
+                if a in values]
+    kolla_vars = {}
+    for name in GLOBALS:
+        if controls:
+            kolla_vars[name] = min(v[name] for v in controls)
+    host_vars = dict((address, dict((HOST_VAR_PREFIX + name, value)
+                                    for name, value in v.items() if name not in GLOBALS))
+                     for address, v in values.items())
+    return kolla_vars, host_vars
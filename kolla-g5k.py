@@ -4,11 +4,21 @@
 Usage:
   kolla-g5k.py [-h | --help] [-f CONFIG_PATH] [--force-deploy]
   kolla-g5k.py prepare-node [-f CONFIG_PATH] [--force-deploy] [-t TAGS | --tags=TAGS]
-  kolla-g5k.py install-os [--reconfigure] [-t TAGS | --tags=TAGS]
-  kolla-g5k.py init-os
-  kolla-g5k.py bench [--scenarios=SCENARIOS] [--times=TIMES] [--concurrency=CONCURRENCY] [--wait=WAIT]
-  kolla-g5k.py ssh-tunnel
-  kolla-g5k.py info
+  kolla-g5k.py install-os [--reconfigure] [-t TAGS | --tags=TAGS] [--deployment=NAME]
+  kolla-g5k.py init-os [--deployment=NAME]
+  kolla-g5k.py bench [--scenarios=SCENARIOS] [--times=TIMES] [--concurrency=CONCURRENCY] [--wait=WAIT] [--deployment=NAME]
+  kolla-g5k.py ssh-tunnel [--deployment=NAME]
+  kolla-g5k.py info [--deployment=NAME]
+  kolla-g5k.py logs index [--processes=PROCESSES] [--deployment=NAME]
+  kolla-g5k.py logs slowest <SERVICE> [--scenario=SCENARIO] [--limit=LIMIT] [--deployment=NAME]
+  kolla-g5k.py logs errors [--scenario=SCENARIO] [--deployment=NAME]
+  kolla-g5k.py logs request <REQUEST_ID> [--deployment=NAME]
+  kolla-g5k.py costs [--influx=URL] [--step=STEP] [--deployment=NAME]
+  kolla-g5k.py archive [--deployment=NAME]
+  kolla-g5k.py archive list [--host=HOST] [--kind=KIND] [--path=REGEXP] [--deployment=NAME]
+  kolla-g5k.py archive show <MEMBER> [--deployment=NAME]
+  kolla-g5k.py loadgen <OPERATION> [--rates=RATES] [--duration=DURATION] [--workers=WORKERS] [--poisson] [--deployment=NAME]
+  kolla-g5k.py campaign <CAMPAIGN> [--force-deploy] [--deployment=NAME]
 
 Options:
   -h --help                             Show this help message.
@@ -22,6 +32,28 @@ Options:
   --times=TIMES                         Number of times to run each scenario [default: 1].
   --concurrency=CONCURRENCY             Concurrency level of the tasks in each scenario [default: 1].
   --wait=WAIT                           Seconds to wait between two scenarios [default: 0].
+  --processes=PROCESSES                 Number of processes used to index the logs
+                                        (default: number of cpus).
+  --scenario=SCENARIO                   Only consider the time window of the rally
+                                        scenarios matching this name.
+  --limit=LIMIT                         Number of requests to show [default: 10].
+  --influx=URL                          Influx holding the metrics of the bench
+                                        (default: the influx of the deployment).
+  --step=STEP                           Seconds of the buckets the metrics are
+                                        aggregated in [default: 10].
+  --host=HOST                           Only list the files of this host.
+  --kind=KIND                           Only list the files of this kind (kolla-logs,
+                                        kolla-conf, influxdb, rally or result).
+  --path=REGEXP                         Only list the files whose path matches.
+  --rates=RATES                         Requests per second offered by each step of
+                                        the load, comma separated [default: 10,20,50,100].
+  --duration=DURATION                   Seconds of each step of the load [default: 60].
+  --workers=WORKERS                     Threads sending the requests [default: 64].
+  --poisson                             Poisson arrivals instead of evenly spaced requests.
+  --deployment=NAME                     Only act on this deployment of the reservation
+                                        (see `deployments` in the configuration file).
+                                        By default the phases of all the deployments
+                                        run side by side.
 
 Commands:
   prepare-node  Make a G5K reservation and install the docker registry
@@ -29,39 +61,34 @@ Commands:
   bench         Run rally on this OpenStack
   ssh-tunnel    Print configuration for port forwarding with horizon
   info          Show information of the actual deployment
+  logs          Index the collected kolla logs and query the index
+  costs         Resource cost of the rally scenarios and of their atomic actions
+  archive       Gather the results in a seekable archive, list and read its files
+  loadgen       Offer an open-loop load to an OpenStack API (token, nova-list,
+                nova-boot, glance-list or neutron-port) and measure its latency
+  campaign      Run a list of experiments on the same nodes
 """
 from docopt import docopt
 from subprocess import call
-import pickle
-import requests
 import pprint
 from operator import itemgetter, attrgetter
 
-from keystoneauth1.identity import v3
-from keystoneauth1 import session
-from novaclient import client as nclient
-from glanceclient import client as gclient
-from keystoneclient.v3 import client as kclient
-from neutronclient.neutron import client as ntnclient
-
-import sys, os, subprocess
+import sys, os, subprocess, time
+import csv
 from collections import namedtuple
-from ansible.parsing.dataloader import DataLoader
-from ansible.vars import VariableManager
-from ansible.inventory import Inventory
-from ansible.executor.playbook_executor import PlaybookExecutor
-from ansible.executor.stats import AggregateStats
-import ansible.plugins.callback
-
-import jinja2
+
+# Heavy libraries (ansible, execo_g5k, OpenStack clients...) are imported
+# by the phases that use them, to keep the other commands fast
 from execo.log import style
 from execo_engine import logger
-from engine.g5k_engine import G5kEngine
+import engine.state
 
 import yaml
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 SYMLINK_NAME = os.path.join(SCRIPT_PATH, 'current')
+# Directory of the deployment in use, see set_deployment
+DEPLOYMENT_DIR = SYMLINK_NAME
 TEMPLATE_DIR = os.path.join(SCRIPT_PATH, 'templates')
 
 KOLLA_REPO = 'https://git.openstack.org/openstack/kolla'
@@ -78,25 +105,128 @@ KOLLA_MANDATORY_GROUPS = [
     "storage"
 ]
 
-# State of the script
+# kolla, registry, influx, grafana and neutron external addresses
+VIPS_PER_DEPLOYMENT = 5
+
+# Nodes of this role are dedicated to rally, instead of the hosts of
+# disco/rally in the base inventory
+LOAD_ROLE = 'load'
+RALLY_GROUP = 'disco/rally'
+# Seconds given to ansible to reach all the rally hosts before the
+# scenarios start together
+RALLY_START_DELAY = 60
+
+# State of the script (see engine.state.SCHEMA)
 STATE = {
     'config' : {}, # The config
     'config_file' : '', # The initial config file
-    'nodes'  : {}, # Roles with nodes
+    'deployment' : '', # Name of the deployment (empty if alone in the reservation)
+    'deployments' : [], # Deployments sharing the reservation
+    'job'    : {}, # Grid job, its oar jobs, start date and walltime
+    'nodes'  : {}, # Roles with nodes addresses
     'phase'  : '', # Last phase that have been run
+    'screening' : {}, # Screening results and outliers of the nodes
+    'timeline' : [], # Start/end timestamps of the phases that have been run
     'user'   : ''  # User id for this job
 }
 
 def save_state():
-    state_path = os.path.join(SYMLINK_NAME, '.state')
-    with open(state_path, 'wb') as state_file:
-        pickle.dump(STATE, state_file)
+    engine.state.save(DEPLOYMENT_DIR, STATE)
+
+def load_state(keys=None):
+    if os.path.isdir(DEPLOYMENT_DIR):
+        STATE.update(engine.state.load(DEPLOYMENT_DIR, keys))
+
+def set_deployment(name):
+    """
+    Use the state and the files of a deployment of the reservation
+    """
+    global DEPLOYMENT_DIR
+    DEPLOYMENT_DIR = os.path.join(SYMLINK_NAME, name)
+    if not os.path.isdir(DEPLOYMENT_DIR):
+        logger.error("Unknown deployment %s" % name)
+        sys.exit(34)
 
-def load_state():
-    state_path = os.path.join(SYMLINK_NAME, '.state')
-    if os.path.isfile(state_path):
-        with open(state_path, 'rb') as state_file:
-            STATE.update(pickle.load(state_file))
+def start_phase(phase):
+    """
+    Mark the beginning of a phase in the timeline of the experiment
+    """
+    STATE['phase'] = phase
+    STATE.setdefault('timeline', []).append({
+        'phase': phase,
+        'start': time.time(),
+        'end'  : None
+    })
+
+def end_phase():
+    """
+    Mark the end of the current phase, record its duration and save the state
+    """
+    import engine.schedule
+    phase = STATE['timeline'][-1]
+    phase['end'] = time.time()
+    engine.schedule.record(engine.schedule.PHASE, phase['phase'],
+                           phase['end'] - phase['start'], nodes=count_nodes())
+    save_state()
+
+def count_nodes():
+    return len(set(a for addresses in STATE['nodes'].values() for a in addresses)) or 1
+
+def refresh_job():
+    """
+    Updates the start date and the walltime of the job (the walltime may
+    have been extended). Returns None if there is no job in the state.
+    """
+    job = STATE.get('job')
+    if not job or job.get('walltime') is None:
+        return None
+    if STATE['config'].get('backend') == 'simulated':
+        return job
+    try:
+        import execo_g5k as EX5
+        job_info = EX5.get_oargrid_job_info(job['gridjob'])
+        job['start_date'] = job_info.get('start_date', job['start_date'])
+        job['walltime'] = job_info.get('walltime', job['walltime'])
+    except Exception as e:
+        logger.warning("Can't refresh the job, using the state: %s" % e)
+    return job
+
+def ensure_walltime(needed, what):
+    """
+    Checks that needed seconds are left before the end of the job, and asks
+    for more walltime if walltime_extension is set. Returns the remaining
+    time, or None if the job is unknown.
+    """
+    import engine.schedule
+    job = refresh_job()
+    if job is None:
+        return None
+    remaining = engine.schedule.remaining_walltime(job)
+    if needed <= remaining:
+        return remaining
+    logger.warning("%s needs about %ds but only %ds are left in the job" %
+                   (what, needed, remaining))
+    if STATE['config'].get('walltime_extension') and \
+            engine.schedule.extend_walltime(job['jobs'], int(needed - remaining)):
+        job = refresh_job()
+        remaining = engine.schedule.remaining_walltime(job)
+        logger.info("Walltime extended, %ds left" % remaining)
+    return remaining
+
+def check_walltime(phases):
+    """
+    Warns (or extends the walltime) if the phases won't end before the job.
+    The job is only looked up when a phase is about to run.
+    """
+    if not phases:
+        return
+    import engine.schedule
+    needed = sum(engine.schedule.predict(engine.schedule.PHASE, phase, nodes=count_nodes())
+                 for phase in phases)
+    ensure_walltime(needed, ', '.join(phases))
+
+def to_rfc3339(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
 
 def update_config_state():
     """
@@ -104,11 +234,17 @@ def update_config_state():
     """
     config_file = STATE['config_file']
     with open(config_file, 'r') as f:
-        STATE['config'].update(yaml.load(f))
+        config = yaml.load(f)
+    STATE['config'].update(deployment_config(config, STATE['deployment']))
     logger.info("Reloaded config %s", STATE['config'] )
 
 
 def run_ansible(playbooks, inventory_path, extra_vars={}, tags=None):
+    from ansible.parsing.dataloader import DataLoader
+    from ansible.vars import VariableManager
+    from ansible.inventory import Inventory
+    from ansible.executor.playbook_executor import PlaybookExecutor
+
     variable_manager = VariableManager()
     loader = DataLoader()
 
@@ -172,6 +308,7 @@ def run_ansible(playbooks, inventory_path, extra_vars={}, tags=None):
             logger.error("Unreachable hosts: %s" % unreachable_hosts)
 
 def render_template(template_path, vars, output_path):
+    import jinja2
     loader = jinja2.FileSystemLoader(searchpath='.')
     env = jinja2.Environment(loader=loader)
     template = env.get_template(template_path)
@@ -180,22 +317,35 @@ def render_template(template_path, vars, output_path):
     with open(output_path, 'w') as f:
         f.write(rendered_text)
 
-def generate_inventory(roles, base_inventory, dest):
+def generate_inventory(roles, base_inventory, dest, host_vars=None):
     """
     Generate the inventory.
     It will generate a group for each role in roles and
     concatenate them with the base_inventory file.
+    When there are load nodes, they replace the children of disco/rally.
+    host_vars maps an address to its variables in the inventory.
     The generated inventory is written in dest
     """
+    overrides = {}
+    if roles.get(LOAD_ROLE):
+        overrides['[%s:children]' % RALLY_GROUP] = LOAD_ROLE
     with open(dest, 'w') as f:
-        f.write(to_ansible_group_string(roles))
+        f.write(to_ansible_group_string(roles, host_vars))
         with open(base_inventory, 'r') as a:
+            skip = False
             for line in a:
+                if line.startswith('['):
+                    skip = False
+                if skip:
+                    continue
                 f.write(line)
+                if line.strip() in overrides:
+                    f.write(overrides[line.strip()] + '\n\n')
+                    skip = True
 
     logger.info("Inventory file written to " + style.emph(dest))
 
-def to_ansible_group_string(roles):
+def to_ansible_group_string(roles, host_vars=None):
     """
     Transform a role list (oar) to an ansible list of groups (inventory)
     Make sure the mandatory group are set as well
@@ -212,7 +362,17 @@ def to_ansible_group_string(roles):
     n3
     [role2]
     n4
+    Each node gets its variables in host_vars, if any.
     """
+    if host_vars is None:
+        host_vars = {}
+
+    def host_line(node, role):
+        address = getattr(node, 'address', node)
+        variables = "".join(" %s=%s" % (k, v)
+                            for k, v in sorted(host_vars.get(address, {}).items()))
+        return "%s ansible_ssh_user=root g5k_role=%s%s" % (address, role, variables)
+
     inventory = []
     mandatory = [group for group in KOLLA_MANDATORY_GROUPS if group not in roles.keys()]
     for group in mandatory:
@@ -220,7 +380,7 @@ def to_ansible_group_string(roles):
 
     for role, nodes in roles.items():
         inventory.append("[%s]" % (role))
-        inventory.extend(map(lambda n: "%s ansible_ssh_user=root g5k_role=%s" % (n.address, role), nodes))
+        inventory.extend(host_line(n, role) for n in nodes)
     inventory.append("\n")
     return "\n".join(inventory)
 
@@ -250,59 +410,168 @@ def generate_kolla_files(config_vars, kolla_vars, directory):
     logger.info("admin-openrc generated in %s" % (admin_openrc_path))
 
 
+def deployment_config(config, name):
+    """
+    Returns the config of a deployment: the keys of its section under
+    `deployments` override the top level ones.
+    """
+    config = dict(config)
+    if name:
+        config.update(config['deployments'][name])
+    return config
+
+def prepare_deployment(name, config, roles, vip_addresses, interfaces, directory, facts=None):
+    """
+    Generates the inventory and the kolla files of a deployment in
+    directory. Returns the config of the deployment and the kolla vars.
+    interfaces maps each address to its (network_interface,
+    neutron_external_interface). They go in globals.yml when all the nodes
+    agree, otherwise they are variables of each host (see
+    write_kolla_host_vars). With the `tuning` config, the control plane is
+    sized after the hardware facts of the nodes (see engine.tuning).
+    """
+    tuning_vars, host_vars = {}, {}
+    if config.get('tuning'):
+        import engine.tuning
+        tuning_vars, host_vars = engine.tuning.tune(roles, facts or {}, config['tuning'])
+        tuning_path = os.path.join(directory, engine.tuning.TUNING_NAME)
+        with open(tuning_path, 'w') as f:
+            yaml.dump({
+                'formulas': dict(engine.tuning.formulas(config['tuning'])),
+                'globals': tuning_vars,
+                'hosts': host_vars
+            }, f, default_flow_style=False)
+        logger.info("Tuning written to " + style.emph(tuning_path))
+    from engine.g5k_engine import VETH_INTERFACE
+    interface_vars = {}
+    for address in set(getattr(n, 'address', n) for nodes in roles.values() for n in nodes):
+        network_interface, external_interface = interfaces[address]
+        interface_vars[address] = {
+            'network_interface': network_interface,
+            'neutron_external_interface': external_interface,
+            'enable_veth': external_interface == VETH_INTERFACE
+        }
+    # The variables of globals.yml and of the config are given as extra
+    # vars to ansible, they would override the ones of each host
+    common_interfaces = {}
+    if len(set(tuple(sorted(v.items())) for v in interface_vars.values())) == 1:
+        common_interfaces = interface_vars.values()[0]
+        kolla_host_vars = {}
+    else:
+        logger.warning("The nodes have different NICs, each gets its own "
+                       "network_interface and neutron_external_interface")
+        for address, variables in interface_vars.items():
+            host_vars.setdefault(address, {}).update(variables)
+        kolla_host_vars = interface_vars
+    config.update(common_interfaces)
+    # Kept to generate the inventory and the kolla host vars of the next
+    # experiments
+    config['host_vars'] = host_vars
+    config['kolla_host_vars'] = kolla_host_vars
+
+    inventory_path = os.path.join(directory, 'multinode')
+    generate_inventory(roles, config['inventory'], inventory_path, host_vars)
+
+    config.update({
+        'vip': str(vip_addresses[0]),
+        'registry_vip': str(vip_addresses[1]),
+        'influx_vip': str(vip_addresses[2]),
+        'grafana_vip': str(vip_addresses[3])
+    })
+    if name:
+        # Backups and the kolla checkout go in the deployment directory
+        link = os.path.join(SYMLINK_NAME, name)
+        config.update({
+            'backup_dir': link,
+            'kolla_root': link
+        })
+
+    kolla_vars = {
+        'kolla_internal_vip_address' : str(vip_addresses[0]),
+        'neutron_external_address'   : str(vip_addresses[4])
+    }
+    kolla_vars.update(common_interfaces)
+    kolla_vars.update(tuning_vars)
+
+    # Generating Ansible globals.yml, passwords.yml
+    generate_kolla_files(dict(config["kolla"]), kolla_vars, directory)
+    # Kept to generate the kolla files of the next experiments
+    config['kolla_vars'] = kolla_vars
+
+    return config, kolla_vars
+
+def write_kolla_host_vars(kolla_path, host_vars):
+    """
+    Writes the variables of each host in the host_vars directory of the
+    kolla playbooks. The group_vars/all.yml of kolla sets network_interface
+    and neutron_external_interface, and the group_vars of a playbook take
+    precedence over the variables of the hosts in the inventory, but not
+    over its host_vars.
+    """
+    directory = os.path.join(kolla_path, 'ansible', 'host_vars')
+    if host_vars and not os.path.isdir(directory):
+        os.makedirs(directory)
+    for address, variables in host_vars.items():
+        with open(os.path.join(directory, '%s.yml' % address), 'w') as f:
+            yaml.dump(variables, f, default_flow_style=False)
+
+def run_ansible_concurrently(runs):
+    """
+    Runs ansible for several deployments at the same time. Each run gets its
+    own process as the ansible executor isn't meant to be shared.
+    """
+    import multiprocessing
+    processes = []
+    for name, run_args in runs:
+        process = multiprocessing.Process(target=run_ansible, args=run_args, name=name)
+        process.start()
+        processes.append(process)
+    for process in processes:
+        process.join()
+
 def prepare_node(conf_file, force_deploy, tags):
+    from engine.g5k_engine import G5kEngine
+    from engine.fanout import FanoutError
+    import engine.prefetch
     g5k = G5kEngine(conf_file, force_deploy)
 
     g5k.start(args=[])
 
     STATE['config'].update(g5k.load())
 
+    # Kolla and cirros don't need the nodes, they are fetched while waiting
+    # for the reservation and the deployment
+    if not g5k.backend.simulated:
+        prefetch = engine.prefetch.start(KOLLA_REPO, KOLLA_BRANCH)
+
     g5k.get_job()
 
-    deployed, undeployed = g5k.deploy()
+    # Nodes that keep failing the bootstrap (within the exec_quorum) are
+    # left aside
+    try:
+        deployed, undeployed = g5k.deploy(bootstrap=True)
+    except FanoutError as e:
+        logger.error(str(e))
+        sys.exit(31)
     if len(undeployed) > 0:
         sys.exit(31)
 
-    roles = g5k.build_roles()
+    # Leave the slow nodes aside before assigning the roles
+    STATE['screening'] = {}
+    if STATE['config']['screening']:
+        results, outliers = g5k.screen_nodes()
+        STATE['screening'] = {'results': results, 'outliers': outliers}
 
-    # Get an IP for
+    # A reservation without `deployments` holds a single unnamed deployment
+    names = sorted(STATE['config'].get('deployments', {}).keys()) or ['']
+
+    # Get for each deployment an IP for
     # kolla (haproxy)
     # docker registry
     # influx db
     # grafana
-    vip_addresses = g5k.get_free_ip(5)
-    # Get the NIC devices of the reserved cluster
-    # XXX: this only works if all nodes are on the same cluster,
-    # or if nodes from different clusters have the same devices
-    interfaces = g5k.get_cluster_nics(STATE['config']['resources'].keys()[0])
-    network_interface = str(interfaces[0])
-    external_interface = None
-
-    if len(interfaces) > 1:
-        external_interface = str(interfaces[1])
-    else:
-        external_interface = 'veth0'
-        logger.warning("%s has only one NIC. The same interface "
-                       "will be used for network_interface and "
-                       "neutron_external_interface."
-                       % STATE['config']['resources'].keys()[0])
-
-
-    g5k.exec_command_on_nodes(
-        g5k.deployed_nodes,
-        'apt-get update && apt-get -y --force-yes install apt-transport-https',
-        'Installing apt-transport-https...')
-
-    # Install python on the nodes
-    g5k.exec_command_on_nodes(
-        g5k.deployed_nodes,
-        'apt-get -y install python',
-        'Installing Python on all the nodes...')
-
-    # Generates files for ansible/kolla
-    inventory_path = os.path.join(g5k.result_dir, 'multinode')
-    base_inventory = STATE['config']['inventory']
-    generate_inventory(roles, base_inventory, inventory_path)
+    # neutron external address
+    vip_addresses = g5k.get_free_ip(VIPS_PER_DEPLOYMENT * len(names))
 
     # Symlink current directory
     link = os.path.abspath(SYMLINK_NAME)
@@ -313,72 +582,125 @@ def prepare_node(conf_file, force_deploy, tags):
     os.symlink(g5k.result_dir, link)
     logger.info("Symlinked %s to %s" % (g5k.result_dir, link))
 
-    STATE['config'].update({
-        'vip': str(vip_addresses[0]),
-        'registry_vip': str(vip_addresses[1]),
-        'influx_vip': str(vip_addresses[2]),
-        'grafana_vip': str(vip_addresses[3]),
-        'network_interface': network_interface
-    })
+    # Each deployment gets its own nodes, block of addresses and
+    # directory (`current/<name>`)
+    nodes = list(g5k.deployed_nodes)
+    facts = g5k.get_nodes_facts(nodes)
+    # The fastest NIC of each node carries the API and tenant traffic, the
+    # next one the external traffic
+    interfaces = g5k.get_nodes_interfaces(nodes, facts)
+    deployments = []
+    for i, name in enumerate(names):
+        config = deployment_config(STATE['config'], name)
+        roles = g5k.build_roles(facts=facts, nodes=nodes, resources=config['resources'])
+        used = set(n.address for role_nodes in roles.values() for n in role_nodes)
+        nodes = [n for n in nodes if n.address not in used]
+
+        directory = os.path.join(g5k.result_dir, name)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        vips = vip_addresses[i * VIPS_PER_DEPLOYMENT:(i + 1) * VIPS_PER_DEPLOYMENT]
+        config, kolla_vars = prepare_deployment(name, config, roles, vips,
+                                                interfaces, directory, facts)
+        deployments.append((name, config, kolla_vars, roles, directory))
 
     # Run the Ansible playbooks
     playbook_path = os.path.join(SCRIPT_PATH, 'ansible', 'prepare-node.yml')
     passwords_path = os.path.join(TEMPLATE_DIR, "passwords.yml")
-    inventory_path = os.path.join(SYMLINK_NAME, 'multinode')
-    config = STATE['config'].copy()
     with open(passwords_path) as passwords_file:
-        config.update(yaml.load(passwords_file))
-
-    kolla_vars = {
-        'kolla_internal_vip_address' : str(vip_addresses[0]),
-        'network_interface'          : network_interface,
-        'neutron_external_interface' : external_interface,
-        'enable_veth'                : external_interface == 'veth0',
-        'neutron_external_address'   : str(vip_addresses[4])
-    }
-
-    config.update(kolla_vars)
+        passwords = yaml.load(passwords_file)
+    runs = []
+    for name, config, kolla_vars, roles, directory in deployments:
+        extra_vars = config.copy()
+        extra_vars.update(passwords)
+        extra_vars.update(kolla_vars)
+        inventory_path = os.path.join(SYMLINK_NAME, name, 'multinode')
+        runs.append((name, ([playbook_path], inventory_path, extra_vars, tags)))
+
+    if g5k.backend.simulated:
+        logger.info("Simulated nodes, the playbooks are not run")
+    elif len(runs) == 1:
+        run_ansible(*runs[0][1])
+    else:
+        run_ansible_concurrently(runs)
 
-    run_ansible([playbook_path], inventory_path, config, tags)
-
-    # Generating Ansible globals.yml, passwords.yml
-    generate_kolla_files(g5k.config["kolla"], kolla_vars, g5k.result_dir)
+    if not g5k.backend.simulated:
+        prefetch.join()
 
     # Fills the state and save it in the `current` directory
     # TODO: Manage STATE at __main__ level
     STATE['config_file'] = conf_file
-    STATE['nodes']  = roles
     STATE['user']   = g5k.user
+    STATE['job'] = {
+        'gridjob': g5k.gridjob,
+        'jobs': [[site, job_id] for site, job_id in g5k.jobs],
+        'start_date': g5k.start_date,
+        'walltime': g5k.walltime
+    }
+    if names == ['']:
+        _, config, _, roles, _ = deployments[0]
+        STATE['config'] = config
+        STATE['nodes'] = engine.state.to_addresses(roles)
+        STATE['deployment'] = ''
+        STATE['deployments'] = []
+        return
+
+    # The state of each deployment lives in its directory
+    for name, config, _, roles, directory in deployments:
+        engine.state.save(directory, {
+            'config': config,
+            'config_file': conf_file,
+            'deployment': name,
+            'deployments': [],
+            'job': STATE['job'],
+            'nodes': engine.state.to_addresses(roles),
+            'phase': 'prepare-node',
+            'screening': {},
+            'timeline': [],
+            'user': g5k.user
+        })
+    STATE['nodes'] = {}
+    for _, _, _, roles, _ in deployments:
+        for role, addresses in engine.state.to_addresses(roles).items():
+            STATE['nodes'].setdefault(role, []).extend(addresses)
+    STATE['deployment'] = ''
+    STATE['deployments'] = names
 
 def install_os(reconfigure, tags = None):
+    import engine.prefetch
     update_config_state()
 
+    # Deployments sharing a reservation have their own kolla checkout
+    kolla_root = STATE['config'].get('kolla_root', SCRIPT_PATH)
+    kolla_path = os.path.join(kolla_root, "kolla")
+
     # Clone or pull Kolla
-    if os.path.isdir('kolla'):
+    if os.path.isdir(kolla_path):
         logger.info("Remove previous Kolla installation")
-        kolla_path = os.path.join(SCRIPT_PATH, "kolla")
         call("rm -rf %s" % kolla_path, shell=True)
 
     logger.info("Cloning Kolla")
-    call("cd %s ; git clone %s -b %s > /dev/null" % (SCRIPT_PATH, KOLLA_REPO, KOLLA_BRANCH), shell=True)
+    engine.prefetch.clone_kolla(KOLLA_REPO, KOLLA_BRANCH, kolla_root)
 
     logger.warning("Patching kolla, this should be \
             deprecated with the new version of Kolla")
 
     playbook = os.path.join(SCRIPT_PATH, "ansible/patches.yml")
-    inventory_path = os.path.join(SYMLINK_NAME, 'multinode')
+    inventory_path = os.path.join(DEPLOYMENT_DIR, 'multinode')
     run_ansible([playbook], inventory_path, STATE['config'])
 
-    kolla_cmd = [os.path.join(SCRIPT_PATH, "kolla", "tools", "kolla-ansible")]
+    write_kolla_host_vars(kolla_path, STATE['config'].get('kolla_host_vars', {}))
+
+    kolla_cmd = [os.path.join(kolla_path, "tools", "kolla-ansible")]
 
     if reconfigure:
         kolla_cmd.append('reconfigure')
     else:
         kolla_cmd.append('deploy')
 
-    kolla_cmd.extend(["-i", "%s/multinode" % SYMLINK_NAME,
-                  "--passwords", "%s/passwords.yml" % SYMLINK_NAME,
-                  "--configdir", "%s" % SYMLINK_NAME])
+    kolla_cmd.extend(["-i", "%s/multinode" % DEPLOYMENT_DIR,
+                  "--passwords", "%s/passwords.yml" % DEPLOYMENT_DIR,
+                  "--configdir", "%s" % DEPLOYMENT_DIR])
 
     if tags is not None:
         kolla_cmd.extend(["--tags", args])
@@ -387,17 +709,17 @@ def install_os(reconfigure, tags = None):
 
 
 def init_os():
+    import requests
+    import engine.loadgen
+    import engine.prefetch
+    from novaclient import client as nclient
+    from glanceclient import client as gclient
+    from keystoneclient.v3 import client as kclient
+    from neutronclient.neutron import client as ntnclient
+
     # Authenticate to keystone
-    # http://docs.openstack.org/developer/keystoneauth/using-sessions.html
     # http://docs.openstack.org/developer/python-glanceclient/apiv2.html
-    keystone_addr = STATE['config']['vip']
-    auth = v3.Password(auth_url='http://%s:5000/v3' % keystone_addr,
-                       username='admin',
-                       password='demo',
-                       project_name='admin',
-                       user_domain_id='default',
-                       project_domain_id='default')
-    sess = session.Session(auth=auth)
+    sess = engine.loadgen.session(STATE['config']['vip'])
 
     # Install `member` role
     keystone = kclient.Client(session=sess)
@@ -410,18 +732,21 @@ def init_os():
     glance = gclient.Client('2', session=sess)
     cirros_name = 'cirros.uec'
     if cirros_name not in map(itemgetter('name'), glance.images.list()):
-        # Download cirros
-        image_url  = 'http://download.cirros-cloud.net/0.3.4/'
-        image_name = 'cirros-0.3.4-x86_64-disk.img'
-        logger.info("Downloading %s at %s..." % (cirros_name, image_url))
-        cirros_img = requests.get(image_url + '/' + image_name)
+        # Download cirros, unless prepare-node already did
+        image_path = engine.prefetch.cirros_cache()
+        if os.path.isfile(image_path):
+            with open(image_path, 'rb') as image:
+                cirros_img = image.read()
+        else:
+            logger.info("Downloading %s at %s..." % (cirros_name, engine.prefetch.CIRROS_URL))
+            cirros_img = requests.get(engine.prefetch.CIRROS_URL).content
 
         # Install cirros
         cirros = glance.images.create(name=cirros_name,
                                       container_format='bare',
                                       disk_format='qcow2',
                                       visibility='public')
-        glance.images.upload(cirros.id, cirros_img.content)
+        glance.images.upload(cirros.id, cirros_img)
         logger.info("%s has been created on OpenStack" %  cirros_name)
 
     # Install default flavors
@@ -475,13 +800,250 @@ def init_os():
 
 def bench(scenario_list, times, concurrency, wait):
     playbook_path = os.path.join(SCRIPT_PATH, 'ansible', 'run-bench.yml')
-    inventory_path = os.path.join(SYMLINK_NAME, 'multinode')
+    inventory_path = os.path.join(DEPLOYMENT_DIR, 'multinode')
     if scenario_list:
         STATE['config']['rally_scenarios_list'] = scenario_list
     STATE['config']['rally_times'] = times
     STATE['config']['rally_concurrency'] = concurrency
     STATE['config']['rally_wait'] = wait
+    # Only backup the metrics written since the beginning of this bench
+    STATE['config']['influx_backup_since'] = to_rfc3339(STATE['timeline'][-1]['start'])
+    # The rally hosts start the scenarios at the same time
+    STATE['config']['rally_start_at'] = int(time.time()) + RALLY_START_DELAY
+    schedule_bench(int(times), int(concurrency), int(wait))
     run_ansible([playbook_path], inventory_path, STATE['config'])
+    record_bench(int(times), int(concurrency))
+    if STATE['config'].get('archive'):
+        import analysis.archive
+        analysis.archive.build(os.path.realpath(
+            STATE['config'].get('backup_dir', DEPLOYMENT_DIR)))
+
+def schedule_bench(times, concurrency, wait):
+    """
+    Only keeps the scenarios that end before the walltime of the job, so
+    that the results are collected in time. Rally is also stopped at the
+    deadline in case the predictions were too optimistic.
+    """
+    import engine.schedule
+    STATE['config']['rally_scenarios_schedule'] = ''
+    STATE['config']['rally_deadline'] = 0
+    job = refresh_job()
+    if job is None:
+        return
+
+    scenarios_list = STATE['config'].get('rally_scenarios_list')
+    if scenarios_list is None:
+        with open(os.path.join(SCRIPT_PATH, 'ansible', 'group_vars', 'all.yml')) as f:
+            scenarios_list = yaml.load(f)['rally_scenarios_list']
+    with open(os.path.join(SCRIPT_PATH, 'rally', scenarios_list)) as f:
+        scenarios = [l.strip() for l in f if l.strip() and not l.startswith('#')]
+
+    remaining = engine.schedule.remaining_walltime(job)
+    kept, skipped, missing = engine.schedule.schedule(scenarios, remaining,
+                                                      times, concurrency, wait)
+    if skipped:
+        remaining = ensure_walltime(remaining + missing, 'the bench')
+        kept, skipped, missing = engine.schedule.schedule(scenarios, remaining,
+                                                          times, concurrency, wait)
+    for scenario in skipped:
+        logger.warning("Skipping %s, it can't end before the walltime" % scenario)
+
+    schedule_path = os.path.join(DEPLOYMENT_DIR, 'scheduled-scenarios.txt')
+    with open(schedule_path, 'w') as f:
+        f.write(''.join("%s\n" % scenario for scenario in kept))
+    STATE['config']['rally_scenarios_schedule'] = os.path.realpath(schedule_path)
+    STATE['config']['rally_deadline'] = int(
+        job['start_date'] + job['walltime'] -
+        engine.schedule.predict(engine.schedule.COLLECT, 'collect'))
+
+def record_bench(times, concurrency):
+    """
+    Records the durations of the scenarios of the bench that just ended
+    (from the first to the last rally host) and the time taken to collect
+    the results.
+    """
+    import analysis.logs
+    import engine.schedule
+    start = STATE['timeline'][-1]['start']
+    backup_dir = STATE['config'].get('backup_dir', DEPLOYMENT_DIR)
+    scenarios = [s for s in analysis.logs.read_scenarios(backup_dir)
+                 if s[1] >= int(start)]
+    for name, scenario_start, scenario_end in scenarios:
+        engine.schedule.record(engine.schedule.SCENARIO, name,
+                               scenario_end - scenario_start,
+                               times=times, concurrency=concurrency)
+    if scenarios:
+        engine.schedule.record(engine.schedule.COLLECT, 'collect',
+                               time.time() - max(s[2] for s in scenarios))
+
+
+def deployment_args(phase, args):
+    "Command line of a phase for a deployment of the reservation"
+    if phase == 'install-os':
+        argv = ['install-os']
+        if args['--reconfigure']:
+            argv.append('--reconfigure')
+        if args['--tags']:
+            argv.append('--tags=%s' % args['--tags'])
+        return argv
+    if phase == 'bench':
+        argv = ['bench', '--times=%s' % args['--times'],
+                '--concurrency=%s' % args['--concurrency'],
+                '--wait=%s' % args['--wait']]
+        if args['--scenarios']:
+            argv.append('--scenarios=%s' % args['--scenarios'])
+        return argv
+    return [phase]
+
+def run_deployments(phases, args):
+    """
+    Runs the phases of all the deployments of the reservation side by side,
+    each deployment in its own kolla-g5k.py process. The output of a
+    deployment goes to the kolla-g5k.log of its directory.
+    """
+    import threading
+    failed = []
+
+    def run(name):
+        log_path = os.path.join(SYMLINK_NAME, name, 'kolla-g5k.log')
+        with open(log_path, 'a') as log:
+            for phase in phases:
+                argv = [sys.executable, os.path.join(SCRIPT_PATH, 'kolla-g5k.py')]
+                argv.extend(deployment_args(phase, args))
+                argv.append('--deployment=%s' % name)
+                if call(argv, stdout=log, stderr=subprocess.STDOUT) != 0:
+                    failed.append(name)
+                    return
+
+    logger.info("Running %s on deployments %s" % (', '.join(phases),
+                ', '.join(STATE['deployments'])))
+    threads = [threading.Thread(target=run, args=(name,))
+               for name in STATE['deployments']]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if len(failed) > 0:
+        logger.error("Deployments %s failed, see their kolla-g5k.log" %
+                     ', '.join(sorted(failed)))
+        sys.exit(33)
+
+def experiment_config(config, experiment):
+    """
+    Returns the config of an experiment of a campaign. The keys of the
+    experiment override the ones of the config, dicts (e.g. kolla) are
+    updated instead of replaced.
+    """
+    config = dict(config)
+    for key, value in experiment.items():
+        if key in ['name', 'bench']:
+            continue
+        if isinstance(value, dict) and isinstance(config.get(key), dict):
+            merged = dict(config[key])
+            merged.update(value)
+            value = merged
+        config[key] = value
+    return config
+
+def experiment_changes(previous, config):
+    """
+    Returns what has to be done to go from the OpenStack of the previous
+    experiment to the one of config:
+    - 'deploy'     : the services moved, OpenStack is removed and deployed again
+    - 'reconfigure': the kolla globals or patches changed
+    - None         : the same OpenStack is used
+    """
+    def inventory(c):
+        with open(c['inventory']) as f:
+            return f.read()
+
+    if previous is None or inventory(previous) != inventory(config):
+        return 'deploy'
+    for key in ['kolla', 'patches']:
+        if previous.get(key) != config.get(key):
+            return 'reconfigure'
+    return None
+
+def campaign(campaign_file, force_deploy, deployment=None):
+    """
+    Runs the experiments of a campaign one after the other on the nodes of
+    a single reservation, or of one of its deployments. Each experiment only
+    reapplies what differs from the previous one, its results go in
+    `experiments/<name>` of the deployment directory.
+    """
+    with open(campaign_file) as f:
+        experiments = yaml.load(f)
+    base_config_file = experiments.get('config', 'reservation.yaml')
+
+    # Kadeploy and the bootstrap of the nodes are done once, by the
+    # prepare-node of the whole reservation for a deployment
+    if not deployment:
+        STATE['timeline'] = []
+        start_phase('prepare-node')
+        prepare_node(base_config_file, force_deploy, None)
+        end_phase()
+    if STATE['deployments']:
+        logger.error("Choose the deployment of the campaign with --deployment (one of %s)" %
+                     ', '.join(STATE['deployments']))
+        sys.exit(35)
+
+    with open(base_config_file) as f:
+        base_config = deployment_config(yaml.load(f), deployment)
+    # Deployment specific keys (vips, interfaces...) of the state
+    deployment_keys = dict((k, v) for k, v in STATE['config'].items()
+                           if k not in base_config)
+
+    previous = None
+    for experiment in experiments['experiments']:
+        name = experiment['name']
+        logger.info("Running experiment %s" % style.emph(name))
+        experiment_dir = os.path.join(DEPLOYMENT_DIR, 'experiments', name)
+        if not os.path.isdir(experiment_dir):
+            os.makedirs(experiment_dir)
+
+        # The phases reload the config file, so the config of the
+        # experiment is written in its directory
+        config = experiment_config(base_config, experiment)
+        config_path = os.path.join(experiment_dir, 'config.yaml')
+        with open(config_path, 'w') as f:
+            yaml.dump(config, f, default_flow_style=False)
+        STATE['config_file'] = config_path
+        STATE['config'] = dict(deployment_keys)
+        STATE['config'].update(config)
+
+        changes = experiment_changes(previous, config)
+        generate_inventory(STATE['nodes'], config['inventory'],
+                           os.path.join(DEPLOYMENT_DIR, 'multinode'),
+                           STATE['config'].get('host_vars'))
+        generate_kolla_files(dict(config['kolla']), STATE['config']['kolla_vars'],
+                             DEPLOYMENT_DIR)
+        call("cp %s %s" % (' '.join(os.path.join(DEPLOYMENT_DIR, f)
+                                    for f in ['multinode', 'globals.yml']),
+                          experiment_dir), shell=True)
+
+        if changes == 'deploy' and previous is not None:
+            start_phase('teardown')
+            playbook = os.path.join(SCRIPT_PATH, 'ansible', 'teardown.yml')
+            run_ansible([playbook], os.path.join(DEPLOYMENT_DIR, 'multinode'),
+                        STATE['config'])
+            end_phase()
+        if changes is not None:
+            start_phase('install-os')
+            install_os(changes == 'reconfigure')
+            end_phase()
+        if changes == 'deploy':
+            start_phase('init-os')
+            init_os()
+            end_phase()
+
+        bench_args = experiment.get('bench', {})
+        STATE['config']['backup_dir'] = experiment_dir
+        start_phase('run-bench')
+        bench(bench_args.get('scenarios'), bench_args.get('times', 1),
+              bench_args.get('concurrency', 1), bench_args.get('wait', 0))
+        end_phase()
+        previous = config
 
 def ssh_tunnel():
     user = STATE['user']
@@ -506,11 +1068,103 @@ def ssh_tunnel():
     logger.info(script)
     logger.info("___")
 
+def logs(args):
+    import analysis.logs
+    result_dir = os.path.realpath(DEPLOYMENT_DIR)
+
+    if args['index']:
+        processes = int(args['--processes']) if args['--processes'] else None
+        analysis.logs.build_index(result_dir, processes)
+        return
+
+    db = analysis.logs.open_index(result_dir)
+    if args['slowest']:
+        requests = analysis.logs.slowest_requests(db, args['<SERVICE>'],
+                args['--scenario'], int(args['--limit']))
+        for timestamp, duration, status, method, url, request_id in requests:
+            print("%s %8.3fs %s %s %s %s" % (to_rfc3339(timestamp), duration,
+                status, method, url, request_id or ''))
+    elif args['errors']:
+        for minute, service, count in analysis.logs.errors_per_minute(db, args['--scenario']):
+            print("%s %-32s %d" % (to_rfc3339(minute), service, count))
+    elif args['request']:
+        for host, path, line in analysis.logs.request_lines(db, args['<REQUEST_ID>']):
+            print("%s %s" % (style.host(host), line))
+
+
+def costs(influx_url, step):
+    import analysis.costs
+    result_dir = os.path.realpath(DEPLOYMENT_DIR)
+    if influx_url is None:
+        influx_url = "http://%s:8086" % STATE['config']['influx_vip']
+
+    rows = analysis.costs.report(influx_url, result_dir, step)
+    logger.info("Costs written in %s" % os.path.join(result_dir, analysis.costs.COSTS_NAME))
+
+    # The service using the most cpu per execution of each action
+    top = {}
+    for row in rows:
+        scenario, action, service, count, cpu = row[:5]
+        if cpu > top.get((scenario, action), (None, None, -1))[2]:
+            top[(scenario, action)] = (service, count, cpu)
+    for (scenario, action), (service, count, cpu) in sorted(top.items()):
+        print("%-40s %-32s %5d %-12s %8.3f cpu s/op" % (scenario, action, count, service, cpu))
+
+
+def archive(args):
+    import analysis.archive
+    result_dir = os.path.realpath(DEPLOYMENT_DIR)
+    archive_path = os.path.join(result_dir, analysis.archive.ARCHIVE_NAME)
+
+    if args['list']:
+        manifest = analysis.archive.read_manifest(archive_path)
+        for entry in analysis.archive.find(manifest, args['--host'], args['--kind'], args['--path']):
+            dates = entry['time_range'] or [None, None]
+            print("%-12s %10d %-20s %-20s %s" % (entry['kind'], entry['size'],
+                to_rfc3339(dates[0]) if dates[0] else '-',
+                to_rfc3339(dates[1]) if dates[1] else '-',
+                entry['name']))
+    elif args['show']:
+        analysis.archive.copy_member(archive_path, args['<MEMBER>'], sys.stdout)
+    else:
+        analysis.archive.build(result_dir)
+
+
+def loadgen(operation, rates, duration, workers, poisson):
+    import engine.loadgen
+    if operation not in engine.loadgen.OPERATIONS:
+        logger.error("Unknown operation %s (one of %s)" %
+                     (operation, ', '.join(sorted(engine.loadgen.OPERATIONS))))
+        sys.exit(36)
+    rows = engine.loadgen.run(STATE['config']['vip'], operation, rates,
+                              duration, workers, poisson)
+
+    columns = ['offered', 'achieved', 'errors'] + \
+              ['p%s_ms' % p for p in engine.loadgen.PERCENTILES] + ['max_ms']
+    path = os.path.join(os.path.realpath(DEPLOYMENT_DIR), 'loadgen-%s.csv' % operation)
+    with open(path, 'w') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    logger.info("Latencies written in %s" % path)
+
+    print(' '.join('%10s' % c for c in columns))
+    for row in rows:
+        print(' '.join('%10.2f' % v for v in row))
+
 
 if __name__ == "__main__":
     args = docopt(__doc__)
 
-    load_state()
+    # A deployment of a shared reservation has its own directory
+    if args['--deployment']:
+        set_deployment(args['--deployment'])
+
+    # Only read what the command needs
+    if args['ssh-tunnel']:
+        load_state(['user', 'config', 'deployments'])
+    else:
+        load_state()
 
     # If the user doesn't specify a phase in particular, then run all
     if not args['prepare-node'] and \
@@ -518,37 +1172,62 @@ if __name__ == "__main__":
        not args['init-os'] and \
        not args['bench'] and \
        not args['ssh-tunnel'] and \
-       not args['info']:
+       not args['info'] and \
+       not args['logs'] and \
+       not args['costs'] and \
+       not args['archive'] and \
+       not args['loadgen'] and \
+       not args['campaign']:
        args['prepare-node'] = True
        args['install-os'] = True
        args['init-os'] = True
 
     # Prepare node phase
     if args['prepare-node']:
-        STATE['phase'] = 'prepare-node'
+        # A new deployment starts a new timeline
+        STATE['timeline'] = []
+        start_phase('prepare-node')
         config_file = args['-f']
         force_deploy = args['--force-deploy']
         tags = args['--tags'].split(',') if args['--tags'] else None
         prepare_node(config_file, force_deploy, tags)
-        save_state()
+        end_phase()
+
+    # Warn before starting phases that won't end in time
+    if not args['--deployment']:
+        check_walltime([p for p in ['install-os', 'init-os'] if args[p]])
+
+    # The deployments sharing the reservation run the next phases
+    # side by side
+    if STATE['deployments'] and not args['--deployment']:
+        phases = [p for p in ['install-os', 'init-os', 'bench'] if args[p]]
+        if phases:
+            run_deployments(phases, args)
+        for phase in phases:
+            args[phase] = False
+        if args['ssh-tunnel'] or args['logs'] or args['costs'] or args['archive'] \
+           or args['loadgen']:
+            logger.error("Choose a deployment with --deployment (one of %s)" %
+                         ', '.join(STATE['deployments']))
+            sys.exit(34)
 
     # Run kolla phase
     if args['install-os']:
-        STATE['phase'] = 'install-os'
+        start_phase('install-os')
         install_os(args['--reconfigure'], args['--tags'])
-        save_state()
+        end_phase()
 
     # Run init phase
     if args['init-os']:
-        STATE['phase'] = 'init-os'
+        start_phase('init-os')
         init_os()
-        save_state()
+        end_phase()
 
     # Run bench phase
     if args['bench']:
-        STATE['phase'] = 'run-bench'
+        start_phase('run-bench')
         bench(args['--scenarios'], args['--times'], args['--concurrency'], args['--wait'])
-        save_state()
+        end_phase()
 
     # Print information for port forwarding
     if args['ssh-tunnel']:
@@ -557,3 +1236,24 @@ if __name__ == "__main__":
     # Show info
     if args ['info']:
         pprint.pprint(STATE)
+
+    # Query the collected logs
+    if args['logs']:
+        logs(args)
+
+    # Cost of the scenarios of the last bench
+    if args['costs']:
+        costs(args['--influx'], int(args['--step']))
+
+    # Seekable archive of the results
+    if args['archive']:
+        archive(args)
+
+    # Open-loop load of an OpenStack API
+    if args['loadgen']:
+        loadgen(args['<OPERATION>'], [float(r) for r in args['--rates'].split(',')],
+                int(args['--duration']), int(args['--workers']), args['--poisson'])
+
+    # Run the experiments of a campaign
+    if args['campaign']:
+        campaign(args['<CAMPAIGN>'], args['--force-deploy'], args['--deployment'])
@@ -4,6 +4,12 @@ scenarios=$1
 times=$2
 concurrency=$3
 waiting=$4
+# the rally hosts start together at this date (unix timestamp)
+start_at=${5:-0}
+
+while [ $(date +%s) -lt $start_at ]; do
+    sleep 1
+done
 
 for scenario in $(cat $scenarios | grep -v '^#'); do
     sed -i "s/times: .*/times: $times/g" $scenario
@@ -13,6 +19,9 @@ for scenario in $(cat $scenarios | grep -v '^#'); do
     sed -i "s/\"concurrency\": .*/\"concurrency\": $concurrency,/g" $scenario
     rally task validate $scenario
     echo  $scenario
+    start=$(date +%s)
     rally task start $scenario #--deployment $3
+    # time window of each scenario, used to query the logs index
+    echo "$start $(date +%s) $scenario" >> scenarios.log
     sleep $waiting
 done
@@ -0,0 +1,186 @@
+#! /usr/bin/env python
+"""Imports the metrics of an experiment in the shared influx of the VM.
+
+The points are read from the influx restored from the archive of the
+experiment (SOURCE) in chunks, and written in the same databases of the
+shared influx (STORE) with an `experiment` tag. Their time is relative to
+the start of the experiment (its first point, at 1970-01-01 00:00:00) so
+that the experiments overlay in grafana, e.g. with a GROUP BY experiment.
+
+The points are read from the default retention policy, or from the only
+policy holding points when another one was backed up (see
+influx_backup_retention), or from RETENTION.
+
+Usage:
+  import_metrics.py <EXPERIMENT> <SOURCE> <STORE> [--databases=DATABASES] [--batch=BATCH] [--retention=RETENTION]
+
+Options:
+  -h --help                  Show this help message.
+  --databases=DATABASES      Databases to import, comma separated [default: cadvisor,collectd].
+  --batch=BATCH              Number of points of each read and write [default: 10000].
+  --retention=RETENTION      Retention policy to read the points from.
+"""
+from docopt import docopt
+import json
+import logging
+import re
+
+import requests
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+logger = logging.getLogger('import_metrics')
+
+EXPERIMENT_TAG = 'experiment'
+
+MEASUREMENT_ESCAPE = re.compile(r'([, ])')
+TAG_ESCAPE = re.compile(r'([,= ])')
+
+
+def query(url, database, q, chunk_size=None):
+    """
+    Yields the series of an influx query. With chunk_size, the points are
+    streamed by chunks of chunk_size.
+    """
+    params = {'db': database, 'q': q, 'epoch': 'ns'}
+    if chunk_size is not None:
+        params.update({'chunked': 'true', 'chunk_size': chunk_size})
+    response = requests.get(url + '/query', params=params, stream=True)
+    response.raise_for_status()
+    for line in response.iter_lines():
+        if not line:
+            continue
+        for result in json.loads(line)['results']:
+            if 'error' in result:
+                raise Exception("%s: %s" % (q, result['error']))
+            for series in result.get('series', []):
+                yield series
+
+
+def quote(name):
+    return '"%s"' % name.replace('"', '\\"')
+
+
+def field_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, long, float)):
+        return repr(float(value))
+    return '"%s"' % unicode(value).replace('"', '\\"')
+
+
+def to_line(measurement, tags, fields, timestamp):
+    "A point in the influx line protocol."
+    key = MEASUREMENT_ESCAPE.sub(r'\\\1', measurement)
+    for tag, value in sorted(tags.items()):
+        if value not in (None, ''):
+            key += ',%s=%s' % (TAG_ESCAPE.sub(r'\\\1', tag),
+                               TAG_ESCAPE.sub(r'\\\1', unicode(value)))
+    return '%s %s %d' % (key, ','.join('%s=%s' % (TAG_ESCAPE.sub(r'\\\1', f), field_value(v))
+                                       for f, v in sorted(fields.items())),
+                         timestamp)
+
+
+def start_of(url, database, retention):
+    "Date (ns) of the first point of the retention policy, None if it is empty."
+    dates = [series['values'][0][0]
+             for series in query(url, database, 'SELECT * FROM %s./.*/ LIMIT 1' % quote(retention))
+             if series['values']]
+    return min(dates) if dates else None
+
+
+def retention_policies(url, database):
+    "Names of the retention policies of the database, the default one first."
+    policies = []
+    for series in query(url, database, 'SHOW RETENTION POLICIES ON %s' % quote(database)):
+        columns = series['columns']
+        for values in series['values']:
+            policy = dict(zip(columns, values))
+            policies.append((not policy.get('default'), policy['name']))
+    return [name for _, name in sorted(policies)]
+
+
+def pick_retention(url, database, retention=None):
+    """
+    Returns the retention policy to import and the date of its first point:
+    the given one, else the default one, else the only one holding points.
+    """
+    if retention is not None:
+        return retention, start_of(url, database, retention)
+    starts = [(policy, start_of(url, database, policy))
+              for policy in retention_policies(url, database)]
+    filled = [(policy, start) for policy, start in starts if start is not None]
+    if not filled:
+        return None, None
+    if starts[0][1] is not None:
+        return starts[0]
+    if len(filled) > 1:
+        raise Exception("%s: the default retention policy is empty, choose one of %s "
+                        "with --retention" % (database, ', '.join(p for p, _ in filled)))
+    logger.info("%s: the default retention policy is empty, reading %s" %
+                (database, filled[0][0]))
+    return filled[0]
+
+
+def points(url, database, retention, start, experiment, chunk_size):
+    "Yields the points of the retention policy as lines, with their relative date."
+    measurements = [values[0]
+                    for series in query(url, database, 'SHOW MEASUREMENTS')
+                    for values in series['values']]
+    for measurement in measurements:
+        tag_keys = set(values[0]
+                       for series in query(url, database, 'SHOW TAG KEYS FROM %s.%s' %
+                                           (quote(retention), quote(measurement)))
+                       for values in series['values'])
+        for series in query(url, database, 'SELECT * FROM %s.%s' %
+                            (quote(retention), quote(measurement)), chunk_size):
+            columns = series['columns']
+            for values in series['values']:
+                tags = {EXPERIMENT_TAG: experiment}
+                fields = {}
+                for column, value in zip(columns[1:], values[1:]):
+                    if column in tag_keys:
+                        tags[column] = value
+                    elif value is not None:
+                        fields[column] = value
+                if fields:
+                    yield to_line(measurement, tags, fields, values[0] - start)
+
+
+def write(url, database, lines):
+    response = requests.post(url + '/write', params={'db': database, 'precision': 'ns'},
+                             data=u'\n'.join(lines).encode('utf-8'))
+    response.raise_for_status()
+
+
+def import_database(source, store, database, experiment, batch, retention=None):
+    retention, start = pick_retention(source, database, retention)
+    if start is None:
+        logger.info("%s: %s is empty" % (experiment, database))
+        return 0
+    requests.post(store + '/query', params={'q': 'CREATE DATABASE %s' % quote(database)}).raise_for_status()
+    # The points of a previous import of the experiment are replaced
+    requests.post(store + '/query', params={
+        'db': database,
+        'q': "DROP SERIES WHERE %s = '%s'" % (EXPERIMENT_TAG, experiment.replace("'", "\\'"))
+    }).raise_for_status()
+
+    count = 0
+    lines = []
+    for line in points(source, database, retention, start, experiment, batch):
+        lines.append(line)
+        if len(lines) == batch:
+            write(store, database, lines)
+            count += len(lines)
+            lines = []
+    if lines:
+        write(store, database, lines)
+        count += len(lines)
+    logger.info("%s: %d points of %s imported" % (experiment, count, database))
+    return count
+
+
+if __name__ == '__main__':
+    args = docopt(__doc__)
+    for database in args['--databases'].split(','):
+        import_database(args['<SOURCE>'], args['<STORE>'], database,
+                        args['<EXPERIMENT>'], int(args['--batch']), args['--retention'])
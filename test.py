@@ -1,11 +1,62 @@
 import unittest
-from engine.g5k_engine import G5kEngine, check_nodes, ROLE_DISTRIBUTION_MODE_STRICT
+import imp
+import os
+import json
+import shutil
+import StringIO
+import subprocess
+import tarfile
+import tempfile
+import sys
+import threading
+import time
+import types
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from engine.g5k_engine import G5kEngine, check_nodes, merge_resources, node_facts, node_interfaces, ROLE_DISTRIBUTION_MODE_STRICT
 from execo.host import Host
+import engine.state
+from engine.g5k_api import G5kApi
+from engine.sim_backend import SimulatedBackend
+import engine.fanout
+import engine.loadgen
+import engine.prefetch
+import engine.tuning
+from engine.screening import find_outliers, parse_results, select_outliers
+import engine.schedule
+from analysis.haproxy_latency import LatencyHistograms, NB_BUCKETS, bucket
+import analysis.archive
+import analysis.logs
+import analysis.costs
+import analysis.rally_results
+
+def node_description(uid, cores=16, ram=128, storage="HDD", rate=10, switch="sw-1"):
+    return {
+        "uid": uid,
+        "architecture": {"nb_cores": cores},
+        "main_memory": {"ram_size": ram},
+        "storage_devices": [{"storage": storage}],
+        "network_adapters": [{"device": "eth0", "mountable": True,
+                              "rate": rate, "switch": switch}]
+    }
+
+
+class FakeApi(object):
+    "Serves the reference descriptions of the nodes."
+    def __init__(self, descriptions):
+        self.descriptions = descriptions
+
+    def get_cluster_nodes(self, cluster):
+        if cluster not in self.descriptions:
+            raise ValueError("unknown g5k cluster %s" % cluster)
+        return self.descriptions[cluster]
+
 
 class TestBuildRoles(unittest.TestCase):
 
     def setUp(self):
         self.engine = G5kEngine()
+        self.engine.api = FakeApi({})
         self.engine.config = {
             "resources": {
                 "a": {
@@ -63,10 +114,146 @@ class TestBuildRoles(unittest.TestCase):
         self.assertEquals(4, len(roles["compute"]))
         self.assertEquals(1, len(roles["network"]))
         self.assertEquals(1, len(roles["util"]))
+
+    def test_build_roles_strongest_nodes(self):
+        self.engine.config = {"resources": {"a": {"control": 1, "network": 1, "compute": 2}}}
+        self.engine.api = FakeApi({"a": [
+            node_description("a-1", ram=64),
+            node_description("a-2", cores=32, storage="SSD"),
+            node_description("a-3", switch="sw-2", cores=32, storage="SSD"),
+            node_description("a-4", ram=64, rate=1)]})
+        self.engine.deployed_nodes = map(lambda x: Host(x + "-kavlan-4.rennes.grid5000.fr"),
+                                         ["a-1", "a-2", "a-3", "a-4"])
+        roles = self.engine.build_roles()
+        self.assertEquals(["a-2"], [n.address.split("-kavlan")[0] for n in roles["control"]])
+        # same switch as the control node rather than the strongest one
+        self.assertEquals(["a-1"], [n.address.split("-kavlan")[0] for n in roles["network"]])
+        self.assertEquals(["a-3", "a-4"], [n.address.split("-kavlan")[0] for n in roles["compute"]])
+
+    def test_build_roles_subset(self):
+        nodes = map(lambda x: Host(x), ["a-1", "a-2", "a-3", "a-4"])
+        self.engine.deployed_nodes = nodes
+        resources = {"a": {"control": 1, "compute": 1}}
+        first = self.engine.build_roles(nodes=nodes, resources=resources)
+        used = [n for role_nodes in first.values() for n in role_nodes]
+        second = self.engine.build_roles(nodes=[n for n in nodes if n not in used],
+                                         resources=resources)
+        self.assertEquals(["a-1"], [n.address for n in first["control"]])
+        self.assertEquals(["a-3"], [n.address for n in second["control"]])
+        self.assertEquals(["a-4"], [n.address for n in second["compute"]])
+
+    def test_merge_resources(self):
+        resources = merge_resources({
+            "vanilla": {"resources": {"a": {"control": 1, "compute": 2}}},
+            "patched": {"resources": {"a": {"control": 1}, "b": {"compute": 1}}}
+        })
+        self.assertEquals({"a": {"control": 2, "compute": 2}, "b": {"compute": 1}},
+                          resources)
+
+    def test_node_facts(self):
+        facts = node_facts(node_description("a-1", storage="SSD"))
+        self.assertEquals({"cores": 16, "ram": 128, "ssd": True, "nic_rate": 10,
+                           "nics": ["eth0"], "switch": "sw-1"}, facts)
+
+    def test_node_interfaces(self):
+        description = node_description("a-1")
+        description["network_adapters"] = [
+            {"device": "eth0", "mountable": True, "mounted": True, "rate": 10 ** 9},
+            {"device": "eth1", "mountable": True, "rate": 10 ** 10},
+            {"device": "ib0", "mountable": False, "rate": 56 * 10 ** 9},
+            {"device": "eth2", "mountable": True, "mounted": True, "rate": 10 ** 10}]
+        nics = node_facts(description)["nics"]
+        # an unmounted NIC has no address, even if it is the fastest
+        self.assertEquals(["eth2", "eth0", "eth1"], nics)
+        self.assertEquals(("eth2", "eth0"), node_interfaces(nics))
+        self.assertEquals(("eth0", "veth0"), node_interfaces(["eth0"]))
     
 
 
 
+class TestSimulatedBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SimulatedBackend(clusters={"paravance": 10}, failure_rate=0.3, seed=1)
+        self.engine = G5kEngine(backend=self.backend)
+        self.engine.config = {
+            "name": "sim",
+            "env_name": "ubuntu1404-x64-min",
+            "walltime": u"2:00:00",
+            "reservation": None,
+            "role_distribution": "debug",
+            "resources": {"paravance": {"control": 1, "network": 1, "compute": 6}},
+            "vlans": {"rennes": "{type='kavlan'}/vlan=1"}
+        }
+
+    def test_reservation(self):
+        self.engine.get_job()
+        self.assertEquals(8, len(self.engine.nodes))
+        self.assertEquals([("rennes", 4)], self.engine.vlans)
+        # the running job is used the next time
+        self.assertEquals(self.engine.gridjob, self.engine.get_job())
+
+    def test_deploy_failures(self):
+        self.engine.get_job()
+        deployed, undeployed = self.engine.deploy()
+        self.assertEquals(8, len(deployed) + len(undeployed))
+        self.assertTrue(len(undeployed) > 0)
+        roles = self.engine.build_roles()
+        self.assertEquals(len(deployed), sum(len(n) for n in roles.values()))
+
+    def test_pipelined_deploy(self):
+        def pipelined_deploy():
+            backend = SimulatedBackend(clusters={"paravance": 10, "econome": 10},
+                                       failure_rate=0.3, seed=2)
+            engine = G5kEngine(backend=backend)
+            engine.config = dict(self.engine.config, **{
+                "pipeline_deploy": True,
+                "exec_retries": 0,
+                "exec_quorum": 0,
+                "resources": {"paravance": {"control": 1, "compute": 3},
+                              "econome": {"network": 1, "compute": 3}}
+            })
+            engine.get_job()
+            deployed, undeployed = engine.deploy(bootstrap=True)
+            return deployed, undeployed, engine.deployed_nodes
+
+        deployed, undeployed, nodes = pipelined_deploy()
+        self.assertEquals(8, len(deployed) + len(undeployed))
+        # some deployed nodes failed the bootstrap
+        self.assertTrue(len(nodes) < len(deployed))
+        self.assertEquals(set(["paravance", "econome"]),
+                          set(h.address.split("-")[0] for h in nodes))
+        # the failures don't depend on the order of the cluster threads
+        self.assertEquals(sorted(h.address for h in nodes),
+                          sorted(h.address for h in pipelined_deploy()[2]))
+
+
+class TestFanout(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = SimulatedBackend(failure_rate=0.3, seed=1)
+        self.nodes = [Host("paravance-%d" % i) for i in range(1, 41)]
+
+    def test_retries(self):
+        once = engine.fanout.run(self.backend, "true", self.nodes, None, "once")
+        retried = engine.fanout.run(self.backend, "true", self.nodes, None, "retried",
+                                    retries=3)
+        self.assertEquals(40, len(retried.results))
+        self.assertTrue(len(retried.failed) < len(once.failed))
+        for host in retried.failed:
+            self.assertEquals(4, retried.attempts[host])
+
+    def test_quorum(self):
+        result = engine.fanout.run(self.backend, "true", self.nodes, None, "quorum",
+                                   quorum=0.5)
+        self.assertEquals(20, result.required)
+        self.assertTrue(result.ok)
+        self.assertEquals(36, engine.fanout.required_nodes(0.9, 40))
+        self.assertEquals(40, engine.fanout.required_nodes(50, 40))
+        self.assertFalse(engine.fanout.run(self.backend, "true", self.nodes, None,
+                                           "all").ok)
+
+
 class TestCheckNodes(unittest.TestCase):
 
     def setUp(self):
@@ -99,7 +286,587 @@ class TestCheckNodes(unittest.TestCase):
     def test_not_enough_nodes_not_strict(self):
         nodes = [1, 2, 3, 4, 5]
         self.assertTrue(check_nodes(nodes, self.roles, ""))
-            
+
+
+class TestScreening(unittest.TestCase):
+
+    def setUp(self):
+        self.clusters = {"a-1": "a", "a-2": "a", "a-3": "a", "b-1": "b"}
+        self.results = {
+            "a-1": {"cpu": 1000.0, "disk": 400.0},
+            "a-2": {"cpu": 1100.0, "disk": 450.0},
+            "a-3": {"cpu": 1050.0, "disk": 4000.0},
+            "b-1": {"cpu": 3000.0, "disk": 400.0}
+        }
+
+    def test_parse_results(self):
+        results = parse_results("cpu 1234567\ndisk 20000\nnetwork \n")
+        self.assertEquals({"cpu": 1234.567, "disk": 20.0}, results)
+
+    def test_outliers_against_cluster(self):
+        outliers = find_outliers(self.results, self.clusters)
+        # b-1 is slower than a-* but alone in its cluster
+        self.assertEquals(["a-3"], outliers.keys())
+
+    def test_missing_result(self):
+        del self.results["a-1"]["disk"]
+        outliers = find_outliers(self.results, self.clusters)
+        self.assertEquals(["a-1", "a-3"], sorted(outliers.keys()))
+
+    def test_select_outliers(self):
+        outliers = {"a-1": ["disk: no result"], "a-3": ["cpu", "disk"], "b-1": ["cpu"]}
+        # a single spare in a, none in b
+        excluded, kept = select_outliers(outliers, self.clusters, {"a": 1, "b": 0})
+        self.assertEquals(["a-3"], excluded.keys())
+        self.assertEquals(["a-1", "b-1"], sorted(kept.keys()))
+
+
+class TestSchedule(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.history = os.path.join(self.tmp_dir, "durations.sqlite")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def predict(self, *args, **kwargs):
+        return engine.schedule.predict(*args, path=self.history, **kwargs) / engine.schedule.SAFETY_FACTOR
+
+    def test_predict_scenario(self):
+        engine.schedule.record(engine.schedule.SCENARIO, "boot.json", 100,
+                               times=10, concurrency=5, path=self.history)
+        # 2 rounds of 50s
+        self.assertAlmostEquals(200, self.predict(engine.schedule.SCENARIO, "boot.json",
+                                                  times=20, concurrency=5))
+
+    def test_predict_phase(self):
+        engine.schedule.record(engine.schedule.PHASE, "install-os", 1000,
+                               nodes=4, path=self.history)
+        self.assertAlmostEquals(2000, self.predict(engine.schedule.PHASE, "install-os",
+                                                   nodes=16))
+
+    def test_schedule(self):
+        for name, duration in [("a.json", 1000), ("b.json", 5000), ("c.json", 500)]:
+            engine.schedule.record(engine.schedule.SCENARIO, name, duration, path=self.history)
+        engine.schedule.record(engine.schedule.COLLECT, "collect", 500, path=self.history)
+        kept, skipped, missing = engine.schedule.schedule(
+            ["a.json", "b.json", "c.json"], 3000, 1, 1, path=self.history)
+        self.assertEquals(["a.json", "c.json"], kept)
+        self.assertEquals(["b.json"], skipped)
+        self.assertAlmostEquals(6000, missing)
+
+
+def load_haproxy_plugin():
+    "The collectd plugin of haproxy, outside of collectd."
+    collectd = types.ModuleType('collectd')
+    collectd.register_config = collectd.register_read = collectd.register_shutdown = \
+        lambda callback: None
+    sys.modules['collectd'] = collectd
+    return imp.load_source('haproxy_plugin', 'ansible/roles/collectd/files/haproxy.py')
+
+haproxy_plugin = load_haproxy_plugin()
+kolla_g5k = imp.load_source('kolla_g5k', 'kolla-g5k.py')
+
+INFO = "Name: HAProxy\nMaxConn: 4000\nCumConns: 1234\nNode: control-1\n"
+STATS = ("# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,status,\n"
+         "keystone,FRONTEND,,,3,10,4000,120,5678,OPEN,\n"
+         "keystone,control-1,0,0,1,4,,60,2839,UP,\n")
+
+
+class FakeStatSocket(object):
+    "Stat socket that returns canned chunks."
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+    def recv(self, size):
+        return self.chunks.pop(0) if self.chunks else ''
+
+    def close(self):
+        pass
+
+
+class FakeConfigNode(object):
+    "Config of the collectd python plugin, a node per key."
+    def __init__(self, key=None, values=(), children=()):
+        self.key = key
+        self.values = list(values)
+        self.children = list(children)
+
+
+class TestHaproxyPlugin(unittest.TestCase):
+
+    def setUp(self):
+        haproxy_plugin.config(FakeConfigNode(children=[FakeConfigNode('Socket', ['/tmp/stats'])]))
+        self.haproxy = haproxy_plugin.HAProxySocket('/tmp/stats')
+        haproxy_plugin.HAPROXY = self.haproxy
+
+    def test_read_responses(self):
+        # the prompt of the first response is split between two chunks
+        response = INFO + "\n> " + STATS + "\n> "
+        cut = len(INFO) + 1
+        self.haproxy.stat_sock = FakeStatSocket([response[:cut], response[cut:cut + 20], response[cut + 20:]])
+        info, stats = self.haproxy.communicate('show info', 'show stat')
+        self.assertEquals(["show info\nshow stat\n"], self.haproxy.stat_sock.sent)
+        self.assertEquals(INFO, info)
+        self.assertEquals(STATS, stats)
+
+    def test_closed_connection(self):
+        self.haproxy.stat_sock = FakeStatSocket([INFO])
+        self.assertRaises(haproxy_plugin.socket.error, self.haproxy._read_responses, 1)
+
+    def test_parse_stats(self):
+        columns, rows = haproxy_plugin.parse_stats(STATS)
+        self.assertEquals([(2, 'qcur'), (4, 'scur'), (7, 'stot'), (8, 'bin')], columns)
+        self.assertEquals(['keystone', 'control-1', '0', '0', '1', '4', '', '60', '2839', 'UP', ''], rows[1])
+        # the columns of a header are computed once
+        self.assertIs(columns, haproxy_plugin.parse_stats(STATS)[0])
+
+    def test_get_stats(self):
+        self.haproxy.stat_sock = FakeStatSocket([INFO + "\n> " + STATS + "\n> "])
+        stats = haproxy_plugin.get_stats()
+        self.assertIn(('maxconn', 4000, ''), stats)
+        self.assertIn(('cumconns', 1234, ''), stats)
+        frontend = '[proxy_name=keystone,service_name=FRONTEND]'
+        self.assertIn(('scur', 3, frontend), stats)
+        self.assertIn(('stot', 120, frontend), stats)
+        # empty fields are not metrics
+        self.assertEquals(['scur', 'stot', 'bin'],
+                          [s[0] for s in stats if s[2] == frontend])
+
+    def test_delta_rates(self):
+        previous = haproxy_plugin.PreviousValues()
+        # a rate needs two reads, gauges are sent right away
+        self.assertEquals([('scur', 3, 'fe')],
+                          previous.update([('stot', 100, 'fe'), ('scur', 3, 'fe')], 0, 2))
+        self.assertEquals([('stot', 5.0, 'fe'), ('scur', 4, 'fe')],
+                          previous.update([('stot', 150, 'fe'), ('scur', 4, 'fe')], 10, 2))
+
+    def test_delta_heartbeat(self):
+        previous = haproxy_plugin.PreviousValues()
+        previous.update([('scur', 3, 'fe')], 0, 2)
+        # unchanged values are sent again every heartbeat reads
+        self.assertEquals([], previous.update([('scur', 3, 'fe')], 10, 2))
+        self.assertEquals([], previous.update([('scur', 3, 'fe')], 20, 2))
+        self.assertEquals([('scur', 3, 'fe')], previous.update([('scur', 3, 'fe')], 30, 2))
+
+    def test_delta_counter_reset(self):
+        previous = haproxy_plugin.PreviousValues()
+        previous.update([('stot', 100, 'fe')], 0, 2)
+        # haproxy restarted, the counter starts again from 0
+        self.assertEquals([], previous.update([('stot', 20, 'fe')], 10, 2))
+        self.assertEquals([('stot', 3.0, 'fe')], previous.update([('stot', 50, 'fe')], 20, 2))
+
+
+class TestHaproxyLatency(unittest.TestCase):
+
+    def setUp(self):
+        self.histograms = LatencyHistograms()
+
+    def test_http_log(self):
+        self.histograms.add_line('2016-11-02 12:34:56.123 control-1 haproxy[27]: 10.4.0.1:41234 [02/Nov/2016:12:34:56.120] nova_api nova_api/control-1 0/0/1/120/121 200 1234 - - ---- 3/3/0/1/0 0/0 "GET /v2.1/servers HTTP/1.1"')
+        histogram = self.histograms.histograms[("nova_api", 1478090096)]
+        self.assertEquals(1, histogram[4 * NB_BUCKETS + bucket(121)])
+        self.assertEquals(5, sum(histogram))
+
+    def test_tcp_log(self):
+        self.histograms.add_line('2016-11-02 12:34:57.523 control-1 haproxy[27]: 10.4.0.1:41236 [02/Nov/2016:12:34:57.400] mariadb mariadb/control-1 1/0/+30000 4521 -- 12/12/12/12/0 0/0')
+        histogram = self.histograms.histograms[("mariadb", 1478090097)]
+        # Tq and Tr are not part of the tcp logs
+        self.assertEquals(1, histogram[0])
+        self.assertEquals(1, histogram[4 * NB_BUCKETS + bucket(30000)])
+
+    def test_not_a_request(self):
+        self.histograms.add_line('2016-11-02 12:34:57.523 control-1 haproxy[27]: Proxy nova_api started.')
+        self.assertEquals(0, self.histograms.lines)
+        self.assertEquals(1, self.histograms.skipped)
+
+class TestCosts(unittest.TestCase):
+
+    def setUp(self):
+        # two iterations of 20s, one after the other
+        self.windows = analysis.costs.action_windows([
+            (100, 20, [("keystone.create_user", 5), ("keystone.delete_user", 15)]),
+            (120, 20, [("keystone.create_user", 5), ("keystone.delete_user", 15)])])
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_shares(self):
+        self.assertEquals([(100, 105), (120, 125)], self.windows["keystone.create_user"])
+        shares = analysis.costs.shares(self.windows, 100, 10, 4)
+        self.assertEquals([0.5, 0.0, 0.5, 0.0], shares["keystone.create_user"])
+        self.assertEquals([0.5, 1.0, 0.5, 1.0], shares["keystone.delete_user"])
+        self.assertEquals([1.0] * 4, shares[analysis.costs.ITERATION])
+
+    def test_costs(self):
+        metrics = dict((m[0], {}) for m in analysis.costs.METRICS)
+        metrics["cpu_s"]["keystone"] = [2.0, 4.0, 2.0, 4.0]
+        metrics["memory_mib"]["keystone"] = [100.0, 200.0, 100.0, 200.0]
+        rows = dict(((r[1], r[2]), r) for r in
+                    analysis.costs.costs("create_delete", self.windows, metrics, 100, 10, 4))
+        create = rows[("keystone.create_user", "keystone")]
+        # half of the first and third buckets, per user
+        self.assertEquals(1.0, create[4])
+        self.assertEquals(100.0, create[7])
+        self.assertEquals(6.0, rows[("iteration", "keystone")][4])
+
+    def test_read_iterations(self):
+        results = os.path.join(self.tmp, "results-1.json")
+        with open(results, "w") as f:
+            json.dump([{"key": {"name": "KeystoneBasic.create_delete_user"},
+                        "result": [{"timestamp": 100, "duration": 20, "error": [],
+                                    "atomic_actions": {"keystone.create_user": 5}},
+                                   {"timestamp": 120, "duration": 1, "error": ["Timeout"],
+                                    "atomic_actions": {}}]}], f)
+        with tarfile.open(os.path.join(self.tmp, "rally-1-rally.tar.gz"), "w:gz") as archive:
+            archive.add(results, "root/rally_home/results-1.json")
+        self.assertEquals([("KeystoneBasic.create_delete_user",
+                            [(100, 20, [("keystone.create_user", 5)])])],
+                          analysis.costs.read_iterations(self.tmp))
+
+
+class TestRallyResults(unittest.TestCase):
+
+    def test_merge(self):
+        def task(*timestamps):
+            return [{"key": {"name": "NovaServers.boot_and_delete_server", "pos": 0},
+                     "sla": [], "full_duration": 30,
+                     "result": [{"timestamp": t, "duration": 10} for t in timestamps]}]
+        [merged] = analysis.rally_results.merge([task(100, 110), task(101, 115)])
+        self.assertEquals([100, 101, 110, 115], [i["timestamp"] for i in merged["result"]])
+        self.assertEquals(25, merged["load_duration"])
+
+
+class TestLoadgen(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = engine.loadgen.Histogram()
+        for value in range(1, 100001):
+            histogram.record(value)
+        for p in [50, 99, 99.9]:
+            self.assertAlmostEquals(p * 1000, histogram.percentile(p), delta=p * 10)
+        self.assertEquals(100000, histogram.percentile(100))
+
+    def test_errors(self):
+        histogram = engine.loadgen.Histogram()
+        histogram.record(1000)
+        histogram.record(2000, error=True)
+        self.assertEquals((2, 1), (histogram.total, histogram.errors))
+
+    def test_schedule(self):
+        self.assertEquals(100, len(engine.loadgen.schedule(10, 10)))
+        dates = engine.loadgen.schedule(100, 100, poisson=True)
+        self.assertAlmostEquals(10000, len(dates), delta=300)
+        self.assertEquals(dates, sorted(dates))
+
+
+class TestTuning(unittest.TestCase):
+
+    def test_tune(self):
+        roles = {'control': ['big', 'small'], 'compute': ['small', 'unknown']}
+        facts = {'big': {'cores': 32, 'ram': 128 * 2 ** 30},
+                 'small': {'cores': 8, 'ram': 32 * 2 ** 30}}
+        kolla_vars, host_vars = engine.tuning.tune(roles, facts, {'haproxy_nbproc': 'cores // 8'})
+        self.assertEquals({'openstack_service_workers': 4}, kolla_vars)
+        self.assertEquals(['big', 'small'], sorted(host_vars.keys()))
+        self.assertEquals(1, host_vars['small']['tuning_haproxy_nbproc'])
+        self.assertEquals(4, host_vars['big']['tuning_haproxy_nbproc'])
+        # maxconn is per process
+        self.assertEquals(128 * 2 ** 20 // 8 // 34 // 4, host_vars['big']['tuning_haproxy_maxconn'])
+        self.assertEquals(32 * 1024, host_vars['big']['tuning_innodb_buffer_pool_size'])
+        self.assertEquals(host_vars['small']['tuning_haproxy_maxconn'] // 5,
+                          host_vars['small']['tuning_haproxy_service_maxconn'])
+
+
+class TestPrefetch(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache_dir = engine.prefetch.CACHE_DIR
+        engine.prefetch.CACHE_DIR = os.path.join(self.tmp, "cache")
+        self.upstream = os.path.join(self.tmp, "upstream")
+        self.git("init -q %s" % self.upstream)
+        self.commit("first")
+        self.git("-C %s checkout -q -b stable/newton" % self.upstream)
+
+    def tearDown(self):
+        engine.prefetch.CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.tmp)
+
+    def git(self, args):
+        self.assertEquals(0, subprocess.call(
+            "git -c user.name=test -c user.email=test@localhost " + args, shell=True))
+
+    def commit(self, message):
+        self.git("-C %s commit -q --allow-empty -m %s" % (self.upstream, message))
+
+    def test_clone_kolla(self):
+        engine.prefetch.fetch_kolla(self.upstream, "stable/newton")
+        # install-os runs after new commits were pushed
+        self.commit("second")
+        self.assertEquals(0, engine.prefetch.clone_kolla(self.upstream, "stable/newton", self.tmp))
+        kolla = os.path.join(self.tmp, "kolla")
+        log = subprocess.check_output(["git", "-C", kolla, "log", "--format=%s"])
+        self.assertEquals("second\nfirst\n", log)
+        self.assertEquals(self.upstream + "\n", subprocess.check_output(
+            ["git", "-C", kolla, "config", "remote.origin.url"]))
+
+
+class TestArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        log = os.path.join(self.tmp, "nova-api.log")
+        with open(log, "w") as f:
+            f.write("2016-11-02 12:34:56.306 3434 INFO nova.osapi_compute.wsgi.server\n"
+                    "2016-11-02 12:40:00.001 3434 INFO nova.osapi_compute.wsgi.server\n")
+        with tarfile.open(os.path.join(self.tmp, "control-1-kolla-logs.tar.gz"), "w:gz") as archive:
+            archive.add(log, "tmp/kolla-logs/nova/nova-api.log")
+        os.remove(log)
+        with open(os.path.join(self.tmp, "globals.yml"), "w") as f:
+            f.write("kolla_base_distro: centos\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_build(self):
+        analysis.archive.build(self.tmp)
+        archive_path = os.path.join(self.tmp, analysis.archive.ARCHIVE_NAME)
+        manifest = analysis.archive.read_manifest(archive_path)
+        self.assertEquals(["control-1/kolla-logs/tmp/kolla-logs/nova/nova-api.log",
+                           "result/globals.yml"], [e["name"] for e in manifest])
+        [log] = analysis.archive.find(manifest, host="control-1", path="nova-api")
+        self.assertEquals([1478090096, 1478090400], log["time_range"])
+        self.assertEquals(None, manifest[1]["time_range"])
+        output = StringIO.StringIO()
+        analysis.archive.copy_member(archive_path, log["name"], output)
+        self.assertEquals(log["size"], len(output.getvalue()))
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        logs = {
+            "nova/nova-api.log":
+            "2016-11-02 12:34:56.306 3434 INFO nova.osapi_compute.wsgi.server [req-11111111-2222-3333-4444-555555555555 admin admin - - -] 10.4.0.1 \"GET /v2.1/servers HTTP/1.1\" status: 200 len: 1893 time: 0.5000000\n"
+            "2016-11-02 12:35:10.120 3434 INFO nova.osapi_compute.wsgi.server [req-66666666-2222-3333-4444-555555555555 admin admin - - -] 10.4.0.1 \"POST /v2.1/servers HTTP/1.1\" status: 500 len: 120 time: 1.2500000\n"
+            "2016-11-02 12:35:20.001 3434 ERROR nova.api.openstack [req-66666666-2222-3333-4444-555555555555 admin admin - - -] Unexpected exception\n",
+            "keystone/keystone-apache-public-access.log":
+            "10.4.0.1 - - [02/Nov/2016:12:34:58 +0000] \"POST /v3/auth/tokens HTTP/1.1\" 201 1234 250000 \"-\" \"python-keystoneclient\"\n",
+            "mariadb/mariadb.log":
+            "161102 12:36:01 [ERROR] WSREP: gcs connect failed\n",
+            "heka/heka.log": "not indexed\n",
+        }
+        with tarfile.open(os.path.join(self.tmp, "control-1-kolla-logs.tar.gz"), "w:gz") as archive:
+            for name, content in logs.items():
+                self.add(archive, "tmp/kolla-logs/" + name, content)
+        with tarfile.open(os.path.join(self.tmp, "rally-1-rally.tar.gz"), "w:gz") as archive:
+            self.add(archive, "root/rally_home/scenarios.log",
+                     "1478090100 1478090159 keystone/create-user.yaml\n")
+
+    def add(self, archive, name, content):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        archive.addfile(info, StringIO.StringIO(content))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_classify(self):
+        self.assertEquals(("openstack", "nova-api"), analysis.logs.classify("nova/nova-api.log.1"))
+        self.assertEquals(("keystone-apache", "keystone-apache-public"),
+                          analysis.logs.classify("keystone/keystone-apache-public-access.log"))
+        self.assertEquals(("mariadb", "mariadb"), analysis.logs.classify("mariadb/mariadb.log"))
+        self.assertEquals(None, analysis.logs.classify("heka/heka.log"))
+
+    def test_index(self):
+        analysis.logs.build_index(self.tmp, processes=1)
+        db = analysis.logs.open_index(self.tmp)
+        slowest = analysis.logs.slowest_requests(db, "nova")
+        self.assertEquals([(1478090110, 1.25, 500, "POST", "/v2.1/servers",
+                            "req-66666666-2222-3333-4444-555555555555"),
+                           (1478090096, 0.5, 200, "GET", "/v2.1/servers",
+                            "req-11111111-2222-3333-4444-555555555555")], slowest)
+        self.assertEquals([(1478090098, 0.25, 201, "POST", "/v3/auth/tokens", None)],
+                          analysis.logs.slowest_requests(db, "keystone"))
+        self.assertEquals([(1478090100, "nova-api", 1), (1478090160, "mariadb", 1)],
+                          analysis.logs.errors_per_minute(db))
+        # only the minutes of the scenario
+        self.assertEquals([(1478090100, "nova-api", 1)],
+                          analysis.logs.errors_per_minute(db, "create-user"))
+        self.assertEquals(1, len(analysis.logs.slowest_requests(db, "nova", "create-user")))
+        lines = analysis.logs.request_lines(db, "req-66666666-2222-3333-4444-555555555555")
+        self.assertEquals(2, len(lines))
+        self.assertEquals("control-1", lines[1][0])
+        self.assertTrue(lines[1][2].endswith("Unexpected exception"))
+
+    def test_scenarios_of_several_rally_hosts(self):
+        with tarfile.open(os.path.join(self.tmp, "rally-2-rally.tar.gz"), "w:gz") as archive:
+            self.add(archive, "root/rally_home/scenarios.log",
+                     "1478090102 1478090170 keystone/create-user.yaml\n"
+                     "1478090300 1478090400 nova/boot.yaml\n")
+        self.assertEquals([("keystone/create-user.yaml", 1478090100, 1478090170),
+                           ("nova/boot.yaml", 1478090300, 1478090400)],
+                          analysis.logs.read_scenarios(self.tmp))
+
+
+class TestCampaign(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.config = {"inventory": self.inventory("a", "[control]\nnode-1\n"),
+                       "kolla": {"kolla_base_distro": "centos", "openstack_release": "3.0.0"},
+                       "patches": []}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def inventory(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_experiment_config(self):
+        config = kolla_g5k.experiment_config(self.config, {
+            "name": "release", "bench": "bench.yml", "patches": ["keystone"],
+            "kolla": {"openstack_release": "4.0.0"}})
+        self.assertEquals({"kolla_base_distro": "centos", "openstack_release": "4.0.0"},
+                          config["kolla"])
+        self.assertEquals(["keystone"], config["patches"])
+        self.assertNotIn("name", config)
+        self.assertNotIn("bench", config)
+        # the base config is left as is
+        self.assertEquals("3.0.0", self.config["kolla"]["openstack_release"])
+
+    def test_experiment_changes(self):
+        self.assertEquals("deploy", kolla_g5k.experiment_changes(None, self.config))
+        self.assertEquals(None, kolla_g5k.experiment_changes(self.config, dict(self.config)))
+        same_inventory = dict(self.config, inventory=self.inventory("b", "[control]\nnode-1\n"))
+        self.assertEquals(None, kolla_g5k.experiment_changes(self.config, same_inventory))
+        moved = dict(self.config, inventory=self.inventory("c", "[control]\nnode-2\n"))
+        self.assertEquals("deploy", kolla_g5k.experiment_changes(self.config, moved))
+        release = kolla_g5k.experiment_config(self.config, {"kolla": {"openstack_release": "4.0.0"}})
+        self.assertEquals("reconfigure", kolla_g5k.experiment_changes(self.config, release))
+        patched = kolla_g5k.experiment_config(self.config, {"patches": ["keystone"]})
+        self.assertEquals("reconfigure", kolla_g5k.experiment_changes(self.config, patched))
+
+
+class TestState(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_save_load(self):
+        engine.state.save(self.state_dir, {
+            "user": "discovery",
+            "nodes": engine.state.to_addresses({"control": [Host("a-1")]})
+        })
+        state = engine.state.load(self.state_dir)
+        self.assertEquals("discovery", state["user"])
+        self.assertEquals(["a-1"], state["nodes"]["control"])
+
+    def test_load_some_keys(self):
+        engine.state.save(self.state_dir, {"user": "discovery", "phase": "bench"})
+        self.assertEquals({"phase": "bench"}, engine.state.load(self.state_dir, ["phase"]))
+
+    def test_no_state(self):
+        self.assertEquals({}, engine.state.load(self.state_dir))
+
+    def test_wrong_type(self):
+        with self.assertRaises(TypeError):
+            engine.state.save(self.state_dir, {"nodes": []})
+
+class FakeG5kApiHandler(BaseHTTPRequestHandler):
+    "A local stand-in of the Grid'5000 reference API."
+    documents = {
+        "/sites": {"items": [{"uid": "rennes"}, {"uid": "nancy"}]},
+        "/sites/rennes/clusters": {"items": [{"uid": "paravance"}, {"uid": "parasilo"}]},
+        "/sites/nancy/clusters": {"items": [{"uid": "graphene"}]},
+        "/sites/rennes/clusters/paravance/nodes": {"items": [
+            {"uid": "paravance-1", "network_adapters": [
+                {"device": "eth0", "mountable": True},
+                {"device": "eth1", "mountable": True},
+                {"device": "ib0", "mountable": False}]}]}
+    }
+    paths = []
+
+    def do_GET(self):
+        FakeG5kApiHandler.paths.append(self.path)
+        # slow enough for concurrent requests to overlap
+        time.sleep(0.05)
+        document = self.documents.get(self.path)
+        if document is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(json.dumps(document))
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestG5kApi(unittest.TestCase):
+
+    def setUp(self):
+        FakeG5kApiHandler.paths = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeG5kApiHandler)
+        threading.Thread(target=self.server.serve_forever).start()
+        self.cache_dir = tempfile.mkdtemp()
+        self.base_uri = "http://127.0.0.1:%d" % self.server.server_address[1]
+        self.api = G5kApi(base_uri=self.base_uri, cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_cluster_site(self):
+        self.assertEquals("nancy", self.api.get_cluster_site("graphene"))
+        self.assertEquals("rennes", self.api.get_cluster_site("paravance"))
+        with self.assertRaises(ValueError):
+            self.api.get_cluster_site("unknown")
+        # one request per site and one for the list of sites
+        self.assertEquals(3, len(FakeG5kApiHandler.paths))
+
+    def test_cluster_nics(self):
+        self.assertEquals(["eth0", "eth1"], self.api.get_cluster_nics("paravance"))
+
+    def test_disk_cache(self):
+        self.api.get_cluster_nics("paravance")
+        requests = len(FakeG5kApiHandler.paths)
+        api = G5kApi(base_uri=self.base_uri, cache_dir=self.cache_dir)
+        self.assertEquals(["eth0", "eth1"], api.get_cluster_nics("paravance"))
+        self.assertEquals(requests, len(FakeG5kApiHandler.paths))
+
+    def test_expired_cache(self):
+        self.api.get_sites()
+        api = G5kApi(base_uri=self.base_uri, cache_dir=self.cache_dir, ttl=-1)
+        api.get_sites()
+        self.assertEquals(2, len(FakeG5kApiHandler.paths))
+
+    def test_in_flight_requests(self):
+        api = G5kApi(base_uri=self.base_uri, cache_dir=None)
+        sites = api.map(lambda _: api.get_sites(), range(4))
+        self.assertEquals([["rennes", "nancy"]] * 4, sites)
+        self.assertEquals(1, len(FakeG5kApiHandler.paths))
+
 if __name__ == '__main__':
     unittest.main()
 